@@ -0,0 +1,96 @@
+"""
+Benchmark del thread que manda los mensajes de chat de un cliente, comparando
+OutboundQueue (duerme hasta que puede mandar, con ventanas de 1 y `--window`
+mensajes sin confirmar) con el loop que revisaba la cola cada 100 us y mandaba
+de a un mensaje, como se hacia antes.
+
+El server es falso: responde cada mensaje despues de `--rtt` segundos. Se mide
+el CPU del proceso con el cliente inactivo (sin mensajes por mandar), y el CPU
+y el throughput mandando `--messages` mensajes.
+
+    python -m benchmarks.client_sender --idle 2 --messages 2000 --rtt 0.002
+"""
+from argparse import ArgumentParser
+from collections import deque
+from threading import Event, Thread, Timer
+from time import perf_counter, process_time, sleep
+
+from src.client.outbound import OutboundQueue
+
+
+class PollingQueue:
+    """El loop de antes: revisa la cola y los flags cada 100 us"""
+
+    def __init__(self, emit) -> None:
+        self.emit = emit
+        self.messages = deque()
+        self.send_next = False
+        self.paused = False
+
+    def put(self, message: dict):
+        self.messages.append(message)
+
+    def set_send_next(self, value: bool):
+        self.send_next = value
+
+    def run(self):
+        self.send_next = True
+        while True:
+            if self.messages and self.send_next and not self.paused:
+                self.send_next = False
+                msg = self.messages.popleft()
+                self.emit(msg, lambda response=None: self.set_send_next(True))
+            sleep(1e-4)
+
+
+def run(outbound_factory, idle: float, messages: int, rtt: float):
+    """(CPU s por s inactivo, CPU ms por mensaje, mensajes/s)"""
+    acked = Event()
+    count = [0]
+
+    def respond(callback):
+        callback({"status": "ok"})
+        count[0] += 1
+        if count[0] == messages:
+            acked.set()
+
+    def emit(msg, callback):
+        if rtt:
+            Timer(rtt, respond, [callback]).start()
+        else:
+            respond(callback)
+
+    outbound = outbound_factory(emit)
+    Thread(target=outbound.run, daemon=True).start()
+
+    cpu = process_time()
+    sleep(idle)
+    idle_cpu = (process_time() - cpu) / idle
+
+    cpu, start = process_time(), perf_counter()
+    for i in range(messages):
+        outbound.put({"message": str(i)})
+    acked.wait()
+    busy_cpu = (process_time() - cpu) / messages
+    return idle_cpu, busy_cpu * 1e3, messages / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--idle", type=float, default=2, help="Seconds to measure the idle client")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--rtt", type=float, default=0, help="Server response time (s)")
+    parser.add_argument("--window", type=int, default=8, help="Unacknowledged messages allowed")
+    args = parser.parse_args()
+
+    print(f"idle={args.idle}s messages={args.messages} rtt={args.rtt * 1e3:.1f}ms")
+    print(f"{'sender':>10} {'idle CPU %':>11} {'CPU ms/msg':>11} {'msgs/s':>10}")
+    senders = [
+        ("window-1", lambda emit: OutboundQueue(emit, window=1)),
+        (f"window-{args.window}", lambda emit: OutboundQueue(emit, window=args.window)),
+        # Los threads que mandan nunca terminan, por lo que el que hace polling va al final
+        ("polling", PollingQueue),
+    ]
+    for name, outbound_factory in senders:
+        idle_cpu, busy_cpu, throughput = run(outbound_factory, args.idle, args.messages, args.rtt)
+        print(f"{name:>10} {idle_cpu * 100:>11.1f} {busy_cpu:>11.3f} {throughput:>10.0f}")
@@ -0,0 +1,128 @@
+"""
+Benchmark del tiempo total de una migracion en localhost, y de cada una de sus fases.
+
+Levanta un DNS y un servidor, conecta un cliente que al recibir server_start levanta
+el nuevo servidor (igual que start_server, retorna antes de que este escuchando) y
+comienza la migracion con trigger_migration. Opcionalmente otro cliente manda mensajes
+durante la migracion. Con el modo standby, antes de migrar se levanta un servidor
+standby, y la migracion lo toma en vez de pedirle al cliente que levante uno.
+
+    python -m benchmarks.migration --runs 3 --rate 100 --modes spawn standby
+"""
+from argparse import ArgumentParser
+from statistics import mean
+from threading import Event, Thread
+from time import perf_counter, sleep
+
+from socketio import Client
+
+from src.server.MigrationMiddleware import PHASE_DEADLINES
+from src.utils.networking import free_port, request_standbys
+
+from .quorum_cluster import Cluster, metrics_of
+
+PHASES = list(PHASE_DEADLINES)
+
+
+def chat_load(addr: str, rate: float, stop: Event):
+    client = Client(reconnection=False)
+    client.connect(addr, auth={"username": "load", "publicUri": "http://127.0.0.1:2", "reconnecting": False})
+    paused = Event()
+    client.on("pause_messaging", lambda pause: paused.set() if pause else paused.clear())
+
+    i = 0
+    while not stop.is_set():
+        if not paused.is_set():
+            client.emit("chat", {"message": str(i)})
+            i += 1
+        sleep(1 / rate)
+    client.disconnect()
+
+
+def start_standby(cluster: Cluster, timeout: float = 30):
+    port = free_port()
+    cluster.spawn(
+        "server.py",
+        *("--dns_ip", cluster.host, "--dns_port", cluster.dns_port),
+        *("--server_ip", cluster.host, "--server_port", port, "--standby"),
+    )
+
+    deadline = perf_counter() + timeout
+    while f"http://{cluster.host}:{port}" not in request_standbys(cluster.host, cluster.dns_port, "backend.com"):
+        if perf_counter() > deadline:
+            raise TimeoutError("Standby server did not register")
+        sleep(0.1)
+    return f"http://{cluster.host}:{port}"
+
+
+def run(rate: float, standby: bool) -> dict:
+    cluster = Cluster(1, 64, server_args=("--migration_interval", 3600))
+    new_addr = []
+    reconnected = Event()
+
+    def on_server_start(*_):
+        port = free_port()
+        cluster.spawn(
+            "server.py",
+            *("--dns_ip", cluster.host, "--dns_port", cluster.dns_port),
+            *("--server_ip", cluster.host, "--server_port", port, "--migrating"),
+        )
+        new_addr.append(f"http://{cluster.host}:{port}")
+        return {"ip": cluster.host, "port": port}
+
+    # El server original termina al migrar, por lo que ningun cliente tiene a que reconectarse
+    owner = Client(reconnection=False)
+    owner.on("server_start", on_server_start)
+    owner.on("reconnect", lambda *_: reconnected.set())
+
+    stop = Event()
+    trigger = Client(reconnection=False)
+    try:
+        owner.connect(
+            cluster.addrs[0], auth={"username": "owner", "publicUri": "http://127.0.0.1:1", "reconnecting": False}
+        )
+        if standby:
+            new_addr.append(start_standby(cluster))
+        if rate > 0:
+            Thread(target=chat_load, args=[cluster.addrs[0], rate, stop], daemon=True).start()
+            sleep(2)
+
+        trigger.connect(cluster.addrs[0], auth={"dns_polling": True})
+
+        start = perf_counter()
+        trigger.call("trigger_migration", {})
+        if not reconnected.wait(sum(PHASE_DEADLINES.values())):
+            raise TimeoutError("Migration did not finish")
+        elapsed = perf_counter() - start
+
+        stop.set()
+        sleep(1)
+        metrics = metrics_of(new_addr[-1])
+        return {"end_to_end": elapsed, **metrics}
+    finally:
+        stop.set()
+        trigger.disconnect()
+        owner.disconnect()
+        cluster.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=100, help="Chat messages per second during the migration")
+    parser.add_argument("--modes", nargs="+", choices=["spawn", "standby"], default=["spawn", "standby"])
+    args = parser.parse_args()
+
+    columns = ["end_to_end", *(f"migration.{phase}_seconds" for phase in PHASES), "migration.pause_seconds"]
+    names = ["total", *PHASES, "pause"]
+    print(f"{'mode':>10} " + " ".join(f"{name:>10}" for name in names) + " (ms)")
+
+    for mode in args.modes:
+        results = []
+        for _ in range(args.runs):
+            result = run(args.rate, mode == "standby")
+            results.append(result)
+            print(f"{mode:>10} " + " ".join(f"{result.get(column, 0) * 1e3:>10.1f}" for column in columns))
+
+        means = " ".join(f"{mean(r.get(column, 0) for r in results) * 1e3:>10.1f}" for column in columns)
+        print(f"{'mean':>10} {means}")
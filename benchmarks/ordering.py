@@ -0,0 +1,69 @@
+"""
+Benchmark que compara las formas de ordenar mensajes entre dos replicas: indices
+arrendados (uno a la vez o en bloques) y stamps de un reloj logico hibrido.
+
+Igual que benchmarks.replication_leasing, las replicas se conectan con un cliente
+falso que simula la latencia de red.
+
+    python -m benchmarks.ordering --rtt 0.002 --threads 4 --messages 2000
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from statistics import quantiles
+from threading import Lock, Thread
+from time import perf_counter
+
+from src.server.ReplicationMiddleware import HLC, LEASES, ReplicationMiddleware
+
+from .replication_leasing import make_pair
+
+SCHEMES = [(LEASES, 0), (LEASES, 64), (HLC, 0)]
+
+
+def run(ordering: str, lease_size: int, threads: int, messages: int, rtt: float, send_cost: float, writers: int):
+    servers = make_pair(lease_size, rtt, send_cost, ordering)
+    indexes = []
+    latencies = []
+    lock = Lock()
+
+    def worker(server: ReplicationMiddleware, n: int):
+        for i in range(n):
+            data = {"message": str(i), "client_name": "bench", "room": "general"}
+            start = perf_counter()
+            result = server.get_handler("chat")("sid", data)
+            latency = perf_counter() - start
+            with lock:
+                indexes.append(result["message_index"])
+                latencies.append(latency)
+
+    workers = [Thread(target=worker, args=[servers[i % writers], messages // threads]) for i in range(threads)]
+
+    start = perf_counter()
+    for th in workers:
+        th.start()
+    for th in workers:
+        th.join()
+    elapsed = perf_counter() - start
+
+    duplicated = sum(count - 1 for count in Counter(indexes).values() if count > 1)
+    percentiles = quantiles(latencies, n=100)
+    return len(indexes) / elapsed, percentiles[49], percentiles[98], duplicated
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rtt", type=float, default=0.002, help="Round-trip time between replicas (s)")
+    parser.add_argument("--send_cost", type=float, default=0.0002, help="Time to write an emit (s)")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"rtt={args.rtt * 1e3:.1f}ms send_cost={args.send_cost * 1e3:.2f}ms threads={args.threads}")
+    print(f"{'writers':>8} {'ordering':>10} {'msgs/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'duplicated':>10}")
+    for writers in (1, 2):
+        for ordering, lease_size in SCHEMES:
+            name = f"{ordering}-{lease_size}" if ordering == LEASES else ordering
+            throughput, p50, p99, duplicated = run(
+                ordering, lease_size, args.threads, args.messages, args.rtt, args.send_cost, writers
+            )
+            print(f"{writers:>8} {name:>10} {throughput:>10.0f} {p50 * 1e3:>8.2f} {p99 * 1e3:>8.2f} {duplicated:>10}")
@@ -0,0 +1,131 @@
+"""
+Benchmark de la latencia de commit de un mensaje segun la cantidad de replicas.
+
+Levanta localmente un DNS y N servidores (cada uno en su propio proceso), conecta
+un cliente a uno de ellos y mide cuanto tarda en confirmarse cada mensaje de chat.
+Con lease_size 0 cada mensaje espera a que una mayoria acepte su indice.
+
+    python -m benchmarks.quorum_cluster --replicas 1 2 3 5 --messages 200
+"""
+import socket
+import subprocess
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from statistics import mean, quantiles
+from time import monotonic, perf_counter, sleep
+from typing import List
+
+from socketio import Client
+
+from src.utils.networking import free_port
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def metrics_of(addr: str, timeout: float = 2) -> dict:
+    client = Client()
+    try:
+        client.connect(addr, auth={"dns_polling": True})
+        return client.call("metrics", {}, timeout=timeout)
+    finally:
+        client.disconnect()
+
+
+def wait_for_cluster(addrs: List[str], size: int, timeout: float = 30):
+    """Espera a que cada servidor vea a todas las demas replicas conectadas"""
+    deadline = monotonic() + timeout
+    for addr in addrs:
+        while True:
+            try:
+                metrics = metrics_of(addr)
+                if size == 1 or metrics.get("replication.connected_replicas") == size - 1:
+                    break
+            except Exception:
+                pass
+            if monotonic() > deadline:
+                raise TimeoutError(f"{addr} did not join the cluster")
+            sleep(0.2)
+
+
+class Cluster:
+    def __init__(
+        self, replicas: int, lease_size: int, ordering: str = "lease", server_args=(), max_servers: int = None
+    ) -> None:
+        self.host = socket.gethostbyname(socket.gethostname())
+        self.dns_port = free_port()
+        self.processes: List[subprocess.Popen] = []
+        self.addrs: List[str] = []
+
+        self.spawn("dns.py", "--port", self.dns_port, "--max_servers", max_servers or replicas)
+        sleep(1)
+
+        # Los servidores se levantan de a uno, para que cada uno se conecte a los anteriores
+        for i in range(replicas):
+            port = free_port()
+            self.spawn(
+                "server.py",
+                *("--dns_ip", self.host, "--dns_port", self.dns_port),
+                *("--server_ip", self.host, "--server_port", port),
+                *("--lease_size", lease_size, "--ordering", ordering),
+                *server_args,
+            )
+            self.addrs.append(f"http://{self.host}:{port}")
+            wait_for_cluster(self.addrs, i + 1)
+
+    def spawn(self, script: str, *args):
+        self.processes.append(
+            subprocess.Popen(
+                [sys.executable, script, *map(str, args)],
+                cwd=ROOT,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        )
+
+    def close(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+
+
+def run(replicas: int, lease_size: int, messages: int, ordering: str = "lease") -> List[float]:
+    cluster = Cluster(replicas, lease_size, ordering)
+    client = Client()
+    try:
+        client.connect(
+            cluster.addrs[0],
+            auth={"username": "bench", "publicUri": "http://127.0.0.1:1", "reconnecting": False},
+        )
+
+        latencies = []
+        for i in range(messages):
+            start = perf_counter()
+            client.call("chat", {"message": str(i)}, timeout=10)
+            latencies.append(perf_counter() - start)
+        return latencies
+    finally:
+        client.disconnect()
+        cluster.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 3, 5])
+    parser.add_argument("--lease_sizes", type=int, nargs="+", default=[0, 64])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--ordering", choices=["lease", "hlc"], default="lease")
+    args = parser.parse_args()
+
+    print(f"ordering={args.ordering}")
+    print(f"{'replicas':>8} {'lease_size':>10} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for lease_size in args.lease_sizes:
+        for replicas in args.replicas:
+            latencies = run(replicas, lease_size, args.messages, args.ordering)
+            percentiles = quantiles(latencies, n=100)
+            print(
+                f"{replicas:>8} {lease_size:>10} {mean(latencies) * 1e3:>8.2f}"
+                f" {percentiles[49] * 1e3:>8.2f} {percentiles[98] * 1e3:>8.2f}"
+            )
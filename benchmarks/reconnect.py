@@ -0,0 +1,101 @@
+"""
+Benchmark de la reconexion de los clientes al nuevo server despues de una migracion.
+
+Levanta un DNS, un servidor y un standby, conecta N clientes y migra. Cada cliente,
+al recibir reconnect, espera el delay que le asigno el server y se conecta al nuevo
+server con su token (o sin el, con --no_resume, como un connect completo). Se mide
+cuanto tardan en reconectarse todos, la latencia de cada connect y cuantas
+sesiones se retomaron.
+
+    python -m benchmarks.reconnect --clients 100 --windows 0 1
+"""
+from argparse import ArgumentParser
+from statistics import quantiles
+from threading import Event, Lock
+from time import perf_counter, sleep
+from typing import List
+
+from socketio import Client
+
+from .migration import start_standby
+from .quorum_cluster import Cluster, metrics_of
+
+
+class ReconnectingClient:
+    def __init__(self, name: str, addr: str, resume: bool, done) -> None:
+        self.name = name
+        self.resume = resume
+        self.done = done
+        self.client = Client(reconnection=False)
+        self.client.on("reconnect", self.on_reconnect)
+        self.client.connect(addr, auth=self.auth())
+
+    def auth(self, token: str = None) -> dict:
+        auth = {"username": self.name, "publicUri": "http://127.0.0.1:1", "reconnecting": token is not None}
+        if token and self.resume:
+            auth["resume"] = token
+        return auth
+
+    def on_reconnect(self, data: dict):
+        self.client.start_background_task(self.reconnect, data)
+
+    def reconnect(self, data: dict):
+        sleep(data["delay"])
+        self.client.disconnect()
+        self.client = Client(reconnection=False)
+        start = perf_counter()
+        self.client.connect(data["addr"], auth=self.auth(data["token"]))
+        self.done(start, perf_counter())
+
+
+def run(clients: int, window: float, resume: bool) -> dict:
+    cluster = Cluster(1, 64, server_args=("--migration_interval", 3600, "--reconnect_window", window))
+    new_addr = start_standby(cluster)
+
+    lock = Lock()
+    connects: List[tuple] = []
+    all_done = Event()
+
+    def done(start: float, end: float):
+        with lock:
+            connects.append((start, end))
+            if len(connects) == clients:
+                all_done.set()
+
+    users = [ReconnectingClient(f"user{i}", cluster.addrs[0], resume, done) for i in range(clients)]
+    try:
+        trigger = Client()
+        trigger.connect(cluster.addrs[0], auth={"dns_polling": True})
+        start = perf_counter()
+        trigger.call("trigger_migration", {})
+        if not all_done.wait(60):
+            raise TimeoutError(f"Only {len(connects)} clients reconnected")
+
+        latencies = [end - begin for begin, end in connects]
+        metrics = metrics_of(new_addr)
+        return {
+            "all_reconnected": max(end for _, end in connects) - start,
+            "p50": quantiles(latencies, n=100)[49],
+            "p99": quantiles(latencies, n=100)[98],
+            "resumed": metrics.get("sessions.resumed", 0),
+        }
+    finally:
+        for user in users:
+            user.client.disconnect()
+        cluster.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 1])
+    parser.add_argument("--no_resume", action="store_true", help="Reconnect with a full connect")
+    args = parser.parse_args()
+
+    print(f"{'window':>6} {'all ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'resumed':>8}")
+    for window in args.windows:
+        result = run(args.clients, window, not args.no_resume)
+        print(
+            f"{window:>6} {result['all_reconnected'] * 1e3:>8.1f} {result['p50'] * 1e3:>8.1f}"
+            f" {result['p99'] * 1e3:>8.1f} {result['resumed']:>8}"
+        )
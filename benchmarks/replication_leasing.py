@@ -0,0 +1,128 @@
+"""
+Benchmark de asignacion de indices entre dos replicas, segun el tamaño de los bloques arrendados
+(lease_size 0 arrienda un indice a la vez).
+
+Las dos instancias de ReplicationMiddleware se conectan con un cliente falso que
+simula la latencia de red, por lo que no se necesita levantar servidores.
+
+    python -m benchmarks.replication_leasing --rtt 0.002 --threads 4 --messages 2000
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from threading import Thread, Timer
+from time import perf_counter, sleep
+
+from src.server.ReplicationMiddleware import LEASES, ReplicationMiddleware
+from src.server.Users import UserList
+from src.utils.Metrics import Metrics
+
+
+class FakeSocketio:
+    def start_background_task(self, target, *args):
+        th = Thread(target=target, args=args, daemon=True)
+        th.start()
+        return th
+
+    def emit(self, *args, **kwargs):
+        pass
+
+
+class FakeMainServer:
+    def __init__(self, addr: str) -> None:
+        self.addr = addr
+        self.standby = False
+        self.metrics = Metrics()
+        self.middleware: ReplicationMiddleware = None
+
+    def handle(self, event: str, sid: str, data):
+        return self.middleware.handle(event, sid, data)
+
+
+class FakeReplicaClient:
+    """Cliente socketio hacia la otra replica. Cada emit cuesta send_cost y la respuesta tarda rtt"""
+
+    def __init__(self, rtt: float, send_cost: float) -> None:
+        self.peer: ReplicationMiddleware = None
+        self.rtt = rtt
+        self.send_cost = send_cost
+        self.connected = True
+
+    def emit(self, event, data=None, callback=None):
+        sleep(self.send_cost)
+
+        def deliver():
+            result = self.peer.get_handler(event)("replica", dict(data))
+            if isinstance(result, tuple):
+                result = result[1]
+            if callback:
+                Timer(self.rtt / 2, callback, [result]).start()
+
+        Timer(self.rtt / 2, deliver).start()
+
+    def disconnect(self):
+        self.connected = False
+
+
+class BenchReplicationMiddleware(ReplicationMiddleware):
+    def connect_replica(self):
+        pass
+
+
+def make_pair(lease_size: int, rtt: float, send_cost: float, ordering: str = LEASES):
+    servers = []
+    for i in range(2):
+        main_server = FakeMainServer(f"server-{i}")
+        main_server.middleware = BenchReplicationMiddleware(
+            UserList(), FakeSocketio(), main_server=main_server, lease_size=lease_size, ordering=ordering
+        )
+        servers.append(main_server.middleware)
+
+    for server, peer in zip(servers, reversed(servers)):
+        client = FakeReplicaClient(rtt, send_cost)
+        client.peer = peer
+        server.attach_replica(peer.main_server.addr, client)
+        # Las replicas se conectan aqui y no desde el DNS
+        server.ready.set()
+    return servers
+
+
+def run(lease_size: int, threads: int, messages: int, rtt: float, send_cost: float, writers: int):
+    servers = make_pair(lease_size, rtt, send_cost)
+    indexes = []
+
+    def worker(server: ReplicationMiddleware, n: int):
+        for i in range(n):
+            data = {"message": str(i), "client_name": "bench", "room": "general"}
+            result = server.get_handler("chat")("sid", data)
+            indexes.append(result["message_index"])
+
+    workers = [Thread(target=worker, args=[servers[i % writers], messages // threads]) for i in range(threads)]
+
+    start = perf_counter()
+    for th in workers:
+        th.start()
+    for th in workers:
+        th.join()
+    elapsed = perf_counter() - start
+
+    duplicated = sum(count - 1 for count in Counter(indexes).values() if count > 1)
+    return len(indexes) / elapsed, duplicated
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rtt", type=float, default=0.002, help="Round-trip time between replicas (s)")
+    parser.add_argument("--send_cost", type=float, default=0.0002, help="Time to write an emit (s)")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--lease_sizes", type=int, nargs="+", default=[0, 16, 64, 256])
+    args = parser.parse_args()
+
+    print(f"rtt={args.rtt * 1e3:.1f}ms send_cost={args.send_cost * 1e3:.2f}ms threads={args.threads}")
+    print(f"{'writers':>8} {'lease_size':>10} {'msgs/s':>10} {'duplicated indexes':>20}")
+    # writers=1: todos los clientes en una replica. writers=2: ambas replicas escriben en la misma sala,
+    # por lo que cada mensaje de la otra replica descarta lo que queda del bloque actual
+    for writers in (1, 2):
+        for lease_size in args.lease_sizes:
+            throughput, duplicated = run(lease_size, args.threads, args.messages, args.rtt, args.send_cost, writers)
+            print(f"{writers:>8} {lease_size:>10} {throughput:>10.0f} {duplicated:>20}")
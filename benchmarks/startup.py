@@ -0,0 +1,67 @@
+"""
+Benchmark del tiempo de inicio de server.py.
+
+Levanta localmente un DNS y un primer servidor, y luego mide varias veces cuanto
+tarda un segundo servidor (replica del primero) desde que se crea su proceso
+hasta que atiende eventos, y cuanto tarda cada etapa del inicio segun sus metricas.
+
+    python -m benchmarks.startup --runs 5
+"""
+from argparse import ArgumentParser
+from statistics import median
+from time import monotonic, perf_counter, sleep
+from typing import Dict
+
+from benchmarks.quorum_cluster import Cluster, metrics_of
+from src.utils.networking import free_port
+
+STAGES = ["imports", "address", "bind", "dns", "middlewares", "events", "total"]
+
+
+def wait_serving(addr: str, timeout: float = 30) -> dict:
+    deadline = monotonic() + timeout
+    while True:
+        try:
+            return metrics_of(addr)
+        except Exception:
+            if monotonic() > deadline:
+                raise TimeoutError(f"{addr} did not start")
+            sleep(0.01)
+
+
+def run() -> Dict[str, float]:
+    cluster = Cluster(1, lease_size=64, max_servers=2)
+    try:
+        port = free_port()
+        addr = f"http://{cluster.host}:{port}"
+        start = perf_counter()
+        cluster.spawn(
+            "server.py",
+            *("--dns_ip", cluster.host, "--dns_port", cluster.dns_port),
+            *("--server_ip", cluster.host, "--server_port", port),
+        )
+        metrics = wait_serving(addr)
+        result = {"serving": perf_counter() - start}
+
+        # La conexion a las replicas termina despues de que el server ya atiende
+        while "startup.replicas_ready_seconds" not in metrics:
+            sleep(0.05)
+            metrics = metrics_of(addr)
+
+        for stage in STAGES:
+            result[stage] = metrics[f"startup.{stage}_seconds"]
+        result["replicas_ready"] = metrics["startup.replicas_ready_seconds"]
+        return result
+    finally:
+        cluster.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [run() for _ in range(args.runs)]
+    print(f"{'stage':>15} {'median ms':>10}")
+    for stage in ["serving", *STAGES, "replicas_ready"]:
+        print(f"{stage:>15} {median(r[stage] for r in results) * 1e3:>10.1f}")
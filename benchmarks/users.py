@@ -0,0 +1,59 @@
+"""
+Benchmark de las busquedas en UserList por nombre y por uuid, comparando los
+indices con el recorrido lineal que se hacia antes.
+
+    python -m benchmarks.users --users 100000 --lookups 1000
+"""
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+
+from src.server.Users import UserList
+
+
+def scan_by_name(users: UserList, name: str):
+    for value in users.users.values():
+        if value.name.upper() == name.upper():
+            return value
+    return None
+
+
+def scan_by_uuid(users: UserList, uuid: str):
+    for value in users.users.values():
+        if value.uuid == uuid:
+            return value
+    return None
+
+
+def timed(lookup, keys) -> float:
+    """Microsegundos por busqueda"""
+    start = perf_counter()
+    for key in keys:
+        lookup(key)
+    return (perf_counter() - start) / len(keys) * 1e6
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    users = UserList()
+    start = perf_counter()
+    for i in range(args.users):
+        users.add_user(f"user{i}", f"sid{i}", f"uri{i}", False)
+    print(f"add_user: {(perf_counter() - start) / args.users * 1e6:.2f} us/user ({args.users} users)")
+
+    random = Random(0)
+    sample = [users.users[f"sid{random.randrange(args.users)}"] for _ in range(args.lookups)]
+    names = [user.name.upper() for user in sample]
+    uuids = [user.uuid for user in sample]
+
+    print(f"{'lookup':>8} {'scan us':>10} {'index us':>10}")
+    for kind, scan, index, keys in (
+        ("name", scan_by_name, users.get_user_by_name, names),
+        ("uuid", scan_by_uuid, users.get_user_by_uuid, uuids),
+    ):
+        scan_us = timed(lambda key: scan(users, key), keys)
+        print(f"{kind:>8} {scan_us:>10.2f} {timed(index, keys):>10.2f}")
@@ -0,0 +1,94 @@
+"""
+Benchmark de VectorClock con mensajes muy desordenados: cada emisor manda sus
+mensajes en bloques de tamaño `--window`, y dentro de cada bloque llegan en orden
+aleatorio (con `--window` igual a `--messages`, todo llega desordenado). Compara el
+buffer de mensajes atrasados con heaps por emisor con una lista que se recorre
+completa después de cada entrega, como se hacia antes.
+
+    python -m benchmarks.vector_clock --senders 4 --messages 5000
+"""
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+from typing import Callable, List
+
+from src.utils.vectorClock import MESSAGE_COUNT, SENDER_ID, VectorClock
+
+
+class ListBuffer:
+    """Entrega en orden por emisor con una lista de mensajes atrasados"""
+
+    def __init__(self, onDeliverMessage: Callable[[dict], None]) -> None:
+        self.received_messages = {}
+        self.delayed_messages = []
+        self.onDeliverMessage = onDeliverMessage
+
+    def should_delay(self, message: dict) -> bool:
+        return message[MESSAGE_COUNT] - 1 > self.received_messages.get(message[SENDER_ID], 0)
+
+    def deliver(self, message: dict):
+        self.received_messages[message[SENDER_ID]] = message[MESSAGE_COUNT]
+        self.onDeliverMessage(message)
+
+    def receive_message(self, message: dict):
+        if self.should_delay(message):
+            self.delayed_messages.append(message)
+            return
+
+        self.deliver(message)
+        delivered = True
+        while delivered:
+            delivered = False
+            for i, delayed in enumerate(self.delayed_messages):
+                if not self.should_delay(delayed):
+                    self.delayed_messages.pop(i)
+                    self.deliver(delayed)
+                    delivered = True
+                    break
+
+
+def arrivals(senders: int, messages: int, window: int, seed: int = 0) -> List[dict]:
+    random = Random(seed)
+    streams = []
+    for sender in range(senders):
+        clock = VectorClock(str(sender), lambda m: None)
+        stream = [clock.send_message(str(i), "dest") for i in range(messages)]
+        for start in range(0, messages, window):
+            block = stream[start : start + window]
+            random.shuffle(block)
+            stream[start : start + window] = block
+        streams.append(stream)
+
+    # Los emisores se intercalan
+    return [stream[i] for i in range(messages) for stream in streams]
+
+
+def run(receiver_factory, messages: List[dict]) -> float:
+    delivered = []
+    receiver = receiver_factory(delivered.append)
+    start = perf_counter()
+    for message in messages:
+        receiver.receive_message(message)
+    elapsed = perf_counter() - start
+    assert len(delivered) == len(messages)
+    for sender in {message[SENDER_ID] for message in delivered}:
+        counts = [message[MESSAGE_COUNT] for message in delivered if message[SENDER_ID] == sender]
+        assert counts == sorted(counts), f"messages from {sender} delivered out of order"
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--senders", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=5000, help="Messages per sender")
+    args = parser.parse_args()
+
+    total = args.senders * args.messages
+    print(f"senders={args.senders} messages={total}")
+    print(f"{'window':>8} {'list ms':>10} {'heap ms':>10}")
+    for window in (1, 10, 100, 1000, args.messages):
+        messages = arrivals(args.senders, args.messages, window)
+        list_ms = run(ListBuffer, messages) * 1e3
+        # Sin limite de mensajes atrasados, para que se entreguen todos como con la lista
+        heap_ms = run(lambda deliver: VectorClock("dest", deliver, max_delayed=len(messages)), messages) * 1e3
+        print(f"{window:>8} {list_ms:>10.1f} {heap_ms:>10.1f}")
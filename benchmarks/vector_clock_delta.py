@@ -0,0 +1,56 @@
+"""
+Benchmark del tamaño de los relojes que se mandan con cada mensaje cuando hay
+muchos peers: el reloj completo (dump) contra solo las entradas que cambiaron
+desde el ultimo intercambio con ese peer (dump_delta), ambos en JSON.
+
+Un nodo que ya intercambio mensajes (y su reloj) con todos los peers le manda
+mensajes a peers al azar, y recibe uno de otro peer al azar por cada uno que
+manda. El primer delta a cada peer, que lleva el reloj completo y los nombres
+de los peers, no se cuenta.
+
+    python -m benchmarks.vector_clock_delta --messages 2000
+"""
+import json
+from argparse import ArgumentParser
+from random import Random
+
+from src.utils.vectorClock import MESSAGE, MESSAGE_COUNT, SENDER_ID, VectorClock
+
+
+def size(data) -> int:
+    return len(json.dumps(data, separators=(",", ":")))
+
+
+def run(peers: int, messages: int, seed: int = 0):
+    """Bytes promedio por mensaje: (reloj completo, delta)"""
+    random = Random(seed)
+    names = [f"peer-{i}" for i in range(peers)]
+    node = VectorClock("node", lambda m: None).load_from({name: 1 for name in names}, {name: 1 for name in names})
+    received = {name: 1 for name in names}
+    for name in names:
+        node.dump_delta(name)
+
+    full = delta = 0
+    for _ in range(messages):
+        dest = random.choice(names)
+        node.send_message("hi", dest)
+        full += size(node.dump())
+        delta += size(node.dump_delta(dest))
+
+        sender = random.choice(names)
+        received[sender] += 1
+        node.receive_message({MESSAGE: "hi", MESSAGE_COUNT: received[sender], SENDER_ID: sender})
+
+    return full / messages, delta / messages
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"messages={args.messages}")
+    print(f"{'peers':>8} {'full B/msg':>12} {'delta B/msg':>12}")
+    for peers in (10, 100, 1000, 5000):
+        full, delta = run(peers, args.messages)
+        print(f"{peers:>8} {full:>12.0f} {delta:>12.0f}")
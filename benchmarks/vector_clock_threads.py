@@ -0,0 +1,74 @@
+"""
+Prueba de carga de VectorClock con varios threads: cada thread es un emisor
+distinto que le entrega sus mensajes, desordenados en bloques de `--window`, al
+mismo reloj receptor. Mide el throughput según la cantidad de threads y verifica
+que no se pierdan mensajes y que cada emisor se entregue en orden.
+
+    python -m benchmarks.vector_clock_threads --messages 20000 --window 16
+"""
+from argparse import ArgumentParser
+from random import Random
+from threading import Barrier, Lock, Thread
+from time import perf_counter
+from typing import Dict, List
+
+from src.utils.vectorClock import MESSAGE_COUNT, SENDER_ID, VectorClock
+
+
+def sender_stream(sender: str, messages: int, window: int) -> List[dict]:
+    clock = VectorClock(sender, lambda m: None)
+    stream = [clock.send_message(str(i), "dest") for i in range(messages)]
+    random = Random(sender)
+    for start in range(0, messages, window):
+        block = stream[start : start + window]
+        random.shuffle(block)
+        stream[start : start + window] = block
+    return stream
+
+
+def run(threads: int, messages: int, window: int) -> float:
+    """Mensajes entregados por segundo"""
+    delivered: Dict[str, List[int]] = {}
+    delivered_lock = Lock()
+
+    def deliver(message: dict):
+        with delivered_lock:
+            delivered.setdefault(message[SENDER_ID], []).append(message[MESSAGE_COUNT])
+
+    receiver = VectorClock("dest", deliver)
+    streams = [sender_stream(f"sender{i}", messages // threads, window) for i in range(threads)]
+    barrier = Barrier(threads + 1)
+
+    def worker(stream: List[dict]):
+        barrier.wait()
+        for message in stream:
+            receiver.receive_message(message)
+
+    workers = [Thread(target=worker, args=[stream]) for stream in streams]
+    for th in workers:
+        th.start()
+    barrier.wait()
+    start = perf_counter()
+    for th in workers:
+        th.join()
+    elapsed = perf_counter() - start
+
+    total = sum(len(stream) for stream in streams)
+    assert sum(len(counts) for counts in delivered.values()) == total, "messages were lost"
+    for sender, counts in delivered.items():
+        assert counts == list(range(1, len(counts) + 1)), f"messages from {sender} delivered out of order"
+    return total / elapsed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000, help="Messages in total, split between threads")
+    parser.add_argument(
+        "--window", type=int, default=16, help="Each sender shuffles its messages in blocks of this size"
+    )
+    args = parser.parse_args()
+
+    print(f"messages={args.messages} window={args.window}")
+    print(f"{'threads':>8} {'msgs/s':>10}")
+    for threads in (1, 2, 4, 8, 16):
+        print(f"{threads:>8} {run(threads, args.messages, args.window):>10.0f}")
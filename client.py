@@ -26,9 +26,29 @@ parser.add_argument(
     help="Server URI",
     type=str,
 )
+parser.add_argument(
+    "-r",
+    "--room",
+    default="general",
+    help="Chat room to join",
+    type=str,
+)
+parser.add_argument(
+    "-w",
+    "--window",
+    default=8,
+    help="Chat messages that can be sent before the server acknowledges them",
+    type=int,
+)
+parser.add_argument(
+    "--history_dir",
+    default=".chat_history",
+    help="Directory where the received messages are cached between sessions",
+    type=str,
+)
 
 if __name__ == "__main__":
     args = parser.parse_args()
 
-    client = ClientSockets(args.dns_ip, args.dns_port, args.server_uri)
+    client = ClientSockets(args.dns_ip, args.dns_port, args.server_uri, args.room, args.window, args.history_dir)
     client.initialize()
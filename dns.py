@@ -1,3 +1,10 @@
+from argparse import ArgumentParser
+
 from src.name_server.main import serve
 
-serve()
+parser = ArgumentParser()
+parser.add_argument("--port", help="Name server port", type=int, default=8000)
+parser.add_argument("--max_servers", help="Maximum number of replicas per URI", type=int, default=2)
+
+args = parser.parse_args()
+serve(args.port, args.max_servers)
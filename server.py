@@ -2,6 +2,7 @@ import logging
 import socket
 from argparse import ArgumentParser
 from src.server.main import MainServer
+from src.server.MigrationTargets import parse_weights
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -38,6 +39,84 @@ parser.add_argument(
 parser.add_argument("--server_ip", help="Optional. Server ip", type=str, default=None)
 parser.add_argument("--server_port", help="Optional. Server port", type=int, default=None)
 parser.add_argument("--migrating", help="Dont use", default=False, action="store_true")
+parser.add_argument(
+    "--standby",
+    help="Start idle and wait in the name server until a migration claims this server",
+    default=False,
+    action="store_true",
+)
+
+parser.add_argument("--user_rate", help="Chat messages per second per user. 0 disables it", type=float, default=0)
+parser.add_argument("--user_burst", help="Burst of chat messages allowed per user", type=float, default=5)
+parser.add_argument("--global_rate", help="Chat messages per second in total. 0 disables it", type=float, default=0)
+parser.add_argument("--global_burst", help="Burst of chat messages allowed in total", type=float, default=50)
+parser.add_argument(
+    "--rate_limit_mode",
+    help="What to do with messages over the limit",
+    choices=["reject", "defer"],
+    default="reject",
+)
+parser.add_argument("--max_defer", help="Max seconds to hold a deferred message", type=float, default=1.0)
+parser.add_argument(
+    "--lease_size",
+    help="Message indexes leased from a majority of replicas at a time. 0 agrees on every index with them",
+    type=int,
+    default=64,
+)
+parser.add_argument(
+    "--ordering",
+    help="How messages are ordered: leased indexes or hybrid logical clock stamps (no coordination)",
+    choices=["lease", "hlc"],
+    default="lease",
+)
+parser.add_argument(
+    "--migration_interval",
+    help="Seconds between migrations (the minimum, with the adaptive policy). trigger_migration starts one right away",
+    type=float,
+    default=30,
+)
+parser.add_argument(
+    "--migration_policy",
+    help="fixed: migrate every interval. adaptive: defer migrations while the server is busy",
+    choices=["fixed", "adaptive"],
+    default="fixed",
+)
+parser.add_argument(
+    "--migration_max_interval",
+    help="Adaptive policy: migrate after this many seconds even if the server is busy",
+    type=float,
+    default=120,
+)
+parser.add_argument(
+    "--migration_max_rate", help="Adaptive policy: busy above this many chat messages/s", type=float, default=50
+)
+parser.add_argument(
+    "--migration_max_users", help="Adaptive policy: busy above this many connected users", type=int, default=500
+)
+parser.add_argument(
+    "--reconnect_window",
+    help="Seconds over which clients reconnect to the new server after a migration",
+    type=float,
+    default=1.0,
+)
+parser.add_argument(
+    "--migration_weights",
+    help="Score of a migration target, e.g. 'cores=1,memory_gb=0.5,rtt_ms=-0.05' (free cores, available GB, RTT)",
+    type=parse_weights,
+    default="",
+)
+parser.add_argument(
+    "--disconnected_grace",
+    help="Seconds a disconnected user is kept before it is forgotten (its uuid is still remembered)",
+    type=float,
+    default=300,
+)
+parser.add_argument(
+    "--profile_startup",
+    help="Print how long each startup stage took, up to the listening socket",
+    default=False,
+    action="store_true",
+)
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -51,5 +130,23 @@ if __name__ == "__main__":
         server_ip=args.server_ip,
         server_port=args.server_port,
         migrating=args.migrating,
+        standby=args.standby,
+        user_rate=args.user_rate,
+        user_burst=args.user_burst,
+        global_rate=args.global_rate,
+        global_burst=args.global_burst,
+        rate_limit_mode=args.rate_limit_mode,
+        max_defer=args.max_defer,
+        lease_size=args.lease_size,
+        ordering=args.ordering,
+        migration_interval=args.migration_interval,
+        migration_policy=args.migration_policy,
+        migration_max_interval=args.migration_max_interval,
+        migration_max_rate=args.migration_max_rate,
+        migration_max_users=args.migration_max_users,
+        reconnect_window=args.reconnect_window,
+        migration_weights=args.migration_weights,
+        disconnected_grace=args.disconnected_grace,
+        profile_startup=args.profile_startup,
     )
     server.start()
@@ -1,6 +1,9 @@
 import logging
-from time import sleep
-from collections import deque
+from threading import Lock
+from time import perf_counter, sleep
+from src.client.history_cache import DEFAULT_CACHE_DIR, HistoryCache, message_key
+from src.client.host_report import host_capacity
+from src.client.outbound import DEFAULT_WINDOW, OutboundQueue
 from src.client.start_server import start_server
 from src.utils.networking import request_server_adrr
 
@@ -13,20 +16,39 @@ from .gui_socketio import GUI
 
 logger = logging.getLogger(f"{Color.RED}[ClientSockets]{Color.RESET}")
 
+HOST_REPORT_INTERVAL = 10  # seconds
+
 
 class ClientSockets:
-    def __init__(self, dns_ip: str, dns_port: int, server_uri: str) -> None:
+    def __init__(
+        self,
+        dns_ip: str,
+        dns_port: int,
+        server_uri: str,
+        room: str = "general",
+        window: int = DEFAULT_WINDOW,
+        history_dir: str = DEFAULT_CACHE_DIR,
+    ) -> None:
         self.dns_host = dns_ip
         self.dns_port = dns_port
         self.server_uri = server_uri
+        self.room = room
         self.gui = GUI(self.server_connect, self.send_private_message, self.send_message)
         self.p2p = P2P()
 
         # Queue for outbound messages.
-        # Should only send a message if the previous one was received by the server.
-        self.__outbound = deque()
-        self.__sendNext = False
-        self.__pauseMessages = False
+        # Up to `window` messages can be sent before the server acknowledges them.
+        self.__outbound = OutboundQueue(
+            lambda msg, callback: self.server_io.emit("chat", msg, callback=callback), window
+        )
+
+        # Messages received in previous sessions. Only the missing ones are requested to the server.
+        # Opened when connecting, since each user has its own
+        self.history_dir = history_dir
+        self.history: HistoryCache = None
+        # { (origin, index): (username, message) }
+        self.__shown = {}
+        self.__shown_lock = Lock()
 
         self.flag = True
         self.reconnecting = False
@@ -62,12 +84,17 @@ class ClientSockets:
 
     def connect(self):
         logger.debug("Initializing chat GUI")
-        self.gui.onConnect(self.reconnecting)
+        self.gui.onConnect(self.reconnecting, self.room)
+        if not self.reconnecting:
+            # Show the cached history right away, the server only sends what is missing
+            for index, message in self.history.history():
+                self.__show_message(index, message)
 
         # Start the message sending from queue in the background process
         logger.debug("Starting message delivery queue")
         if self.flag:
             self.server_io.start_background_task(self.__run)
+            self.server_io.start_background_task(self.__report_host)
             self.flag = False
 
     def server_down(self):
@@ -80,13 +107,20 @@ class ClientSockets:
             reconnected = self.reconnect()
             sleep(0.1)
 
-    def reconnect(self):
+    def reconnect(self, data: dict = None):
+        # After a migration the server tells each client where and when to reconnect,
+        # spreading clients over a window, and gives it a token to resume its session
+        data = data or {}
+        if data.get("delay"):
+            sleep(data["delay"])
         try:
             self.reconnecting = True
             self.server_io.disconnect()
             self.initialize_server_connection()
-            self.server_connect(self.gui.name, self.reconnecting)
-            self.__sendNext = True
+            self.server_connect(self.gui.name, self.reconnecting, data.get("addr"), data.get("token"))
+            # The acks of the old connection won't arrive. The server ignores what it already processed
+            self.__outbound.resend_unacked()
+            self.__setSendNext(True)
             return True
         except:
             return False
@@ -95,7 +129,7 @@ class ClientSockets:
         pass
 
     def receive_pause_messages_signal(self, pause: bool):
-        self.__pauseMessages = pause
+        self.__outbound.set_paused(pause)
         logger.debug(f"Received pause message with vaule {pause}")
 
     def server_message(self, data):
@@ -109,60 +143,83 @@ class ClientSockets:
         self.__on_deliver_message(data)
 
     def __on_deliver_message(self, message: dict):
+        # Live messages carry the index of the previous message of their origin as prev_index
+        if "prev" not in message:
+            message = {**message, "prev": message.get("prev_index")}
+        self.__show_message(message.get("index"), message)
+
+    def __show_message(self, index, message: dict):
+        # Shows each message once, and stores it in the history cache.
+        # A different message with the same key is from a newer cluster, so it's shown too
+        if index is not None:
+            key = message_key(index, message)
+            content = (message["username"], message["message"])
+            with self.__shown_lock:
+                if self.__shown.get(key) == content:
+                    return
+                self.__shown[key] = content
+            self.history.add(index, message)
         self.gui.addMessage(f"<{message['username']}> {message['message']}")
 
     def chat_message_history(self, data):
         # Si llega  la historia de mensaje, formatearlos y agregarlos
         # a la gui
-        for msg in data["messages"]:
-            self.gui.addMessage(f"<{msg[1]['username']}> {msg[1]['message']}")
+        for index, msg in data["messages"]:
+            self.__show_message(index, msg)
 
     def __setSendNext(self, val: bool):
         # Utility function
         logger.debug("Send next")
-        self.__sendNext = val
+        self.__outbound.set_send_next(val)
 
     def __run(self):
-        # Constantly checks the queue for messages to send.
-        # Only sends a message if the previous one has been
-        # acknowledged by the server.
-        self.__sendNext = True
+        # Sends the queued messages, waiting until there is one and
+        # the window of unacknowledged messages has room for it.
+        self.__outbound.run()
+
+    def __report_host(self):
+        # Periodically tells the server how much capacity this machine has and how far
+        # it is, so a migration picks a good client to start the new server
+        rtt_ms = None
         while True:
-            if self.__outbound and self.__sendNext and not self.__pauseMessages:
-                logger.debug(f"Outbound length: {len(self.__outbound)}")
-                # Prevent other messages from being sent
-                self.__sendNext = False
-
-                # Get next message to send
-                print("\n")
-                print(self.__outbound)
-                print("\n")
-                msg = self.__outbound.popleft()
-
-                # Send message to server, and allow next message to be sent
-                # when the server responds to this message.
-                logger.debug("Emmiting message to server")
-                self.server_io.emit(
-                    "chat",
-                    msg,
-                    callback=lambda *args: self.__setSendNext(True),
-                )
-
-            # Yield the CPU
-            self.server_io.sleep(1e-4)  # 100 usec
-
-    def server_connect(self, name, reconnecting=False):
-        # Get server address
-        server_address = request_server_adrr(self.dns_host, self.dns_port, self.server_uri)
+            try:
+                data = {**host_capacity(), "rtt_ms": rtt_ms}
+                start = perf_counter()
+                self.server_io.call("host_report", data, timeout=HOST_REPORT_INTERVAL)
+                rtt_ms = (perf_counter() - start) * 1000
+            except Exception as e:
+                logger.debug(f"Could not report host capacity: {e}")
+            sleep(HOST_REPORT_INTERVAL)
+
+    def server_connect(self, name, reconnecting=False, server_address=None, resume_token=None):
+        # Get server address, unless the previous server already told us
+        if server_address is None:
+            server_address = request_server_adrr(self.dns_host, self.dns_port, self.server_uri)
         logger.debug(f"Obtained server address: {server_address}")
         # Connect to the server.
         # Sends session information, such as name, port and p2p server url.
         logger.debug(f"Connecting to server {self.server_uri}")
-        self.server_io.connect(
-            server_address,
-            auth={"username": name, "publicUri": f"http://{self.public_ip}:{self.port}", "reconnecting": reconnecting},
-        )
-        self.__pauseMessages = False
+        if self.history is None or self.history.username != name:
+            self.history = HistoryCache(self.history_dir, self.server_uri, name, self.room)
+        auth = {
+            "username": name,
+            "publicUri": f"http://{self.public_ip}:{self.port}",
+            "reconnecting": reconnecting,
+            "room": self.room,
+            # The server already has every message before this one
+            "seq_base": self.__outbound.base(),
+            "seq_session": self.__outbound.session,
+            # { origin: highest index } of the cached history
+            "history": self.history.watermarks(),
+        }
+        if resume_token:
+            auth["resume"] = resume_token
+        self.server_io.connect(server_address, auth=auth)
+        self.__outbound.set_paused(False)
+
+        if resume_token:
+            # A resumed session keeps its p2p uri
+            return
         ip, port = self.p2p.start()
         data = {"username": name, "publicUri": f"http://{ip}:{port}"}
         self.server_io.emit('update_p2p_uri', data)
@@ -170,7 +227,7 @@ class ClientSockets:
         # Appends a message to the outbound queue.
         # See __run for message sending.
         logger.debug(f"Sending message")
-        self.__outbound.append({"message": message})
+        self.__outbound.put({"message": message})
 
     def __send_private_message(self, addr, username, message, dest_user, dest_user_id):
         # Check if addr is valid. If it is None, destination user is not
@@ -205,7 +262,7 @@ class ClientSockets:
     def on_create_server(self, data):
         logger.debug(f"Creating server {data}")
         # Create a server
-        ip, port = start_server()
+        ip, port = start_server(self.public_ip)
 
         logger.debug(f"Server created at {ip}:{port}")
         return {"ip": ip, "port": port}
@@ -88,11 +88,11 @@ class GUI:
     def show_error(self, title: str, message: str):
         messagebox.showwarning(title, message)
 
-    def onConnect(self, reconnecting=False):
+    def onConnect(self, reconnecting=False, room=None):
         self.login.destroy()
 
         self.Window.deiconify()
-        self.labelHead.config(text=self.name)
+        self.labelHead.config(text=self.name if room is None else f"{self.name} @ {room}")
         if not reconnecting:
             self.addMessage("Welcome to the chat!")
             self.addMessage("To send a private message, type:\n\t@<username> <message>")
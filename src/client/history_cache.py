@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from colorama import Fore as Color
+
+logger = logging.getLogger(f"{Color.MAGENTA}[HistoryCache]{Color.RESET}")
+
+DEFAULT_CACHE_DIR = ".chat_history"
+MAX_MESSAGES = 5000
+
+# Fields that tell apart two messages with the same key
+CONTENT = ("username", "message", "origin")
+
+# (origin, message index). Each server assigns its own indexes, so the index alone isn't unique
+Key = Tuple[Optional[str], int]
+
+
+def message_key(index: int, message: dict) -> Key:
+    return message.get("origin"), index
+
+
+class HistoryCache:
+    """
+    On-disk cache of the messages a user received from a room of a server, keyed
+    by origin and message index. Messages are appended to a JSON lines file as
+    they arrive, and the file is rewritten with the last `max_messages` when it
+    grows too much.
+
+    Indexes start over when the cluster does, so if a message arrives with the
+    key of a different cached message, the cache is from an older cluster and
+    is dropped.
+
+    Each message carries the index of the previous message of its origin (prev),
+    so the watermark of an origin only advances while the cached chain has no
+    gaps, and the server sends again the messages that were missed.
+    """
+
+    def __init__(
+        self, cache_dir: str, server_uri: str, username: str, room: str, max_messages: int = MAX_MESSAGES
+    ) -> None:
+        # cache_dir/server uri/username/room.jsonl
+        self.path = os.path.join(cache_dir, *(quote(part, safe="") for part in (server_uri, username, room))) + ".jsonl"
+        self.username = username
+        self.max_messages = max_messages
+        self.lock = Lock()
+
+        # { (origin, message_index): {"username": ..., "message": ..., "origin": ..., "prev": ...} }
+        self.messages: Dict[Key, dict] = {}
+        self.lines = 0
+
+        # { origin: highest index up to which every message of that origin is cached }
+        self.origin_highs: Dict[str, int] = {}
+
+        # { origin: { prev: index } } Messages cached before their previous one
+        self.waiting: Dict[str, Dict[int, int]] = {}
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.__load()
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    index, message = json.loads(line)
+                except ValueError:
+                    # e.g. the last line was cut when the client closed
+                    logger.debug(f"Skipping invalid line in {self.path}")
+                    continue
+                self.messages[message_key(index, message)] = message
+                self.lines += 1
+                self.__advance(index, message)
+
+    def add(self, index: int, message: dict) -> bool:
+        """Stores a message. Returns False if it was already stored"""
+        with self.lock:
+            key = message_key(index, message)
+            message = {field: message.get(field) for field in (*CONTENT, "prev")}
+
+            cached = self.messages.get(key)
+            if cached is not None and all(cached.get(field) == message[field] for field in CONTENT):
+                return False
+            if cached is not None:
+                logger.debug(f"Message {key} changed, dropping the history of an older cluster")
+                self.messages.clear()
+                self.origin_highs.clear()
+                self.waiting.clear()
+                self.__rewrite()
+
+            self.messages[key] = message
+            self.__advance(index, message)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps([index, message]) + "\n")
+            self.lines += 1
+
+            if self.lines > 2 * self.max_messages:
+                self.__compact()
+            return True
+
+    def __advance(self, index: int, message: dict):
+        """Advances the watermark of the origin of the message while its chain has no gaps"""
+        origin, prev = message.get("origin"), message.get("prev")
+        if origin is None:
+            return
+
+        high = self.origin_highs.get(origin, -1)
+        if prev is not None and prev > high:
+            # The previous message (or one before it) is missing
+            self.waiting.setdefault(origin, {})[prev] = index
+            return
+
+        high = max(high, index)
+        waiting = self.waiting.get(origin, {})
+        while high in waiting:
+            high = max(high, waiting.pop(high))
+        self.origin_highs[origin] = high
+
+    def __compact(self):
+        """Keeps only the last max_messages messages"""
+        kept = sorted(self.messages.items(), key=lambda item: item[0][1])[-self.max_messages :]
+        self.messages = dict(kept)
+
+        # The oldest kept message of each origin starts its chain, so the watermark is the same after a reload
+        oldest = {}
+        for (origin, index), message in kept:
+            oldest.setdefault(origin, (index, message))
+        for origin, (index, message) in oldest.items():
+            if origin is not None and index <= self.origin_highs.get(origin, -1):
+                message["prev"] = None
+
+        self.__rewrite()
+
+    def __rewrite(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for (_, index), message in sorted(self.messages.items(), key=lambda item: item[0][1]):
+                file.write(json.dumps([index, message]) + "\n")
+        os.replace(tmp_path, self.path)
+        self.lines = len(self.messages)
+
+    def history(self) -> List[Tuple[int, dict]]:
+        with self.lock:
+            return sorted(((index, message) for (_, index), message in self.messages.items()), key=lambda m: m[0])
+
+    def watermarks(self) -> Dict[str, int]:
+        """{ origin: highest index without gaps } The server only has to send the messages after these"""
+        with self.lock:
+            return dict(self.origin_highs)
@@ -0,0 +1,25 @@
+import os
+from typing import Optional
+
+
+def available_memory_gb() -> Optional[float]:
+    """Memory available for new processes, or None if it can't be read (e.g. outside Linux)"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 2 ** 20
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def host_capacity() -> dict:
+    """What a server needs to know about this machine to decide whether to migrate to it"""
+    cores = os.cpu_count() or 1
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        # Not available on Windows
+        load = None
+    return {"cores": cores, "load": load, "memory_gb": available_memory_gb()}
@@ -0,0 +1,151 @@
+import logging
+from collections import deque
+from threading import Condition
+from time import monotonic
+from typing import Callable, Deque, Dict
+from uuid import uuid4
+
+from colorama import Fore as Color
+
+logger = logging.getLogger(f"{Color.RED}[Outbound]{Color.RESET}")
+
+# Sends a message to the server, calling the callback with the response when it is acknowledged
+Emit = Callable[[dict, Callable], None]
+
+# Sequence number of a message. The server processes the messages of a client in this order
+SEQ = "seq"
+
+DEFAULT_WINDOW = 8
+
+
+class OutboundQueue:
+    """
+    Queue for outbound chat messages.
+    Up to `window` messages can be waiting for the server's ack at the same time
+    (with a window of 1, a message is only sent once the previous one was received),
+    and none is sent while the server has paused messaging (e.g. during a migration).
+    Every message gets a sequence number, so the server keeps their order and ignores
+    resent messages it already processed. The sender sleeps on a condition until it
+    can send, instead of polling.
+    """
+
+    def __init__(self, emit: Emit, window: int = DEFAULT_WINDOW) -> None:
+        self.emit = emit
+        self.window = max(window, 1)
+        self.condition = Condition()
+
+        # Messages not sent yet, in sequence order
+        self.messages: Deque[dict] = deque()
+
+        # { seq: message } Sent and waiting for the server's ack
+        self.in_flight: Dict[int, dict] = {}
+        self.next_seq = 1
+
+        # Sequence numbers are only unique within a session. A restarted client starts a new one
+        self.session = uuid4().hex
+
+        self.send_next = False
+        self.paused = False
+
+        # Nothing is sent until then, e.g. after being rate limited
+        self.held_until = 0
+
+    def put(self, message: dict):
+        with self.condition:
+            self.messages.append({**message, SEQ: self.next_seq})
+            self.next_seq += 1
+            self.condition.notify()
+
+    def __requeue(self, message: dict):
+        """Puts a sent message back in the queue, keeping the sequence order"""
+        i = 0
+        while i < len(self.messages) and self.messages[i][SEQ] < message[SEQ]:
+            i += 1
+        self.messages.insert(i, message)
+
+    def set_send_next(self, value: bool):
+        with self.condition:
+            self.send_next = value
+            self.condition.notify()
+
+    def set_paused(self, value: bool):
+        with self.condition:
+            self.paused = value
+            self.condition.notify()
+
+    def resend_unacked(self):
+        """
+        Sends again the messages that were waiting for an ack, e.g. after reconnecting,
+        since the acks of the old connection will never arrive
+        """
+        with self.condition:
+            for message in self.in_flight.values():
+                self.__requeue(message)
+            self.in_flight.clear()
+            self.condition.notify()
+
+    def base(self) -> int:
+        """Lowest sequence number not acknowledged yet. The server already has every message before it"""
+        with self.condition:
+            seqs = [*self.in_flight, self.next_seq]
+            if self.messages:
+                seqs.append(self.messages[0][SEQ])
+            return min(seqs)
+
+    def __can_send(self) -> bool:
+        return (
+            bool(self.messages)
+            and self.send_next
+            and not self.paused
+            and len(self.in_flight) < self.window
+            and monotonic() >= self.held_until
+        )
+
+    def __len__(self):
+        return len(self.messages)
+
+    def run(self):
+        """Sends the queued messages forever"""
+        self.set_send_next(True)
+        while True:
+            with self.condition:
+                while not self.__can_send():
+                    # While held, wake up when the hold ends
+                    held = self.held_until - monotonic()
+                    self.condition.wait(held if held > 0 else None)
+
+                msg = self.messages.popleft()
+                self.in_flight[msg[SEQ]] = msg
+                logger.debug(f"Outbound length: {len(self.messages)}, in flight: {len(self.in_flight)}")
+
+            logger.debug("Emmiting message to server")
+            try:
+                self.emit(msg, lambda response=None, msg=msg: self.on_ack(msg, response))
+            except Exception as e:
+                # Not connected. Wait until the client reconnects and allows sending again
+                logger.debug(f"Could not send message: {e}")
+                with self.condition:
+                    self.in_flight.pop(msg[SEQ], None)
+                    self.__requeue(msg)
+                    self.send_next = False
+
+    def on_ack(self, msg: dict, response: dict = None):
+        with self.condition:
+            if self.in_flight.pop(msg[SEQ], None) is None:
+                # Ack from a connection that was already replaced. The message is
+                # already queued again, and the server will ignore the resend
+                return
+
+            status = response.get("status") if response else None
+            if status in ("rate_limited", "unavailable"):
+                # The server dropped the message (too many messages, or the replicas
+                # could not order it). Put it back in front of the queue and wait
+                # until the server accepts messages again.
+                logger.debug(f"Message {status}, retrying in {response['retry_after']:.2f}s")
+                self.__requeue(msg)
+                self.held_until = max(self.held_until, monotonic() + response["retry_after"])
+            elif status == "out_of_order":
+                # A previous message didn't arrive in time, so this one must be sent again after it
+                self.__requeue(msg)
+
+            self.condition.notify()
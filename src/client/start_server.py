@@ -4,11 +4,14 @@ from os import path
 import sys
 from typing import Tuple
 
-from ..utils.networking import get_public_ip
+from ..utils.networking import free_port, get_public_ip
 
 
-def start_server() -> Tuple[str, int]:
-    ip, port = get_public_ip()
+def start_server(ip: str = None) -> Tuple[str, int]:
+    # Reuse the address this client already knows instead of looking it up again
+    if ip is None:
+        ip, _ = get_public_ip()
+    port = free_port(ip)
 
     # ./src/client
     exec_path, _ = path.split(path.abspath(getsourcefile(lambda: 0)))
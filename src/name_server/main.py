@@ -13,6 +13,7 @@ from re import U
 import socket
 from threading import Thread
 from random import choice, sample
+from typing import List, Optional
 
 from colorama.ansi import Fore
 from socketio import Server
@@ -34,7 +35,7 @@ def ctime():
 
 
 class NameServer:
-    def __init__(self, port=8000, n=10, socketio_port=8001):
+    def __init__(self, port=8000, n=10, socketio_port=8001, max_servers=2):
         """Initializes a name server with forwarding pointers of the form
         (stub, scion) for clients stubs and server stubs.
 
@@ -51,18 +52,23 @@ class NameServer:
             Port on which the server will be listening for requests
         n : int
             Maximum number of processes to listen
+        max_servers : int
+            Maximum number of replicas serving the same URI
         """
         self.host = socket.gethostbyname(socket.gethostname())
         self.port = port
         self.n = n
+        self.max_servers = max_servers
 
         self.server_reader, self.server_writer = get_rwlock()
 
         self.addresses = set()  # set(http://ip:port)
         self.uri2address = dict()  # uri -> [address1, address2, ...]
+        self.standbys = dict()  # uri -> [address1, ...] idle servers ready to take over a migration
 
         # initialize NS
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.s.bind((self.host, self.port))
         self.s.listen(n)
 
@@ -123,6 +129,26 @@ class NameServer:
                         client.disconnect()
                     client.on('server_down_dns', on_server_down)
 
+                elif req["name"] == "register_standby":
+                    self.register_standby(req["uri"], req["addr"])
+                    conn.send(pkl.dumps({"name": "register_standby_response"}))
+
+                    def on_standby_disconnect(uri=req["uri"], address=req["addr"]):
+                        self.remove_standby(uri, address)
+
+                    client = Client(reconnection=False)
+                    client.connect(req["addr"], auth={"dns_polling": True})
+                    client.on("disconnect", on_standby_disconnect)
+
+                elif req["name"] == "claim_standby":
+                    msj = {"name": "claim_standby_response", "addr": self.claim_standby(req["uri"])}
+                    conn.send(pkl.dumps(msj))
+
+                elif req["name"] == "get_standbys":
+                    with self.server_reader:
+                        standbys = list(self.standbys.get(req["uri"], []))
+                    conn.send(pkl.dumps({"name": "get_standbys_response", "addrs": standbys}))
+
                 elif req["name"] == "addr_request":
                     closest_ip = self.get_closest_server(addr[0], req["uri"])
                     msj = {
@@ -154,6 +180,14 @@ class NameServer:
                     }
                     conn.send(pkl.dumps(msj))
 
+                elif req["name"] == "get_replica_addrs":
+                    logger.debug(f"[{ctime()}] Send replica addresses")
+                    msj = {
+                        "name": "get_replica_addrs_response",
+                        "addrs": self.get_replica_addresses(req["my_addr"], req["uri"]),
+                    }
+                    conn.send(pkl.dumps(msj))
+
                 else:
                     logger.debug(f"[{ctime()}] Message didnt match")
                     msj = {"name": "empty"}
@@ -194,7 +228,7 @@ class NameServer:
             if not self.uri2address.get(uri):
                 self.uri2address[uri] = []
 
-            if len(self.uri2address[uri]) < 2:
+            if len(self.uri2address[uri]) < self.max_servers:
                 self.uri2address[uri].append(address)
                 is_active_server = True
 
@@ -206,6 +240,31 @@ class NameServer:
                 return address
         return ""
 
+    def get_replica_addresses(self, request_address: str, uri: str) -> List[str]:
+        """Every other replica serving the URI"""
+        with self.server_reader:
+            return [address for address in self.uri2address.get(uri, []) if address != request_address]
+
+    def register_standby(self, uri: str, address: str):
+        """Registers an idle server that a migration of the URI can claim"""
+        logger.debug(f"[{ctime()}] Added standby server {address} for {uri}")
+        with self.server_writer:
+            self.standbys.setdefault(uri, []).append(address)
+
+    def remove_standby(self, uri: str, address: str):
+        with self.server_writer:
+            if address in self.standbys.get(uri, []):
+                self.standbys[uri].remove(address)
+                logger.debug(f"[{ctime()}] Standby server {address} is disconnected")
+
+    def claim_standby(self, uri: str) -> Optional[str]:
+        """Takes a standby server out of the pool, so that only one migration gets it"""
+        with self.server_writer:
+            standbys = self.standbys.get(uri)
+            if standbys:
+                return standbys.pop(0)
+            return None
+
     def set_current_host(self, uri: str, address: str, old_address: str):
         with self.server_writer:
             try:
@@ -227,11 +286,10 @@ class NameServer:
             return choice(servers)
 
 
-def serve():
-    PORT = 8000
+def serve(port: int = 8000, max_servers: int = 2):
     SOCKETIO_PORT = 8001
     n = 10
-    ns = NameServer(PORT, n, SOCKETIO_PORT)
+    ns = NameServer(port, n, SOCKETIO_PORT, max_servers)
 
     ns.run()
 
@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from threading import Condition, Lock
+from typing import Dict, Iterable
+
+from ..utils.Logger import getServerLogger
+from ..utils.Middleware import Middleware
+from .Users import UserList
+
+logger = getServerLogger("ChatOrderMiddleware")
+
+SEQ = "seq"
+
+ORDER_TIMEOUT = 2.0  # seconds
+ACK_CACHE = 256  # acks kept per client
+MAX_CLIENTS = 10000
+
+
+class ClientSequence:
+    """Numero de secuencia del siguiente mensaje de un cliente, y las respuestas a sus ultimos mensajes"""
+
+    def __init__(self, expected: int = 1, session: str = None) -> None:
+        self.condition = Condition()
+        self.expected = expected
+        self.processing = False
+
+        # Si el mensaje esperado se rechazo (e.g. rate_limited), los siguientes no van a
+        # poder procesarse hasta que el cliente lo reenvie, por lo que no se espera por el
+        self.rejected = False
+
+        # Cola de mensajes del cliente. Un cliente que se reinicia comienza otra, desde 1
+        self.session = session
+
+        # { seq: respuesta }
+        self.acks: "OrderedDict[int, dict]" = OrderedDict()
+
+    def remember(self, seq: int, ack: dict):
+        self.acks[seq] = ack
+        while len(self.acks) > ACK_CACHE:
+            self.acks.popitem(last=False)
+
+    def duplicate_ack(self, seq: int) -> dict:
+        return self.acks.get(seq, {"status": "ok", "duplicate": True})
+
+    def dump(self) -> dict:
+        with self.condition:
+            # Las llaves enteras se convertirian en strings al serializar
+            return {"session": self.session, "expected": self.expected, "acks": list(self.acks.items())}
+
+    def load(self, data: dict):
+        with self.condition:
+            self.restart(data["session"], data["expected"])
+            for seq, ack in data["acks"]:
+                self.remember(seq, ack)
+            self.condition.notify_all()
+
+    def restart(self, session: str, expected: int):
+        """El cliente comenzo una nueva sesion, por lo que sus numeros de secuencia no son los de antes"""
+        self.session = session
+        self.expected = expected
+        self.rejected = False
+        self.acks.clear()
+
+
+class ChatOrderMiddleware(Middleware):
+    """
+    Middleware encargado de procesar los mensajes de chat de cada cliente en el orden
+    en que los mando. El cliente puede mandar varios mensajes sin esperar la respuesta
+    del anterior, y cada uno puede ser atendido por un thread distinto, por lo que cada
+    mensaje lleva un numero de secuencia y espera a que se procese el anterior.
+
+    Un mensaje que ya se proceso (e.g. reenviado despues de reconectarse) no se procesa
+    de nuevo, y se responde con la respuesta original. Si el anterior no llega en
+    ORDER_TIMEOUT segundos, o si se rechazo, se responde out_of_order para que el
+    cliente lo reenvie.
+    Esto es solo dentro de una sesion del cliente: si se reinicia, comienza de nuevo.
+
+    Los mensajes sin numero de secuencia pasan sin esperar.
+    """
+
+    def __init__(self, users: UserList, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.users = users
+
+        # { username: ClientSequence } Se mantiene al reconectarse
+        self.clients: "OrderedDict[str, ClientSequence]" = OrderedDict()
+        self.clients_lock = Lock()
+
+        self.handlers = {
+            "connect": self.on_connect,
+        }
+
+    @property
+    def metrics(self):
+        return self.main_server.metrics
+
+    def get_client(self, name: str, base: int = 1) -> ClientSequence:
+        key = name.casefold()
+        with self.clients_lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = self.clients[key] = ClientSequence(base)
+                if len(self.clients) > MAX_CLIENTS:
+                    self.clients.popitem(last=False)
+            self.clients.move_to_end(key)
+            return client
+
+    def dump(self, names: Iterable[str]) -> Dict[str, dict]:
+        """Estado de los clientes (e.g. los conectados a este server, para migrarlos)"""
+        with self.clients_lock:
+            clients = [(name, self.clients.get(name.casefold())) for name in names]
+        return {name: client.dump() for name, client in clients if client is not None}
+
+    def load(self, data: Dict[str, dict]):
+        for name, client_data in data.items():
+            self.get_client(name).load(client_data)
+
+    def on_connect(self, sid: str, data: dict):
+        """
+        El cliente dice desde que numero de secuencia le faltan respuestas (lo anterior
+        ya se proceso), y de que sesion. Dentro de una sesion seq_base puede ser menor
+        al esperado, si no alcanzaron a llegar las respuestas de lo ultimo procesado.
+        """
+        if not data or data.get("seq_base") is None or not data.get("username"):
+            return
+
+        base, session = data["seq_base"], data.get("seq_session")
+        client = self.get_client(data["username"], base)
+        with client.condition:
+            if session != client.session:
+                logger.debug(f"New message session of {data['username']}, starting from {base}")
+                client.restart(session, base)
+            elif base > client.expected:
+                client.expected = base
+                client.rejected = False
+            client.condition.notify_all()
+
+    def handle(self, event: str, sid: str, data: dict) -> dict:
+        """
+        Los mensajes de chat se pasan al resto de los middlewares en orden. Se reemplaza
+        handle porque se necesita la respuesta del resto de los middlewares para
+        saber si el mensaje se proceso, y guardarla por si el mensaje se reenvia.
+        """
+        if event != "chat" or data.get(SEQ) is None:
+            return super().handle(event, sid, data)
+
+        user = self.users.get_user_by_sid(sid)
+        if user is None:
+            return super().handle(event, sid, data)
+
+        seq = data[SEQ]
+        client = self.get_client(user.name)
+        with client.condition:
+            ready = client.condition.wait_for(
+                lambda: seq < client.expected
+                or (seq == client.expected and not client.processing)
+                or (seq > client.expected and client.rejected),
+                timeout=ORDER_TIMEOUT,
+            )
+            if seq < client.expected:
+                self.metrics.incr("chat_order.duplicates")
+                return client.duplicate_ack(seq)
+            if not ready or seq > client.expected:
+                self.metrics.incr("chat_order.out_of_order")
+                return {"status": "out_of_order", "expected": client.expected}
+            client.processing = True
+            session = client.session
+
+        ack = {}
+        try:
+            ack = super().handle(event, sid, data)
+            return ack
+        finally:
+            with client.condition:
+                client.processing = False
+                # Solo avanza si el mensaje se proceso (e.g. no si se rechazo por el rate limit),
+                # y si el cliente no comenzo otra sesion mientras tanto. Si se rechazo, los
+                # siguientes que esperan se despiertan para responder out_of_order
+                if session == client.session:
+                    client.rejected = "message_index" not in ack
+                    if not client.rejected:
+                        client.expected = seq + 1
+                        client.remember(seq, ack)
+                client.condition.notify_all()
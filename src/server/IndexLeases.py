@@ -0,0 +1,103 @@
+from collections import defaultdict, deque
+from threading import Lock
+from typing import Deque, Dict, List, Optional, Tuple
+
+Block = List[int]  # [start, end)
+
+
+class IndexLeases:
+    """
+    Bloques de indices arrendados por este servidor, por sala.
+
+    Un servidor propone un bloque [start, end) y lo puede usar solo si una
+    mayoria de los servidores (contandose a si mismo) lo acepta. Un servidor
+    acepta una propuesta solo si empieza despues de todo lo que ya arrendo o
+    acepto (su `high`). Como dos mayorias siempre tienen un servidor en comun,
+    dos bloques concedidos nunca se solapan y el orden total se mantiene.
+
+    Ademas, un servidor nunca asigna un indice menor a uno que ya vio, por lo
+    que los mensajes nuevos quedan despues de todos los que sus clientes ya leyeron.
+    """
+
+    def __init__(self, block_size: int, low_water: int = None) -> None:
+        self.block_size = block_size
+        self.low_water = block_size // 4 if low_water is None else low_water
+        self.lock = Lock()
+
+        # { room: deque([[start, end], ...]) } Bloques concedidos y aun no usados
+        self.blocks: Dict[str, Deque[Block]] = defaultdict(deque)
+
+        # { room: fin del ultimo bloque propuesto o aceptado por este server }
+        self.highs: Dict[str, int] = defaultdict(int)
+
+        # { room: indice siguiente al mayor indice visto }
+        self.observed: Dict[str, int] = defaultdict(int)
+
+    def take(self, room: str) -> Optional[int]:
+        """Saca el siguiente indice arrendado de la sala, o None si no quedan"""
+        with self.lock:
+            blocks = self.blocks[room]
+            while blocks:
+                block = blocks[0]
+                if block[0] < block[1]:
+                    index = block[0]
+                    block[0] += 1
+                    self.observed[room] = max(self.observed[room], index + 1)
+                    return index
+                blocks.popleft()
+            return None
+
+    def remaining(self, room: str) -> int:
+        with self.lock:
+            return sum(end - start for start, end in self.blocks[room])
+
+    def needs_renewal(self, room: str) -> bool:
+        return self.remaining(room) <= self.low_water
+
+    def propose(self, room: str) -> Tuple[int, int]:
+        """Reserva localmente el siguiente bloque a proponer a los demas servidores"""
+        with self.lock:
+            start = max(self.highs[room], self.observed[room])
+            end = start + self.block_size
+            self.highs[room] = end
+            return start, end
+
+    def accept(self, room: str, start: int, end: int) -> Tuple[bool, int]:
+        """Acepta la propuesta de otro servidor si no se solapa con nada arrendado o aceptado"""
+        with self.lock:
+            if start >= self.highs[room]:
+                self.highs[room] = end
+                return True, end
+            return False, self.highs[room]
+
+    def grant(self, room: str, start: int, end: int):
+        """Agrega un bloque concedido, descartando lo que ya quedo por debajo de lo visto"""
+        with self.lock:
+            start = max(start, self.observed[room])
+            if start < end:
+                self.blocks[room].append([start, end])
+
+    def raise_high(self, room: str, high: int):
+        with self.lock:
+            self.highs[room] = max(self.highs[room], high)
+
+    def observe(self, room: str, index: int) -> List[Tuple[int, int]]:
+        """
+        Registra un indice asignado por otro servidor. Los indices arrendados
+        menores a este se descartan, y se retornan los rangos descartados.
+        """
+        discarded = []
+        with self.lock:
+            self.observed[room] = max(self.observed[room], index + 1)
+            self.highs[room] = max(self.highs[room], index + 1)
+
+            blocks = self.blocks[room]
+            while blocks and blocks[0][0] <= index:
+                start, end = blocks[0]
+                if end <= index + 1:
+                    blocks.popleft()
+                    discarded.append((start, end))
+                else:
+                    blocks[0][0] = index + 1
+                    discarded.append((start, index))
+        return [(start, end) for start, end in discarded if start < end]
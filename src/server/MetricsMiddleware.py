@@ -0,0 +1,23 @@
+from typing import Tuple
+
+from ..utils.Logger import getServerLogger
+from ..utils.Middleware import Middleware
+
+logger = getServerLogger("MetricsMiddleware")
+
+
+class MetricsMiddleware(Middleware):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.handlers = {"metrics": self.get_metrics}
+
+    def get_metrics(self, sid: str, data: dict) -> Tuple[bool, dict]:
+        """
+        Si llega un evento de tipo metrics,
+        se retorna una copia de las metricas del servidor
+        """
+
+        # Este middleware no tiene que seguir avanzando, por lo que se retorna False
+        # (La respuesta ya esta completa)
+        return False, self.main_server.metrics.snapshot()
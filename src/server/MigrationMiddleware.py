@@ -1,78 +1,235 @@
 import os
 import signal
-from random import choice
-from time import sleep, time
-from typing import List
+from concurrent.futures import Future
+from random import random
+from threading import Event
+from time import monotonic, sleep
+from typing import Callable, Dict, List, Optional, Tuple
 
 from socketio import Client
 
-from src.utils.networking import change_server_addr
+from src.utils.networking import change_server_addr, claim_standby, split_addr
 
 from ..utils.Logger import getServerLogger
 from ..utils.Middleware import Middleware
+from .MigrationSchedule import CHECK_INTERVAL, TRIGGERED, Decision, FixedInterval, Load, RateMeter, SchedulePolicy
+from .MigrationTargets import MigrationTargets
 from .Users import User, UserList
 
 logger = getServerLogger("MigrationMiddleware")
 
-SERVER_START_TIMEOUT = 10  # seconds
+PRECOPY_MAX_ROUNDS = 5
+PRECOPY_THRESHOLD = 64  # messages
+PROBE_INTERVAL = 0.05  # seconds
+PROBE_TIMEOUT = 1  # seconds
+
+# Fases de la migracion, en orden
+IDLE = "idle"
+STARTING = "starting"  # Se toma un standby, o un cliente levanta el nuevo server
+CONNECTING = "connecting"  # Se espera a que el nuevo server este listo
+PRECOPY = "precopy"  # Se copia la historia sin pausar a los clientes
+FINAL = "final"  # Clientes pausados, se manda lo que falta
+CUTOVER = "cutover"  # Se cambia la direccion en el DNS y se reconectan los clientes
+
+# Tiempo maximo de cada fase (segundos)
+PHASE_DEADLINES = {
+    STARTING: 10,
+    CONNECTING: 10,
+    PRECOPY: 30,
+    FINAL: 10,
+    CUTOVER: 10,
+}
+
+
+class MigrationPhaseError(Exception):
+    """Una fase de la migracion fallo o no termino antes de su deadline"""
+
+    def __init__(self, phase: str, message: str) -> None:
+        super().__init__(f"Migration {phase} phase failed: {message}")
+        self.phase = phase
 
 
 class MigrationMiddleware(Middleware):
     """Middleware encargado de manejar la logica de migracion"""
 
-    def __init__(self, users: UserList, *args, **kwargs):
+    def __init__(
+        self,
+        users: UserList,
+        *args,
+        interval: float = 30,
+        schedule: SchedulePolicy = None,
+        reconnect_window: float = 1.0,
+        target_weights: Dict[str, float] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.users = users
 
+        # Capacidad reportada por los clientes, para elegir donde levantar el nuevo server
+        self.targets = MigrationTargets(target_weights)
+        self.target_name: Optional[str] = None
+
+        # Las reconexiones de los clientes al nuevo server se reparten en esta ventana (segundos)
+        self.reconnect_window = reconnect_window
+
+        # { sid: token } Tokens para que los clientes retomen su sesion en el nuevo server
+        self.resume_tokens: Dict[str, str] = {}
+
         self.__migrating = False
+        self.paused_at = None
+        self.client: Client = None
+
+        # La politica decide cuando migrar (por defecto, cada `interval` segundos).
+        # Si llega trigger_migration se migra de inmediato
+        self.schedule = schedule or FixedInterval(interval)
+        self.wakeup = Event()
+        self.last_reason = None
+
+        # Mensajes de chat por segundo que recibe este server, para saber si esta ocupado
+        self.message_rate = RateMeter()
+
+        self.phase = IDLE
+        self.deadline = None
 
         self.handlers = {
             "connect": self.on_connect,
+            "migration_ready": self.on_migration_ready,
+            "trigger_migration": self.on_trigger_migration,
+            "migrate_precopy": self.on_migrate_precopy,
             "migrate": self.on_migrate,
+            "migration_report": self.on_migration_report,
+            "host_report": self.on_host_report,
+            "chat": self.count_message,
         }
 
-    def filter_valid_clients(self, clients: List[User]):
+    @property
+    def metrics(self):
+        return self.main_server.metrics
+
+    def filter_valid_clients(self, clients: List[User]) -> List[User]:
         valid = []
         for client in clients:
             try:
-                if client.replicated:
+                if client.replicated or client.disconnected:
                     continue
-                sid = client.sid
-                self.socketio.get_session(sid)
-                valid.append(sid)
+                self.socketio.get_session(client.sid)
+                valid.append(client)
             except Exception:
                 pass
         return valid
 
+    def remaining(self) -> float:
+        """Segundos que le quedan a la fase actual"""
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            raise MigrationPhaseError(self.phase, "deadline exceeded")
+        return remaining
+
+    def run_phase(self, phase: str, action: Callable, *args):
+        """Ejecuta una fase con su deadline, y registra cuanto tardo"""
+        logger.debug(f"Migration phase: {phase}")
+        self.phase = phase
+        self.deadline = monotonic() + PHASE_DEADLINES[phase]
+
+        start = monotonic()
+        try:
+            return action(*args)
+        except MigrationPhaseError:
+            raise
+        except Exception as e:
+            raise MigrationPhaseError(phase, str(e)) from e
+        finally:
+            self.metrics.set(f"migration.{phase}_seconds", monotonic() - start)
+
     def __migrate(self):
         """Comenzar el proceso de migración"""
+        started_at = monotonic()
 
-        selected_server = False
-        new_address = None
+        new_address = self.run_phase(STARTING, self.start_new_server)
+        if new_address is None:
+            return False
 
-        while not selected_server or new_address is None:
-            clients_sids = self.filter_valid_clients(self.users.users.values())
+        self.run_phase(CONNECTING, self.request_migration_connection, *new_address)
 
-            if len(clients_sids) == 0:
-                return False
+        # Copiar la historia al nuevo server mientras el chat sigue andando
+        watermarks = self.run_phase(PRECOPY, self.precopy)
 
-            # Elegir un cliente al azar
-            selected_client_sid = choice(clients_sids)
+        # Pausar clientes, solo para mandar lo que falta y cambiar de server
+        self.send_pause_messaging_signal(True)
+        self.paused_at = monotonic()
 
-            # Conectar y notificar migracion
-            new_address = self.request_server_start(selected_client_sid)
+        # Mandar mensajes que faltan a nuevo server
+        self.run_phase(FINAL, self.request_migration, watermarks)
+        self.run_phase(CUTOVER, self.on_migrate_complete, new_address)
 
-            if new_address is None:
-                continue
+        self.metrics.set("migration.total_seconds", monotonic() - started_at)
+        self.finish()
+        return True
+
+    def start_new_server(self) -> Optional[Tuple[str, int]]:
+        """
+        Toma un server del pool de standbys, que ya esta listo. Si no hay, pide
+        a los clientes que levanten el nuevo server, de mejor a peor candidato
+        segun su capacidad y RTT, hasta que uno lo haga. Los que fallan quedan
+        en la lista negra, para no volver a elegirlos en las siguientes migraciones
+        """
+        self.target_name = None
+        try:
+            standby = claim_standby(self.main_server.dns_host, self.main_server.dns_port, self.main_server.server_uri)
+        except Exception as e:
+            logger.error(f"Could not claim a standby server: {e}")
+            standby = None
+
+        self.metrics.set("migration.standby_claimed", int(standby is not None))
+        if standby:
+            logger.debug(f"Claimed standby server {standby}")
+            return split_addr(standby)
+
+        clients = {client.name: client for client in self.filter_valid_clients(self.users.snapshot())}
+        for attempt, name in enumerate(self.targets.rank(list(clients)), 1):
+            score = self.targets.score(name)
+            logger.debug(f"Migration target {name} (score {score})")
+
+            new_address = self.request_server_start(clients[name].sid)
+            if new_address is not None:
+                self.target_name = name
+                self.metrics.set("migration.target_attempts", attempt)
+                self.metrics.set("migration.target_score", score if score is not None else 0)
+                return new_address
+
+            self.reject_target(name)
+        return None
+
+    def reject_target(self, name: str):
+        logger.info(f"Blacklisting migration target {name}")
+        self.targets.blacklist(name)
+        self.metrics.incr("migration.blacklisted_targets")
+
+    @staticmethod
+    def count_messages(rooms: dict) -> int:
+        return sum(len(room["messages"]) for room in rooms.values())
+
+    def precopy(self) -> dict:
+        """
+        Manda la historia al nuevo server en rondas, sin pausar a los clientes.
+        Cada ronda manda solo lo que llego durante la anterior, hasta que lo que
+        falta es poco. Retorna lo que el nuevo server ya tiene de cada sala.
+        """
+        watermarks = {}
+        for round_number in range(1, PRECOPY_MAX_ROUNDS + 1):
+            rooms = self.main_server.rooms.dump_missing(watermarks)
+            sent = self.count_messages(rooms)
 
-            selected_server = self.request_migration_connection(*new_address)
+            response = self.client.call("migrate_precopy", {"rooms": rooms}, timeout=self.remaining())
+            watermarks = response["watermarks"]
 
-        # Pausar clientes
-        self.send_pause_messaging_signal(True)
+            logger.debug(f"Pre-copy round {round_number}: {sent} messages")
+            self.metrics.incr("migration.precopy_messages", sent)
+            self.metrics.set("migration.precopy_rounds", round_number)
 
-        # Mandar mensajes a nuevo server
-        self.request_migration(new_address)
-        return True
+            if sent <= PRECOPY_THRESHOLD:
+                break
+        return watermarks
 
     def migrate(self):
         """Ejecutar el proceso de migracion"""
@@ -80,83 +237,99 @@ class MigrationMiddleware(Middleware):
             return self.__migrate()
         except Exception as e:
             logger.error(e)
-            self.__migrating = False
+            self.metrics.incr(f"migration.failures.{self.phase}")
+            if self.phase == CONNECTING and self.target_name:
+                # El cliente levanto el server, pero este nunca estuvo listo
+                self.reject_target(self.target_name)
+            self.abort()
             return False
 
+    def abort(self):
+        """Deja todo como antes de migrar: los clientes pueden volver a mandar mensajes"""
+        if self.__migrating:
+            self.send_pause_messaging_signal(False)
+        if self.client:
+            try:
+                self.client.disconnect()
+            except Exception:
+                pass
+            self.client = None
+        self.resume_tokens = {}
+        self.phase = IDLE
+
     def request_server_start(self, sid):
         """Mandar un mensaje al cliente para solicitar que empiece el proceso del server"""
         logger.debug("Requesting server start")
 
-        done = False
-        addr = None
-
-        def cb(data):
-            # Cliente retorna la ip y puerto del server que se acaba de crear
-            nonlocal done, addr
-            try:
-                addr = (data["ip"], data["port"])
-            except:
-                pass
-            done = True
-
+        response = Future()
         print(f"Server starting to {sid}")
-        self.socketio.emit("server_start", {}, to=sid, callback=cb)
-
-        end_time = time() + SERVER_START_TIMEOUT
-
-        while not done:
-            if end_time < time():
-                logger.error("Server start timeout")
-                return None
-
-            sleep(0.1)
+        # Cliente retorna la ip y puerto del server que se acaba de crear
+        self.socketio.emit(
+            "server_start", {}, to=sid, callback=lambda *args: response.set_result(args[0] if args else None)
+        )
 
-        return addr
+        timeout = self.remaining()
+        try:
+            data = response.result(timeout=timeout)
+            return data["ip"], data["port"]
+        except Exception as e:
+            logger.error(f"Server start failed: {e}")
+            return None
 
     def request_migration_connection(self, ip, port):
         """
-        Una vez que el nuevo server esta andando,
-        se conecta con el para comezar la migracion
+        Una vez que el nuevo server esta andando, se conecta con el para comezar
+        la migracion. Que acepte la conexion no significa que este listo, por lo
+        que se le pregunta hasta que responda que lo esta.
         """
 
         logger.debug("Requesting migration connection")
         addr = f"http://{ip}:{port}"
 
-        try:
-            self.client = Client()
-            self.client.connect(addr, auth={"migration": True})
-            return self.client.connected
-        except Exception as e:
-            logger.error(e)
-            return False
+        while True:
+            try:
+                if self.client is None or not self.client.connected:
+                    self.client = Client()
+                    self.client.connect(addr, auth={"migration": True}, wait_timeout=min(self.remaining(), 5))
+
+                response = self.client.call("migration_ready", {}, timeout=min(self.remaining(), PROBE_TIMEOUT))
+                if response and response.get("ready"):
+                    return True
+            except MigrationPhaseError:
+                raise
+            except Exception as e:
+                logger.debug(f"New server not ready yet: {e}")
+
+            sleep(min(self.remaining(), PROBE_INTERVAL))
 
     def send_pause_messaging_signal(self, pause=True):
         """Notificar a usuarios que encolen (o dejen de encolar) mensajes"""
         self.__migrating = pause
         self.socketio.emit("pause_messaging", pause)
 
-    def request_migration(self, new_address):
+    def request_migration(self, watermarks: dict = None):
         """
         Una vez conectado al nuevo server,
         se manda la informacion de la migracion
+        (solo lo que no se alcanzo a copiar antes de pausar)
         """
         logger.debug("Requesting migration")
 
+        rooms = self.main_server.rooms.dump_missing(watermarks or {})
+
+        # Los clientes estan pausados, por lo que sus sesiones ya no cambian
+        local_users = self.users.local_users()
+        self.resume_tokens = self.main_server.sessions.issue(local_users)
         data = {
-            "messages": self.main_server.messages,
+            "rooms": rooms,
             "min_user_count": self.main_server.min_user_count,
-            "history_sent": self.main_server.server_middleware.history_sent,
+            "sessions": self.main_server.sessions.dump(),
+            # Para que el nuevo server reconozca los mensajes que los clientes reenvien al reconectarse
+            "chat_order": self.main_server.chat_order_middleware.dump(user.name for user in local_users),
         }
+        self.metrics.set("migration.final_messages", self.count_messages(rooms))
 
-        def on_ack(*_):
-            # Una vez que el nuevo server recibe la informacion,
-            # se desconecta de el, y se ejecuta el proceso de termino
-            # de este server
-            self.client.disconnect()
-            self.client = None
-            self.on_migrate_complete(new_address)
-
-        self.client.emit("migrate", data, callback=on_ack)
+        self.client.call("migrate", data, timeout=self.remaining())
 
     def on_migrate_complete(self, addr):
         """
@@ -167,47 +340,119 @@ class MigrationMiddleware(Middleware):
         """
         logger.debug("Migration complete")
 
-        def cb(*_):
-            # Al cambiar la direccion del server,
-            # se notifica a los usuarios para que se reconecten,
-            # se detiene este server y se termina el proceso
-            self.socketio.emit("reconnect")
-            self.main_server._created_server.shutdown()
-            os.kill(os.getpid(), signal.SIGTERM)
-
-        change_server_addr(
+        changed = Event()
+        self.socketio.start_background_task(
+            change_server_addr,
             self.main_server.dns_host,
             self.main_server.dns_port,
             self.main_server.server_uri,
-            server_addr=f"http://{addr[0]}:{addr[1]}",
-            self_addr=self.main_server.addr,
-            callback=cb,
+            f"http://{addr[0]}:{addr[1]}",
+            self.main_server.addr,
+            changed.set,
         )
+        if not changed.wait(self.remaining()):
+            raise MigrationPhaseError(CUTOVER, "name server did not answer")
+
+        # Al cambiar la direccion del server, se notifica a los usuarios para que se reconecten
+        self.stagger_reconnections(f"http://{addr[0]}:{addr[1]}")
+        self.record_pause()
         return True
 
+    def stagger_reconnections(self, new_addr: str):
+        """
+        Le dice a cada cliente cuando reconectarse al nuevo server, con su token para
+        retomar la sesion. Los clientes se reparten en la ventana (cada uno en un
+        intervalo propio, en un momento al azar), para no llegar todos a la vez.
+        """
+        tokens = list(self.resume_tokens.items())
+        slot = self.reconnect_window / max(len(tokens), 1)
+        for i, (sid, token) in enumerate(tokens):
+            delay = (i + random()) * slot
+            self.socketio.emit("reconnect", {"addr": new_addr, "token": token, "delay": delay}, to=sid)
+        self.metrics.set("migration.resume_tokens", len(tokens))
+
+    def record_pause(self):
+        pause = monotonic() - self.paused_at
+        logger.info(f"Clients were paused for {pause * 1000:.1f} ms")
+        self.metrics.set("migration.pause_seconds", pause)
+
+    def finish(self):
+        """
+        Manda las metricas de la migracion al nuevo server, ya que este se termina,
+        y luego se detiene este server y se termina el proceso
+        """
+        report = {key: value for key, value in self.metrics.snapshot().items() if key.startswith("migration.")}
+        try:
+            self.client.call("migration_report", report, timeout=PHASE_DEADLINES[CUTOVER])
+            self.client.disconnect()
+        except Exception as e:
+            logger.error(f"Could not report migration: {e}")
+        self.client = None
+
+        self.main_server._created_server.shutdown()
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def current_load(self) -> Load:
+        return Load(self.message_rate.rate(), len(self.users.local_users()))
+
+    def record_decision(self, decision: Decision, load: Load):
+        """Registra la decision de la politica. Solo se loguea cuando cambia el motivo"""
+        self.metrics.incr(f"migration.schedule.{decision.reason}")
+        self.metrics.set("migration.schedule.message_rate", load.message_rate)
+        self.metrics.set("migration.schedule.users", load.users)
+
+        if decision.reason != self.last_reason:
+            action = "Migrating" if decision.migrate else "Deferring migration"
+            logger.info(f"{action}: {decision.reason} {decision.detail}".rstrip())
+            self.last_reason = decision.reason
+
     def __start(self):
         """Comenzar ciclo de migracion"""
         logger.debug("MigrationMiddleware started")
 
+        cycle_start = monotonic()
         while True:
-            logger.debug("Waiting for cycle to end (30s)")
-            sleep(30)
+            # Cada CHECK_INTERVAL segundos se le pregunta a la politica si migrar
+            triggered = self.wakeup.wait(CHECK_INTERVAL)
+            self.wakeup.clear()
+
             if self.main_server.simulate_server_down:
-                migration_success = False
-            else:
+                cycle_start = monotonic()
+                continue
 
-                logger.debug("Cycle ended, initiating migration")
-                migration_success = self.migrate()
+            load = self.current_load()
+            decision = Decision(True, TRIGGERED) if triggered else self.schedule.decide(monotonic() - cycle_start, load)
+            self.record_decision(decision, load)
+            if not decision.migrate:
+                continue
 
-            if migration_success:
+            logger.debug("Cycle ended, initiating migration")
+            self.metrics.set("migration.schedule.waited_seconds", monotonic() - cycle_start)
+            if self.migrate():
                 logger.debug("Migration successful")
                 break
-            else:
-                logger.debug("Migration failed, repeating cycle")
+
+            logger.debug("Migration failed, repeating cycle")
+            cycle_start = monotonic()
 
     def start(self):
         self.socketio.start_background_task(self.__start)
 
+    def count_message(self, sid, data):
+        self.message_rate.record()
+
+    def on_trigger_migration(self, sid, data):
+        """Comienza la migracion sin esperar a que termine el ciclo"""
+        self.wakeup.set()
+        return False, {"phase": self.phase}
+
+    def on_migration_ready(self, sid, data):
+        """
+        Readiness probe: si llega este evento, el server ya tiene sus handlers y esta atendiendo.
+        Esta listo cuando ademas ya se conecto a las replicas, lo que ocurre en segundo plano
+        """
+        return False, {"ready": self.main_server.replication_middleware.ready.is_set(), "addr": self.main_server.addr}
+
     def on_connect(self, sid, data):
         """
         Cuando se conecta alguien al server,
@@ -223,10 +468,36 @@ class MigrationMiddleware(Middleware):
         else:
             return True, {}
 
+    def on_migrate_precopy(self, sid, data):
+        """Historia copiada antes de pausar. Se responde con lo que ya se tiene, para recibir solo lo que falta"""
+        logger.debug("Migration pre-copy")
+        self.main_server.activate()
+        self.main_server.rooms.load(data["rooms"])
+        self.main_server.replication_middleware.sync_indexes_with_rooms(self.main_server.rooms)
+
+        return False, {"watermarks": self.main_server.rooms.watermarks()}
+
+    def on_host_report(self, sid, data):
+        """Un cliente reporta la capacidad de su maquina y su RTT a este server"""
+        user = self.users.get_user_by_sid(sid)
+        if user is not None:
+            self.targets.report(user.name, data)
+        return False, {}
+
+    def on_migration_report(self, sid, data):
+        for key, value in data.items():
+            self.metrics.set(key, value)
+        logger.info(f"Migration finished, clients were paused for {data['migration.pause_seconds'] * 1000:.1f} ms")
+        return False, {}
+
     def on_migrate(self, sid, data):
         logger.debug("Migration request")
-        self.main_server.messages = data["messages"]
+        self.main_server.activate()
         self.main_server.min_user_count = data["min_user_count"]
-        self.main_server.history_sent = data["history_sent"]
+        self.main_server.rooms.min_user_count = data["min_user_count"]
+        self.main_server.rooms.load(data["rooms"])
+        self.main_server.sessions.load(data.get("sessions", {}))
+        self.main_server.chat_order_middleware.load(data.get("chat_order", {}))
+        self.main_server.replication_middleware.sync_indexes_with_rooms(self.main_server.rooms)
 
         return False, {}
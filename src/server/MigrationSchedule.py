@@ -0,0 +1,115 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from threading import Lock
+from time import monotonic
+from typing import Deque, List, NamedTuple
+
+CHECK_INTERVAL = 1  # seconds
+RATE_WINDOW = 10  # seconds
+
+FIXED = "fixed"
+ADAPTIVE = "adaptive"
+
+# Motivos de cada decision. Cada uno es un contador migration.schedule.<motivo>
+TRIGGERED = "triggered"  # Llego trigger_migration
+INTERVAL = "interval"  # Se cumplio el intervalo fijo
+QUIET = "quiet"  # Hay poca carga
+MAX_INTERVAL = "max_interval"  # Se postergo demasiado, se migra igual
+TOO_SOON = "too_soon"  # Aun no se cumple el intervalo minimo
+BUSY_RATE = "busy_rate"  # Demasiados mensajes por segundo
+BUSY_USERS = "busy_users"  # Demasiados usuarios conectados
+
+
+class Load(NamedTuple):
+    message_rate: float
+    users: int
+
+
+class Decision(NamedTuple):
+    migrate: bool
+    reason: str
+    detail: str = ""
+
+
+class RateMeter:
+    """Mensajes por segundo en los ultimos `window` segundos, contados por segundo"""
+
+    def __init__(self, window: int = RATE_WINDOW) -> None:
+        self.window = window
+        self.lock = Lock()
+
+        # [segundo, cantidad]
+        self.buckets: Deque[List[int]] = deque()
+
+    def record(self, count: int = 1):
+        second = int(monotonic())
+        with self.lock:
+            if self.buckets and self.buckets[-1][0] == second:
+                self.buckets[-1][1] += count
+            else:
+                self.buckets.append([second, count])
+                self.__expire(second)
+
+    def __expire(self, now: int):
+        while self.buckets and self.buckets[0][0] <= now - self.window:
+            self.buckets.popleft()
+
+    def rate(self) -> float:
+        with self.lock:
+            self.__expire(int(monotonic()))
+            return sum(count for _, count in self.buckets) / self.window
+
+
+class SchedulePolicy(ABC):
+    """Decide si migrar ahora, segundos despues de la ultima migracion (o intento) y con la carga actual"""
+
+    @abstractmethod
+    def decide(self, elapsed: float, load: Load) -> Decision:
+        pass
+
+
+class FixedInterval(SchedulePolicy):
+    """Migra cada `interval` segundos, sin importar la carga"""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+
+    def decide(self, elapsed: float, load: Load) -> Decision:
+        if elapsed < self.interval:
+            return Decision(False, TOO_SOON)
+        return Decision(True, INTERVAL)
+
+
+class LoadAdaptive(SchedulePolicy):
+    """
+    Pasado el intervalo minimo, migra apenas la carga baja de los umbrales, ya que
+    pausar a los clientes cuesta menos cuando hay pocos mensajes y usuarios. Si la
+    carga no baja, migra igual al cumplirse el intervalo maximo.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float, max_rate: float, max_users: int) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.max_rate = max_rate
+        self.max_users = max_users
+
+    def decide(self, elapsed: float, load: Load) -> Decision:
+        if elapsed < self.min_interval:
+            return Decision(False, TOO_SOON)
+        if elapsed >= self.max_interval:
+            return Decision(True, MAX_INTERVAL, f"deferred for {elapsed:.0f}s")
+        if load.message_rate > self.max_rate:
+            return Decision(False, BUSY_RATE, f"{load.message_rate:.1f} > {self.max_rate} messages/s")
+        if load.users > self.max_users:
+            return Decision(False, BUSY_USERS, f"{load.users} > {self.max_users} users")
+        return Decision(True, QUIET, f"{load.message_rate:.1f} messages/s, {load.users} users")
+
+
+def make_policy(
+    name: str, interval: float, max_interval: float = 120, max_rate: float = 50, max_users: int = 500
+) -> SchedulePolicy:
+    if name == FIXED:
+        return FixedInterval(interval)
+    if name == ADAPTIVE:
+        return LoadAdaptive(interval, max_interval, max_rate, max_users)
+    raise ValueError(f"Unknown migration policy {name}")
@@ -0,0 +1,93 @@
+from random import random
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional
+
+REPORT_TTL = 30  # seconds
+BLACKLIST_SECONDS = 300
+
+# Peso de cada dato del reporte en el puntaje de un candidato:
+# nucleos libres, memoria disponible (GB) y RTT al server (ms)
+DEFAULT_WEIGHTS = {"cores": 1.0, "memory_gb": 0.5, "rtt_ms": -0.05}
+
+
+def parse_weights(text: str) -> Dict[str, float]:
+    """'cores=1,rtt_ms=-0.1' -> {"cores": 1.0, "rtt_ms": -0.1}. Lo que no se indica queda con su peso por defecto"""
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in filter(None, text.split(",")):
+        key, value = item.split("=")
+        if key.strip() not in DEFAULT_WEIGHTS:
+            raise ValueError(f"Unknown weight {key}, expected one of {', '.join(DEFAULT_WEIGHTS)}")
+        weights[key.strip()] = float(value)
+    return weights
+
+
+class MigrationTargets:
+    """
+    Capacidad y RTT que reporta cada cliente de su maquina, para elegir donde
+    levantar el nuevo server al migrar. Los candidatos se ordenan por puntaje, y
+    los que fallaron hace poco quedan en una lista negra por un tiempo.
+    """
+
+    def __init__(
+        self,
+        weights: Dict[str, float] = None,
+        report_ttl: float = REPORT_TTL,
+        blacklist_seconds: float = BLACKLIST_SECONDS,
+    ) -> None:
+        self.weights = weights or dict(DEFAULT_WEIGHTS)
+        self.report_ttl = report_ttl
+        self.blacklist_seconds = blacklist_seconds
+        self.lock = Lock()
+
+        # { username: (reporte, cuando llego) }
+        self.reports: Dict[str, tuple] = {}
+
+        # { username: hasta cuando esta en la lista negra }
+        self.blacklisted: Dict[str, float] = {}
+
+    def report(self, name: str, data: dict):
+        with self.lock:
+            self.reports[name] = (data, monotonic())
+
+    def blacklist(self, name: str):
+        with self.lock:
+            self.blacklisted[name] = monotonic() + self.blacklist_seconds
+
+    def is_blacklisted(self, name: str) -> bool:
+        with self.lock:
+            until = self.blacklisted.get(name)
+            if until is not None and until <= monotonic():
+                del self.blacklisted[name]
+                until = None
+        return until is not None
+
+    def score(self, name: str) -> Optional[float]:
+        """Puntaje de un candidato segun su ultimo reporte. None si no hay uno reciente"""
+        with self.lock:
+            report, received = self.reports.get(name, (None, 0))
+        if report is None or monotonic() - received > self.report_ttl:
+            return None
+
+        cores = report.get("cores") or 1
+        load = report.get("load")
+        values = {
+            "cores": max(cores - load, 0) if load is not None else cores,
+            "memory_gb": report.get("memory_gb") or 0,
+            "rtt_ms": report.get("rtt_ms") or 0,
+        }
+        return sum(self.weights[key] * value for key, value in values.items())
+
+    def rank(self, names: List[str]) -> List[str]:
+        """
+        Candidatos de mejor a peor, sin los de la lista negra. Los que no han
+        reportado van al final, en orden aleatorio, igual que antes
+        """
+        scored = []
+        for name in names:
+            if self.is_blacklisted(name):
+                continue
+            score = self.score(name)
+            # Los que no tienen puntaje quedan despues de todos los que si
+            scored.append((score is not None, score if score is not None else random(), name))
+        return [name for *_, name in sorted(scored, reverse=True)]
@@ -0,0 +1,111 @@
+from threading import Lock
+from time import monotonic, sleep
+from typing import Dict, Tuple
+
+from ..utils.Logger import getServerLogger
+from ..utils.Middleware import Middleware
+from ..utils.TokenBucket import TokenBucket
+from .Users import UserList
+
+logger = getServerLogger("RateLimitMiddleware")
+
+REJECT = "reject"
+DEFER = "defer"
+
+
+class RateLimitMiddleware(Middleware):
+    """
+    Middleware encargado de limitar la tasa de mensajes de chat, por usuario y global.
+    Va antes de la replicacion, para que un mensaje rechazado no cueste nada mas.
+    """
+
+    def __init__(
+        self,
+        users: UserList,
+        *args,
+        user_rate: float = 0,
+        user_burst: float = 1,
+        global_rate: float = 0,
+        global_burst: float = 1,
+        mode: str = REJECT,
+        max_defer: float = 1.0,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.users = users
+
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.mode = mode
+        self.max_defer = max_defer
+
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+
+        # { username: TokenBucket }
+        self.user_buckets: Dict[str, TokenBucket] = {}
+        self.buckets_lock = Lock()
+
+        self.handlers = {
+            "chat": self.chat,
+            "disconnect": self.disconnect,
+        }
+
+    @property
+    def metrics(self):
+        return self.main_server.metrics
+
+    def get_user_bucket(self, key: str) -> TokenBucket:
+        bucket = self.user_buckets.get(key)
+        if bucket is None:
+            with self.buckets_lock:
+                bucket = self.user_buckets.setdefault(key, TokenBucket(self.user_rate, self.user_burst))
+        return bucket
+
+    def try_acquire(self, key: str) -> Tuple[bool, float, str]:
+        """Consume un token del usuario y uno global. Retorna (ok, segundos a esperar, bucket que rechazo)"""
+        user_bucket = self.get_user_bucket(key)
+
+        ok, wait = user_bucket.try_acquire()
+        if not ok:
+            return False, wait, "user"
+
+        ok, wait = self.global_bucket.try_acquire()
+        if not ok:
+            # No se alcanzo a usar el token del usuario
+            user_bucket.refund()
+            return False, wait, "global"
+
+        return True, 0, ""
+
+    def chat(self, sid: str, data: dict):
+        user = self.users.get_user_by_sid(sid)
+        key = user.name if user else sid
+
+        ok, wait, limited_by = self.try_acquire(key)
+
+        if not ok and self.mode == DEFER:
+            # Se retiene el mensaje mientras la espera no supere max_defer
+            deadline = monotonic() + self.max_defer
+            while not ok and monotonic() + wait <= deadline:
+                self.metrics.incr("rate_limit.deferred")
+                sleep(wait)
+                ok, wait, limited_by = self.try_acquire(key)
+
+        if ok:
+            self.metrics.incr("rate_limit.allowed")
+            return True, {}
+
+        logger.debug(f"Rate limited message from {key} ({limited_by})")
+        self.metrics.incr("rate_limit.rejected")
+        self.metrics.incr(f"rate_limit.rejected.{limited_by}")
+        return False, {"status": "rate_limited", "retry_after": wait}
+
+    def disconnect(self, sid: str, _):
+        user = self.users.get_user_by_sid(sid)
+        key = user.name if user else sid
+
+        # Si el bucket ya esta lleno, no hay nada que recordar del usuario
+        with self.buckets_lock:
+            bucket = self.user_buckets.get(key)
+            if bucket is not None and bucket.is_full():
+                del self.user_buckets[key]
@@ -1,146 +1,587 @@
-from threading import Lock
+from collections import defaultdict
+from random import uniform
+from threading import Condition, Event, Lock
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Set, Tuple
 
 from socketio.client import Client
 
-from src.utils.networking import request_replica_addr
+from src.utils.networking import request_replica_addrs
 
+from .IndexLeases import IndexLeases
+from .ReplicationStream import BATCH_EVENT, ReplicationReceiver, ReplicationStream
+from .Rooms import DEFAULT_ROOM, RoomList
+from .UserRegistry import Delta, RegistryChanges, user_record
 from .Users import UserList
+from ..utils.HybridClock import HybridLogicalClock
 from ..utils.Logger import getServerLogger
 from ..utils.Middleware import Middleware
 
 logger = getServerLogger("ReplicationMiddleware")
 
+LEASE_TIMEOUT = 2  # seconds
+LEASE_ATTEMPTS = 5
+LEASE_RETRY_AFTER = 1  # seconds
+CATCH_UP_BATCH = 256  # messages
+REGISTRY_FLUSH_INTERVAL = 0.05  # seconds
+REGISTRY_BATCH = 512  # users
+REPLICAS_READY_TIMEOUT = 5  # seconds
+
+# Formas de ordenar los mensajes
+LEASES = "lease"  # Indices arrendados a la mayoria
+HLC = "hlc"  # Stamps de un reloj logico hibrido, sin coordinacion
+
+
+class LeaseUnavailable(Exception):
+    """No se pudo arrendar un bloque de indices, por lo que el mensaje no se puede ordenar aun"""
+
+    def __init__(self, room: str, retry_after: float = LEASE_RETRY_AFTER) -> None:
+        super().__init__(f"Could not lease indexes of room {room}")
+        self.retry_after = retry_after
+
+
+class Replica:
+    """Conexion hacia otra replica: su cliente socketio y el stream de replicacion hacia ella"""
+
+    def __init__(self, addr: str, client: Client) -> None:
+        self.addr = addr
+        self.client = client
+        self.stream: ReplicationStream = None
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.client and self.client.connected)
+
+    def close(self):
+        if self.stream:
+            self.stream.close()
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
 
 class ReplicationMiddleware(Middleware):
-    """Este sería el middleware encargado de manejar la replicación de los servidores"""
+    """
+    Este sería el middleware encargado de manejar la replicación de los servidores.
 
-    def __init__(self, users: UserList, *args, **kwargs):
+    Cada servidor tiene una conexion hacia cada una de las otras replicas. Los indices
+    se arriendan con la aceptacion de una mayoria (contando a este servidor), por lo
+    que una minoria lenta o caida no detiene la asignacion de indices.
+    """
+
+    def __init__(self, users: UserList, *args, lease_size: int = 0, ordering: str = LEASES, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.replica_client = None
+        # Usuarios locales que cambiaron y aun no se mandan a las replicas
+        self.registry = RegistryChanges()
         self.users = users
 
+        # { addr: Replica } Replicas conocidas, esten conectadas o no
+        self.replicas: Dict[str, Replica] = {}
+        self.replicas_lock = Lock()
+
+        # { origin: ReplicationReceiver } Un receptor por cada replica que manda su stream
+        self.receivers: Dict[str, ReplicationReceiver] = {}
+
+        # Cada sala tiene su propia secuencia de indices
         self.index_lock = Lock()
-        self.next_index = 0
+        self.next_indexes: Dict[str, int] = defaultdict(int)
+
+        # Los indices se asignan localmente desde bloques arrendados a la mayoria.
+        # Con lease_size 0 se arrienda un indice a la vez, es decir, cada mensaje espera a la mayoria
+        self.lease_size = lease_size
+        self.leases = IndexLeases(max(lease_size, 1))
+        self.renewing: Set[str] = set()
+        self.publish_lock = Lock()
+
+        # { room: ultimo indice asignado por este server } Cada mensaje lleva el anterior
+        # de su origen, para que las replicas sepan si les falta alguno
+        self.last_published: Dict[str, int] = {}
+
+        # Con ordering HLC el indice de un mensaje es su stamp, y no se arrienda nada
+        self.ordering = ordering
+        self.clock = HybridLogicalClock(self.main_server.addr)
 
         self.handlers = {
-            "chat": self.chat,
+            "chat": self.chat if ordering == LEASES else self.chat_hlc,
             "connect": self.connect,
-            "disconnect": self.disconnect,
             "connect_other_server": self.connect_other,
-            "sync_next_index": self.on_sync_next_index,
-            "update_p2p_uri": self.update_p2p_uri,
-            "disconnect_other_server": self.disconnect_other_server,
+            "lease_index_block": self.on_lease_index_block,
+            "replicate_message": self.on_replicate_message,
+            BATCH_EVENT: self.on_replication_batch,
+            "catch_up_request": self.on_catch_up_request,
+            "catch_up_batch": self.on_catch_up_batch,
         }
 
-        self.connect_replica()
+        # Se desactiva mientras se conecta a las replicas del DNS (ver start). Si no hay
+        # replicas a las que conectarse (e.g. un standby, que no se conecta hasta que una
+        # migracion lo toma), no hay nada que esperar
+        self.ready = Event()
+        self.ready.set()
+        self.socketio.start_background_task(self.__flush_registry)
+
+    def start(self):
+        """Se conecta a las replicas en segundo plano, para no retrasar que el server comience a atender"""
+        if not self.main_server.standby:
+            self.ready.clear()
+            self.socketio.start_background_task(self.__connect_replicas)
+
+    def __connect_replicas(self):
+        try:
+            self.connect_replica()
+        except Exception as e:
+            logger.error(f"Error connecting to replicas: {e}")
+        finally:
+            self.ready.set()
+            self.metrics.set("startup.replicas_ready_seconds", self.main_server.startup.elapsed())
+
+    @property
+    def users(self) -> UserList:
+        return self.__users
+
+    @users.setter
+    def users(self, users: UserList):
+        # Cada cambio de un usuario local se manda en el siguiente delta
+        self.__users = users
+        users.on_local_change = self.registry.touch
+
+    @property
+    def metrics(self):
+        return self.main_server.metrics
+
+    @property
+    def cluster_size(self) -> int:
+        return len(self.replicas) + 1
+
+    @property
+    def quorum(self) -> int:
+        return self.cluster_size // 2 + 1
+
+    def connected_replicas(self) -> List[Replica]:
+        with self.replicas_lock:
+            return [replica for replica in self.replicas.values() if replica.connected]
+
+    def __update_membership(self):
+        self.metrics.set("replication.cluster_size", self.cluster_size)
+        self.metrics.set("replication.connected_replicas", len(self.connected_replicas()))
 
     def simulate_down(self):
-        if self.replica_client:
-            self.replica_client.disconnect()
-            self.replica_client = None
+        with self.replicas_lock:
+            replicas = list(self.replicas.values())
+            self.replicas.clear()
+
+        for replica in replicas:
+            replica.close()
+        self.__update_membership()
+
+        if replicas:
             self.socketio.emit("disconnect_other_server")
 
-    def disconnect_other_server(self):
-        self.replica_client.disconnect()
-        self.replica_client = None
+    def remove_replica(self, addr: str):
+        """La replica dejo el cluster, por lo que ya no cuenta para la mayoria"""
+        with self.replicas_lock:
+            replica = self.replicas.pop(addr, None)
+
+        if replica:
+            logger.debug(f"Replica {addr} left the cluster")
+            replica.close()
+            self.users.drop_replicated(addr)
+            self.__update_membership()
+
+    def refresh_replicas(self):
+        """
+        Se olvidan las replicas desconectadas que ya no estan en el DNS (e.g. si migraron).
+        Las que siguen registradas cuentan como caidas, pero siguen siendo parte de la mayoria.
+        """
+        try:
+            registered = set(
+                request_replica_addrs(
+                    self.main_server.dns_host,
+                    self.main_server.dns_port,
+                    self.main_server.addr,
+                    self.main_server.server_uri,
+                )
+            )
+        except Exception as e:
+            logger.error(f"Could not refresh replicas: {e}")
+            return
+
+        with self.replicas_lock:
+            gone = [addr for addr, replica in self.replicas.items() if addr not in registered and not replica.connected]
+        for addr in gone:
+            self.remove_replica(addr)
+        self.__update_membership()
+
+    def new_replica_client(self, addr: str) -> Client:
+        client = Client()
+        # Si la replica se apaga, deja el cluster
+        client.on("disconnect_other_server", lambda *_: self.remove_replica(addr))
+        # Si se pierde la conexion, se revisa si la replica sigue registrada
+        client.on("disconnect", lambda *_: self.socketio.start_background_task(self.refresh_replicas))
+        return client
+
+    def attach_replica(self, addr: str, client: Client) -> Replica:
+        """Registra la conexion hacia una replica, reemplazando la anterior si existia"""
+        replica = Replica(addr, client)
+        replica.stream = ReplicationStream(
+            self.socketio.start_background_task,
+            lambda: replica.client,
+            self.metrics,
+            self.main_server.addr,
+            f"replication.{addr}",
+        )
+
+        with self.replicas_lock:
+            old = self.replicas.get(addr)
+            self.replicas[addr] = replica
+
+        if old:
+            old.close()
+        self.__update_membership()
+        return replica
+
+    def add_replica(self, addr: str, announce: bool = False) -> Optional[Replica]:
+        client = self.new_replica_client(addr)
+        # Aqui tenemos un cliente para comunicarnos con la replica
+        try:
+            client.connect(addr, auth={"replica_addr": self.main_server.addr})
+        except Exception as e:
+            logger.error(f"Could not connect to replica {addr}: {e}")
+            return None
+
+        replica = self.attach_replica(addr, client)
+        # Al reconectarse (la conexion inicial ya se hizo) la replica pudo haberse reiniciado
+        client.on("connect", lambda *_: replica.stream.reset())
+        if announce:
+            client.emit(
+                "connect_other_server",
+                data={"replica_addr": self.main_server.addr, "watermarks": self.main_server.rooms.watermarks()},
+            )
+        return replica
 
     def connect_replica(self):
-        replica_address = request_replica_addr(
+        """Se conecta a todas las otras replicas registradas en el DNS"""
+        replica_addresses = request_replica_addrs(
             self.main_server.dns_host, self.main_server.dns_port, self.main_server.addr, self.main_server.server_uri
-        )  # Se obtiene el address de la replica
-        if replica_address:
-            print("\nConnecting to replica server")
-            self.replica_client = Client()
-            # Aqui tenemos un cliente para comunicarnos con la replica
-            try:
-                self.replica_client.connect(
-                    lambda *_: request_replica_addr(
-                        self.main_server.dns_host,
-                        self.main_server.dns_port,
-                        self.main_server.addr,
-                        self.main_server.server_uri,
-                    ),
-                    auth={"replica_addr": self.main_server.addr},
-                )
-                self.replica_client.emit("connect_other_server", data={"replica_addr": self.main_server.addr})
-            except Exception:
-                pass
+        )  # Se obtienen los address de las replicas
+        for addr in replica_addresses:
+            print(f"\nConnecting to replica server {addr}")
+            self.add_replica(addr, announce=True)
 
-    def update_p2p_uri(self, sid, data):
-        if self.replica_client and self.replica_client.connected:
-            self.replica_client.emit("update_p2p_uri_replica", data)
-        return False
+    def replicate(self, event: str, data):
+        """
+        Manda un evento a todas las replicas, cada una por su stream. Tambien a las
+        desconectadas: su stream lo manda cuando el cliente socketio se reconecte
+        """
+        with self.replicas_lock:
+            replicas = list(self.replicas.values())
+        for replica in replicas:
+            replica.stream.publish(event, data)
 
-    def disconnect(self, sid, _):
+    def replicate_to(self, addr: str, event: str, data):
+        replica = self.replicas.get(addr)
+        if replica:
+            replica.stream.publish(event, data)
 
-        client = self.users.get_user_by_sid(sid)
-        if client:
-            if self.replica_client and self.replica_client.connected:
-                self.replica_client.emit("disconnect_synced_user", sid)
+    def on_replication_batch(self, sid: str, data: dict):
+        origin = data.get("origin")
+        receiver = self.receivers.get(origin)
+        if receiver is None:
+            receiver = self.receivers.setdefault(
+                origin, ReplicationReceiver(self.main_server.handle, self.metrics, f"replication.{origin}")
+            )
+        ack = receiver.receive(sid, data)
+        return False, {"ack": ack}
+
+    def local_user_record(self, name: str) -> Optional[dict]:
+        user = self.users.get_user_by_name(name)
+        if user and not user.replicated and not user.disconnected:
+            return user_record(user)
+        return None
+
+    def __flush_registry(self):
+        """Manda a las replicas, en batches, el estado actual de los usuarios locales que cambiaron"""
+        while True:
+            self.registry.wait()
+            # Se juntan los cambios de una ventana, para no mandar uno por cada usuario
+            sleep(REGISTRY_FLUSH_INTERVAL)
+
+            names = self.registry.drain()
+            for i in range(0, len(names), REGISTRY_BATCH):
+                delta: Delta = {name: self.local_user_record(name) for name in names[i : i + REGISTRY_BATCH]}
+                self.replicate("sync_users_delta", {"origin": self.main_server.addr, "users": delta})
+                self.metrics.incr("registry.delta_batches")
+            self.metrics.incr("registry.delta_users", len(names))
+
+    def ship_user_snapshot(self, addr: str):
+        """Manda a una replica todos los usuarios conectados a este servidor"""
+        users = {user.name: user_record(user) for user in self.users.local_users()}
+        self.replicate_to(addr, "sync_users_snapshot", {"origin": self.main_server.addr, "users": users})
+        self.metrics.incr("registry.snapshot_users", len(users))
 
     def connect_other(self, sid: str, data: dict):
-        if self.replica_client:
-            self.replica_client.disconnect()
-        else:
-            self.replica_client = Client()
+        """Otra replica se unio al cluster (o volvio), por lo que se conecta de vuelta a ella"""
+        addr = data["replica_addr"]
+        replica = self.add_replica(addr)
+        if replica is None:
+            return
 
-        self.replica_client.connect(data["replica_addr"], auth={"replica_addr": self.main_server.addr})
+        # Anti-entropia: se manda a la replica lo que le falta, y se le pide lo que le falta a este server
+        self.ship_user_snapshot(addr)
+        self.ship_missing(addr, data.get("watermarks", {}))
+        replica.client.emit(
+            "catch_up_request",
+            {"replica_addr": self.main_server.addr, "watermarks": self.main_server.rooms.watermarks()},
+        )
+
+    def ship_missing(self, addr: str, watermarks: dict):
+        """
+        Manda por el stream, en batches, los mensajes que no tiene una replica.
+        watermarks tiene, por sala, el mayor indice de cada origen hasta el cual la replica
+        tiene todos sus mensajes.
+        """
+        shipped = 0
+        for room in self.main_server.rooms:
+            missing = room.messages_missing_from(watermarks.get(room.name, {}))
+            for i in range(0, len(missing), CATCH_UP_BATCH):
+                batch = missing[i : i + CATCH_UP_BATCH]
+                self.replicate_to(addr, "catch_up_batch", {"room": room.name, "messages": batch})
+            shipped += len(missing)
+
+        logger.debug(f"Shipping {shipped} messages to catch up the replica {addr}")
+        self.metrics.incr("catch_up.shipped_messages", shipped)
+
+    def on_catch_up_request(self, sid: str, data: dict):
+        self.ship_user_snapshot(data["replica_addr"])
+        self.ship_missing(data["replica_addr"], data["watermarks"])
+        return False
+
+    def on_catch_up_batch(self, sid: str, data: dict):
+        room = self.main_server.rooms.get_room(data["room"])
+
+        received = 0
+        for index, message in data["messages"]:
+            if room.add_message(
+                index, message["username"], message["message"], message.get("origin"), message.get("prev")
+            ):
+                received += 1
+            self.observe_index(room.name, index)
+
+        self.metrics.incr("catch_up.received_messages", received)
+        return False
 
     def connect(self, sid: str, data: dict):
         if "replica_addr" in data:
             return False, {}
-        else:
-            # User connected
-            if "username" in data:
-                if self.replica_client and self.replica_client.connected:
-                    self.replica_client.emit("sync_new_user", data)
-            return None
+        return None
+
+    def sync_indexes_with_rooms(self, rooms: RoomList):
+        """Avanza la secuencia de cada sala mas alla de los mensajes ya registrados (e.g. al migrar)"""
+        for room in rooms:
+            last_index = room.next_free_index() - 1
+            if last_index >= 0:
+                self.observe_index(room.name, last_index)
 
-    def on_sync_next_index(self, sid: str, data: dict):
-        # Calcular el indice a asignar
+    def observe_index(self, room: str, index: int):
+        """Registra un indice asignado por otro servidor, para que los siguientes indices locales queden despues"""
+        if self.ordering == HLC:
+            self.clock.observe(index)
+            return
+
+        self.leases.observe(room, index)
         with self.index_lock:
-            # Indice a asignar segun otro server
-            remote_next_index = data["message_index"]
+            self.next_indexes[room] = max(self.next_indexes[room], index + 1)
+
+    def request_votes(self, replicas: List[Replica], event: str, data: dict, needed: int) -> Tuple[bool, List[int]]:
+        """
+        Manda la propuesta a las replicas y espera solo hasta que `needed` la acepten (o ya no puedan).
+        Retorna si se alcanzo el quorum, y el lease_high de las replicas que la rechazaron.
+        """
+        votes = Condition()
+        granted: List[int] = []
+        rejected: List[int] = []
+
+        def on_vote(response: dict):
+            with votes:
+                if response["granted"]:
+                    granted.append(response["lease_high"])
+                else:
+                    rejected.append(response["lease_high"])
+                votes.notify()
+
+        sent = 0
+        for replica in replicas:
+            try:
+                replica.client.emit(event, data, callback=on_vote)
+                sent += 1
+            except Exception as e:
+                logger.error(f"Lease request to {replica.addr} failed: {e}")
+
+        deadline = monotonic() + LEASE_TIMEOUT
+        with votes:
+            # Se deja de esperar si ya se tiene la mayoria o si los rechazos la hacen imposible
+            while len(granted) < needed and sent - len(rejected) >= needed:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                votes.wait(remaining)
+            return len(granted) >= needed, list(rejected)
+
+    def acquire_lease(self, room: str):
+        """
+        Arrienda un nuevo bloque de indices para la sala. El bloque se propone a
+        todas las replicas y basta con que lo acepte una mayoria. Dos mayorias
+        siempre tienen una replica en comun, y esta nunca acepta dos bloques que
+        se solapen. Si lo rechazan (porque ya aceptaron o arrendaron algo encima),
+        se vuelve a proponer mas arriba.
+
+        Nunca se usa un bloque sin la mayoria: si no esta conectada, o no responde
+        despues de LEASE_ATTEMPTS intentos, se lanza LeaseUnavailable.
+        """
+        # Antes de conectarse a las replicas este server creeria estar solo
+        self.ready.wait(REPLICAS_READY_TIMEOUT)
+
+        failures = 0
+        while True:
+            start, end = self.leases.propose(room)
+            replicas = self.connected_replicas()
+
+            if not self.replicas:
+                # Sin replicas, este server asigna indices solo
+                self.leases.grant(room, start, end)
+                return
+
+            if len(replicas) < self.quorum - 1:
+                # Sin la mayoria (e.g. en una particion) otro lado podria arrendar los mismos indices
+                self.metrics.incr("replication.quorum_failures")
+                raise LeaseUnavailable(room)
 
-            # Indice a asignar segun este server
-            local_next_index = self.next_index
+            if failures >= LEASE_ATTEMPTS:
+                raise LeaseUnavailable(room)
 
-            # Indice a asignar segun ambos
-            next_index = max(remote_next_index, local_next_index)
+            began = monotonic()
+            granted, rejections = self.request_votes(
+                replicas,
+                "lease_index_block",
+                {"room": room, "start": start, "end": end},
+                self.quorum - 1,  # Este server ya acepto su propia propuesta
+            )
+            self.metrics.set("replication.quorum_wait_seconds", monotonic() - began)
 
-            # Actualizar localmente el siguiente indice
-            self.next_index = max(self.next_index, next_index) + 1
+            if granted:
+                logger.debug(f"Leased indexes [{start}, {end}) of room {room}")
+                self.leases.grant(room, start, end)
+                return
 
-        return {"next_index": next_index}
+            if rejections:
+                # Otro server propuso a la vez, se reintenta desde lo que las replicas ya tienen
+                self.metrics.incr("replication.lease_rejections")
+                self.leases.raise_high(room, max(rejections))
+                sleep(uniform(0, 0.01))
+            else:
+                self.metrics.incr("replication.quorum_failures")
+                failures += 1
+
+    def __renew_lease(self, room: str):
+        try:
+            self.acquire_lease(room)
+        except LeaseUnavailable as e:
+            # Se vuelve a intentar cuando se acabe el bloque actual
+            logger.debug(str(e))
+        finally:
+            with self.index_lock:
+                self.renewing.discard(room)
+
+    def renew_lease_if_needed(self, room: str):
+        """Arrienda el siguiente bloque en el fondo antes de que se acabe el actual"""
+        if self.lease_size <= 1:
+            return
+
+        with self.index_lock:
+            if room in self.renewing or not self.leases.needs_renewal(room):
+                return
+            self.renewing.add(room)
+        self.socketio.start_background_task(self.__renew_lease, room)
+
+    def on_lease_index_block(self, sid: str, data: dict):
+        granted, lease_high = self.leases.accept(data["room"], data["start"], data["end"])
+        return False, {"granted": granted, "lease_high": lease_high}
+
+    def on_replicate_message(self, sid: str, data: dict):
+        """Mensaje con indice ya asignado por otra replica. Se pasa al ServerMiddleware para registrarlo"""
+        self.observe_index(data.get("room", DEFAULT_ROOM), data["message_index"])
+        return True
 
     def chat(self, sid: str, data: dict):
         """
         Si llega un evento 'chat', se procesa por aca y se le asigna el indice correspondiente.
-        El mensaje se pasa al siguiente middleware para que eventualmente sea procesado por el
-        servidor de chat.
+        El indice se saca de un bloque arrendado, por lo que solo se espera a la mayoria
+        cuando se acaban. El mensaje se manda a las replicas ya indexado, y se pasa al
+        siguiente middleware para que eventualmente sea procesado por el servidor de chat.
         """
-        if not "client_name" in data:
+        if not "client_name" in data or not "room" in data:
             client = self.users.get_user_by_sid(sid)
 
             if client is None:
                 return False, {}
 
             data["client_name"] = client.name
+            data["room"] = client.room
 
-        def callback(response: dict):
-            with self.index_lock:
-                self.next_index = max(self.next_index, response["next_index"]) + 1
+        room = data["room"]
+        data["origin"] = self.main_server.addr
+
+        while True:
+            # El indice se saca y se publica de forma atomica, para que las replicas
+            # reciban los indices de este origen en orden creciente
+            with self.publish_lock:
+                index = self.leases.take(room)
+                if index is not None:
+                    data["message_index"] = index
+                    data["prev_index"] = self.last_published.get(room, -1)
+                    self.last_published[room] = index
+                    self.replicate("replicate_message", dict(data))
+                    break
 
-        if self.replica_client and self.replica_client.connected:
+            # Solo se espera a la mayoria si se acabaron los indices arrendados
             try:
-                with self.index_lock:
-                    logger.debug(f"Sending new message to replica")
-                    data["message_index"] = self.next_index
-                    self.replica_client.emit("sync_next_index", data, callback=callback)
-            except Exception:
-                pass
-        else:
-            data["message_index"] = self.next_index
-            self.next_index = self.next_index + 1
+                self.acquire_lease(room)
+            except LeaseUnavailable as e:
+                # El cliente reintenta el mensaje despues de retry_after
+                logger.debug(str(e))
+                self.metrics.incr("replication.lease_unavailable")
+                return False, {"status": "unavailable", "retry_after": e.retry_after}
+
+        with self.index_lock:
+            self.next_indexes[room] = max(self.next_indexes[room], index + 1)
+
+        self.renew_lease_if_needed(room)
+        return data
+
+    def chat_hlc(self, sid: str, data: dict):
+        """
+        Igual que chat, pero el indice es el stamp del reloj logico hibrido de este
+        server, por lo que nunca se espera a otra replica. Todas las replicas ordenan
+        los mensajes de la misma forma, ya que el stamp incluye el id del servidor.
+        """
+        if not "client_name" in data or not "room" in data:
+            client = self.users.get_user_by_sid(sid)
+
+            if client is None:
+                return False, {}
+
+            data["client_name"] = client.name
+            data["room"] = client.room
+
+        room = data["room"]
+        data["origin"] = self.main_server.addr
+
+        # Igual que con los arriendos, los stamps de este origen se publican en orden
+        with self.publish_lock:
+            data["message_index"] = self.clock.now_packed()
+            data["prev_index"] = self.last_published.get(room, -1)
+            self.last_published[room] = data["message_index"]
+            self.replicate("replicate_message", dict(data))
+
         return data
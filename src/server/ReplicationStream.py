@@ -0,0 +1,203 @@
+from collections import deque
+from threading import Condition, Lock
+from time import time
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from socketio import Client
+
+from ..utils.Logger import getServerLogger
+from ..utils.Metrics import Metrics
+
+logger = getServerLogger("ReplicationStream")
+
+BATCH_EVENT = "replication_batch"
+
+# [seq, event, data, timestamp]
+Entry = Tuple[int, str, object, float]
+
+
+class ReplicationStream:
+    """
+    Stream ordenado de eventos hacia una replica. Cada entrada tiene un numero
+    de secuencia, las entradas acumuladas se mandan en un solo batch, y sin
+    esperar el ack del batch anterior. La replica responde con un ack acumulativo
+    (la mayor secuencia aplicada en orden). Si un ack no llega a tiempo, se
+    reenvia todo lo que no ha sido confirmado.
+    """
+
+    def __init__(
+        self,
+        start_background_task: Callable,
+        get_client: Callable[[], Optional[Client]],
+        metrics: Metrics,
+        origin: str,
+        metrics_prefix: str = "replication",
+        max_batch: int = 256,
+        max_in_flight: int = 4096,
+        retransmit_timeout: float = 2.0,
+    ) -> None:
+        self.get_client = get_client
+        self.metrics = metrics
+        self.origin = origin
+        self.prefix = metrics_prefix
+        self.max_batch = max_batch
+        self.max_in_flight = max_in_flight
+        self.retransmit_timeout = retransmit_timeout
+
+        self.condition = Condition(Lock())
+        self.session = uuid4().hex
+        self.next_seq = 1
+        self.acked = 0
+        self.sent_upto = 0
+        self.last_send = 0.0
+        self.closed = False
+
+        # Entradas aun no confirmadas por la replica, en orden
+        self.pending: Deque[Entry] = deque()
+
+        start_background_task(self.__run)
+
+    def publish(self, event: str, data) -> int:
+        """Agrega un evento al stream. Retorna su numero de secuencia"""
+        with self.condition:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.pending.append((seq, event, data, time()))
+            self.condition.notify()
+        return seq
+
+    def reset(self):
+        """
+        Comienza una nueva sesion (e.g. al reconectarse a la replica, que pudo haberse
+        reiniciado y no conocer la sesion anterior). Lo pendiente se numera de nuevo
+        desde 1 y se vuelve a mandar completo, ya que no se sabe que alcanzo a aplicar.
+        """
+        with self.condition:
+            self.session = uuid4().hex
+            self.pending = deque(
+                (seq, event, data, timestamp) for seq, (_, event, data, timestamp) in enumerate(self.pending, 1)
+            )
+            self.next_seq = len(self.pending) + 1
+            self.acked = 0
+            self.sent_upto = 0
+            self.__update_lag()
+            self.condition.notify()
+
+    def close(self):
+        """Detiene el envio (e.g. si la replica deja el cluster)"""
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.condition.notify()
+
+    def on_ack(self, session: str, ack: int):
+        with self.condition:
+            if session != self.session or ack <= self.acked:
+                return
+
+            self.acked = ack
+            while self.pending and self.pending[0][0] <= ack:
+                self.pending.popleft()
+            self.__update_lag()
+            self.condition.notify()
+
+    def __update_lag(self):
+        self.metrics.set(f"{self.prefix}.sent_seq", self.sent_upto)
+        self.metrics.set(f"{self.prefix}.acked_seq", self.acked)
+        self.metrics.set(f"{self.prefix}.lag_entries", self.next_seq - 1 - self.acked)
+        self.metrics.set(f"{self.prefix}.lag_seconds", time() - self.pending[0][3] if self.pending else 0)
+
+    def __next_batch(self) -> Tuple[str, List[Entry]]:
+        """Espera hasta que haya algo que mandar (o reenviar) y lo saca. Retorna (None, []) si se cerro"""
+        with self.condition:
+            while True:
+                if self.closed:
+                    return None, []
+
+                if self.pending and self.acked < self.sent_upto:
+                    if time() - self.last_send > self.retransmit_timeout:
+                        # No llego el ack a tiempo: se reenvia desde lo ultimo confirmado
+                        logger.debug(f"Retransmitting from {self.acked + 1}")
+                        self.metrics.incr(f"{self.prefix}.retransmits")
+                        self.sent_upto = self.acked
+
+                unsent = self.next_seq - 1 - self.sent_upto
+                in_flight = self.sent_upto - self.acked
+                if unsent > 0 and in_flight < self.max_in_flight:
+                    first = self.sent_upto - self.acked
+                    batch = [self.pending[i] for i in range(first, min(first + self.max_batch, len(self.pending)))]
+                    self.sent_upto = batch[-1][0]
+                    self.last_send = time()
+                    self.__update_lag()
+                    return self.session, batch
+
+                self.condition.wait(self.retransmit_timeout if self.pending else None)
+
+    def __run(self):
+        while True:
+            session, batch = self.__next_batch()
+            if session is None:
+                return
+
+            client = self.get_client()
+            if not client or not client.connected:
+                # Sin replica no hay a quien mandar, se espera al reintento
+                continue
+
+            try:
+                self.metrics.incr(f"{self.prefix}.batches")
+                self.metrics.incr(f"{self.prefix}.entries", len(batch))
+                client.emit(
+                    BATCH_EVENT,
+                    {"origin": self.origin, "session": session, "entries": batch},
+                    callback=lambda response, session=session: self.on_ack(session, response["ack"]),
+                )
+            except Exception as e:
+                logger.error(f"Error sending replication batch: {e}")
+
+
+class ReplicationReceiver:
+    """Aplica en orden las entradas que llegan de una replica y calcula el ack acumulativo"""
+
+    def __init__(
+        self, apply: Callable[[str, str, object], None], metrics: Metrics, metrics_prefix: str = "replication"
+    ) -> None:
+        self.apply = apply
+        self.metrics = metrics
+        self.prefix = metrics_prefix
+        self.lock = Lock()
+
+        self.session = None
+        self.applied = 0
+
+        # Entradas que llegaron antes que alguna anterior
+        self.buffer: Dict[int, Entry] = {}
+
+    def receive(self, sid: str, batch: dict) -> int:
+        with self.lock:
+            if batch["session"] != self.session:
+                self.session = batch["session"]
+                self.applied = 0
+                self.buffer.clear()
+
+            for entry in batch["entries"]:
+                seq = entry[0]
+                if seq <= self.applied or seq in self.buffer:
+                    self.metrics.incr(f"{self.prefix}.duplicates")
+                    continue
+                self.buffer[seq] = entry
+
+            # Se aplica todo lo que ya esta en orden. Se hace dentro del lock para
+            # que dos batches procesados en paralelo no se apliquen desordenados
+            while self.applied + 1 in self.buffer:
+                _, event, data, timestamp = self.buffer.pop(self.applied + 1)
+                self.applied += 1
+                try:
+                    self.apply(event, sid, data)
+                except Exception as e:
+                    logger.error(f"Error applying replicated {event}: {e}")
+                self.metrics.set(f"{self.prefix}.receive_lag_seconds", max(time() - timestamp, 0))
+
+            self.metrics.set(f"{self.prefix}.applied_seq", self.applied)
+            return self.applied
@@ -0,0 +1,131 @@
+from threading import Lock
+from typing import Dict, Iterator, List, Tuple
+
+DEFAULT_ROOM = "general"
+
+
+class Room:
+    """
+    Estado de una sala de chat: su registro de mensajes, su propio
+    minimo de usuarios para comenzar y si ya se mando la historia
+    """
+
+    def __init__(self, name: str, min_user_count: int = 0) -> None:
+        self.name = name
+        self.min_user_count = min_user_count
+        self.history_sent = False
+
+        # { message_index: {"username": ..., "message": ..., "origin": ..., "prev": ...} }
+        self.messages: Dict[int, dict] = {}
+
+        # { origin: mayor indice de ese servidor hasta el cual la sala tiene todos sus mensajes }
+        # Cada mensaje lleva el indice del mensaje anterior de su origen (prev), por
+        # lo que un mensaje que se perdio deja la cadena cortada hasta que llegue
+        self.origin_highs: Dict[str, int] = {}
+
+        # { origin: { prev: indice } } Mensajes que llegaron antes que su anterior
+        self.waiting: Dict[str, Dict[int, int]] = {}
+        self.lock = Lock()
+
+    def add_message(self, index: int, username: str, message: str, origin: str = None, prev: int = None) -> bool:
+        """Registra un mensaje. Retorna False si ya estaba registrado"""
+        with self.lock:
+            if index in self.messages:
+                return False
+            self.messages[index] = {"username": username, "message": message, "origin": origin, "prev": prev}
+            if origin is not None:
+                self.__advance(origin, index, prev)
+            return True
+
+    def __advance(self, origin: str, index: int, prev: int = None):
+        """Avanza el watermark del origen mientras la cadena de mensajes este completa"""
+        high = self.origin_highs.get(origin, -1)
+        if prev is not None and prev > high:
+            # Falta el anterior (o alguno antes que el)
+            self.waiting.setdefault(origin, {})[prev] = index
+            return
+
+        high = max(high, index)
+        waiting = self.waiting.get(origin, {})
+        while high in waiting:
+            high = max(high, waiting.pop(high))
+        self.origin_highs[origin] = high
+
+    def messages_missing_from(self, watermarks: Dict[str, int]) -> List[Tuple[int, dict]]:
+        """Mensajes que no tiene una replica con los indices mas altos por origen `watermarks`"""
+        with self.lock:
+            missing = [
+                (index, message)
+                for index, message in self.messages.items()
+                if index > watermarks.get(message.get("origin"), -1)
+            ]
+        return sorted(missing)
+
+    def history(self) -> List[Tuple[int, dict]]:
+        with self.lock:
+            return sorted(self.messages.items())
+
+    def next_free_index(self) -> int:
+        """Primer indice mayor a todos los mensajes registrados"""
+        with self.lock:
+            if not self.messages:
+                return 0
+            return max(self.messages) + 1
+
+    def dump(self, watermarks: Dict[str, int] = None) -> dict:
+        """Estado de la sala. Con watermarks, solo los mensajes que no tiene quien los mando"""
+        # Los mensajes se mandan como lista de pares, ya que al serializar
+        # el diccionario sus llaves enteras se convertirian en strings
+        return {
+            "messages": self.history() if watermarks is None else self.messages_missing_from(watermarks),
+            "min_user_count": self.min_user_count,
+            "history_sent": self.history_sent,
+        }
+
+    def load(self, data: dict):
+        for index, message in data["messages"]:
+            self.add_message(index, message["username"], message["message"], message.get("origin"), message.get("prev"))
+        self.min_user_count = data["min_user_count"]
+        self.history_sent = self.history_sent or data["history_sent"]
+        return self
+
+
+class RoomList:
+    """Salas del servidor. Las salas se crean al ser usadas por primera vez"""
+
+    def __init__(self, min_user_count: int = 0) -> None:
+        self.min_user_count = min_user_count
+        self.rooms: Dict[str, Room] = {}
+        self.lock = Lock()
+
+    def get_room(self, name: str = DEFAULT_ROOM) -> Room:
+        room = self.rooms.get(name)
+        if room is None:
+            with self.lock:
+                room = self.rooms.get(name)
+                if room is None:
+                    room = Room(name, self.min_user_count)
+                    self.rooms[name] = room
+        return room
+
+    def dump(self) -> Dict[str, dict]:
+        return {name: room.dump() for name, room in list(self.rooms.items())}
+
+    def dump_missing(self, watermarks: Dict[str, Dict[str, int]]) -> Dict[str, dict]:
+        """Igual que dump, pero solo con los mensajes que faltan segun los watermarks de otro servidor"""
+        return {name: room.dump(watermarks.get(name, {})) for name, room in list(self.rooms.items())}
+
+    def load(self, data: Dict[str, dict]):
+        for name, room_data in data.items():
+            self.get_room(name).load(room_data)
+        return self
+
+    def watermarks(self) -> Dict[str, Dict[str, int]]:
+        """{ room: { origin: indice } } Lo que se tiene de cada sala, para pedir solo lo que falta"""
+        return {room.name: dict(room.origin_highs) for room in self}
+
+    def __iter__(self) -> Iterator[Room]:
+        return iter(list(self.rooms.values()))
+
+    def __len__(self):
+        return len(self.rooms)
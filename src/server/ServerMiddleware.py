@@ -2,6 +2,7 @@ from typing import Tuple
 
 from ..utils.Logger import getServerLogger
 from ..utils.Middleware import Middleware
+from .Rooms import DEFAULT_ROOM, RoomList
 from .Users import UserList
 
 logger = getServerLogger("ServerMiddleware")
@@ -10,36 +11,22 @@ logger = getServerLogger("ServerMiddleware")
 class ServerMiddleware(Middleware):
     """Midleware encargado de manejar la logica del chat"""
 
-    def __init__(self, users: UserList, messages: dict, min_user_count: int, *args, **kwargs):
+    def __init__(self, users: UserList, rooms: RoomList, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.users = users
-        self.min_user_count = min_user_count
-        self.history_sent = False
-        self.messages = messages
+        self.rooms = rooms
 
         self.handlers = {
             "connect": self.connect,
             "disconnect": self.disconnect,
             "chat": self.chat,
-            "sync_next_index": self.chat,
-            "sync_new_user": self.on_sync_new_user,
-            "sync_new_user_reconnection": self.on_sync_reconnecting_user,
-            "disconnect_synced_user": self.disconnect_synced_user,
+            "replicate_message": self.chat,
+            "sync_users_snapshot": self.on_sync_users_snapshot,
+            "sync_users_delta": self.on_sync_users_delta,
             "update_p2p_uri": self.update_p2p_uri,
-            "update_p2p_uri_replica": self.update_p2p_uri_forwarded
         }
 
-    def update_p2p_uri_forwarded(self, sid: str, data: dict):
-        logger.info("Updating uri data in replica")
-        if "username" in data:
-            user = self.users.get_user_by_name(data["username"])
-            if user:
-                self.users.del_user(user.sid)
-                self.users.add_user(user.name, sid, data["publicUri"], user.replicated, uri_update=True)
-            else:
-                logger.error(f"Couldn't find user {data['username']} to update its uri")
-
     def update_p2p_uri(self, sid: str, data: dict):
         logger.info("Updating uri data")
         if "username" in data:
@@ -51,52 +38,96 @@ class ServerMiddleware(Middleware):
                 logger.error(f"Couldn't find user {data['username']} to update its uri")
         return True
 
+    def emit_to_room(self, event: str, data, room: str):
+        """Manda un evento solo a los miembros de la sala"""
+        for user in self.users.get_users_in_room(room):
+            try:
+                self.socketio.emit(event, data, to=user.sid)
+            except Exception as e:
+                logger.error(f"Error: {e}")
+
+    def resume_session(self, sid: str, data: dict):
+        """Retoma la sesion que el cliente tenia en el server anterior. None si el token no sirve"""
+        session = self.main_server.sessions.claim(data["resume"], data["username"])
+        user = None
+        if session is not None:
+            user = self.users.resume_user(session["name"], session["uuid"], session["uri"], sid, session["room"])
+
+        self.main_server.metrics.incr("sessions.resumed" if user else "sessions.resume_rejected")
+        return user
+
     def connect(self, sid, data):
         logger.debug(f"User logging in with auth: {data}")
-        user = self.users.add_user(data["username"], sid, data["publicUri"], replicated="replicated" in data)
+
+        # Con un token valido el usuario sigue como estaba: no se avisa a la sala ni se manda la historia
+        if data.get("resume") and self.resume_session(sid, data):
+            logger.debug(f'{data["username"]} resumed its session')
+            return
+
+        user = self.users.add_user(
+            data["username"],
+            sid,
+            data["publicUri"],
+            replicated="replicated" in data,
+            room=data.get("room", DEFAULT_ROOM),
+        )
 
         if user is None:
             logger.debug(f'Username {data["username"]} is already taken')
             raise ConnectionRefusedError("Username is invalid or already taken")
 
+        room = self.rooms.get_room(user.room)
+
         if not data["reconnecting"]:
-            self.socketio.emit(
+            self.emit_to_room(
                 "server_message",
-                {"message": f'\u2713 {data["username"]} has connected to the server'},
+                {"message": f'\u2713 {data["username"]} has connected to {room.name}'},
+                room.name,
             )
         if not user.replicated:
             self.socketio.emit("send_uuid", user.uuid, to=sid)
 
-            # Si se supero el limite inferior de usuarios conectados, mandar la historia
-            if len(self.users) >= self.min_user_count and not data["reconnecting"]:
-                logger.debug(f"Sending history")
-
-                if self.history_sent:
-                    # Solo al cliente conectado si ya se mando a todos
-                    self.socketio.emit(
-                        "message_history",
-                        {"messages": [x for x in sorted(self.messages.items())]},
-                        to=sid,
-                    )
-                else:
-                    # A todos si todavia no se hace
-                    self.socketio.emit("message_history", {"messages": [x for x in sorted(self.messages.items())]})
-                    self.history_sent = True
-
-            logger.debug(f"{user.name} connected with sid {user.sid}")
-
-    def on_sync_new_user(self, sid: str, data: dict):
-        data["replicated"] = True
-        self.connect(sid, data)
+            # Si se supero el limite inferior de usuarios conectados a la sala, mandar la historia
+            if self.users.count_in_room(room.name) >= room.min_user_count and not data["reconnecting"]:
+                logger.debug(f"Sending history of room {room.name}")
 
-    def on_sync_reconnecting_user(self, sid: str, data: dict):
-        pass
-
-    def disconnect_synced_user(self, sid1: str, sid: str):
-        # Obtener el usuario, si existe
-        client = self.users.get_user_by_sid(sid)
-        if client:
-            self.users.del_user(sid)
+                if room.history_sent:
+                    # Solo al cliente conectado si ya se mando a todos, y solo lo que no tiene en su cache
+                    messages = room.messages_missing_from(data.get("history") or {})
+                    self.socketio.emit("message_history", {"messages": messages}, to=sid)
+                else:
+                    # A todos los de la sala si todavia no se hace
+                    self.emit_to_room("message_history", {"messages": room.history()}, room.name)
+                    room.history_sent = True
+
+            logger.debug(f"{user.name} connected to room {room.name} with sid {user.sid}")
+
+    def set_replicated_user(self, name: str, record: dict, origin: str):
+        return self.users.set_replicated_user(
+            name, record["uuid"], record["uri"], record["sid"], record["room"], origin
+        )
+
+    def on_sync_users_snapshot(self, sid: str, data: dict):
+        """Reemplaza los usuarios replicados de otro servidor por los que tiene conectados ahora"""
+        origin = data["origin"]
+        self.users.drop_replicated(origin, keep=data["users"])
+        for name, record in data["users"].items():
+            self.set_replicated_user(name, record, origin)
+
+    def on_sync_users_delta(self, sid: str, data: dict):
+        """Aplica los cambios de usuarios de otro servidor. Un usuario en None ya no esta conectado"""
+        origin = data["origin"]
+        for name, record in data["users"].items():
+            if record is None:
+                self.users.remove_replicated_user(name, origin)
+                continue
+
+            is_new = self.users.get_user_by_name(name) is None
+            user = self.set_replicated_user(name, record, origin)
+            if user and is_new:
+                self.emit_to_room(
+                    "server_message", {"message": f"\u2713 {name} has connected to {user.room}"}, user.room
+                )
 
     def disconnect(self, sid, _):
         # Obtener el usuario, si existe
@@ -104,31 +135,32 @@ class ServerMiddleware(Middleware):
         if client and not client.replicated:
             logger.debug(f"User disconnected: {client.name}")
             self.users.del_user(sid)
-            # Notificar al resto que el usuario se desconecto
-            self.socketio.emit(
+            # Notificar al resto de la sala que el usuario se desconecto
+            self.emit_to_room(
                 "server_message",
                 {"message": f"\u274C {client.name} has disconnected from the server"},
+                client.room,
             )
 
     def chat(self, sid: str, data: dict):
         """Maneja el broadcast de los chats"""
         # Obtener el cliente que mando el mensaje
         client_name = data["client_name"]
-        print('data',data)
-        # Agregar mensaje al registro
+        room = self.rooms.get_room(data.get("room", DEFAULT_ROOM))
+
+        # Agregar mensaje al registro de la sala
         if "message_index" in data:
-            self.messages[data["message_index"]] = {"username": client_name, "message": data["message"]}
-
-        # Mandar mensaje a todos los clientes, solo si se supera el n
-        if len(self.users) >= self.min_user_count or self.history_sent:
-            logger.debug(f"Sending message to all clients")
-            for user in self.users.users.values():
-                try:
-                    msg = data.copy()
-                    msg["username"] = client_name
-                    msg["index"] = data["message_index"]
-                    self.socketio.emit("chat", msg, to=user.sid)
-                except Exception as e:
-                    logger.error(f"Error: {e}")
+            room.add_message(
+                data["message_index"], client_name, data["message"], data.get("origin"), data.get("prev_index")
+            )
+
+        # Mandar mensaje a los miembros de la sala, solo si se supera el n de la sala
+        if self.users.count_in_room(room.name) >= room.min_user_count or room.history_sent:
+            logger.debug(f"Sending message to clients in room {room.name}")
+            msg = data.copy()
+            msg["username"] = client_name
+            msg["index"] = data["message_index"]
+            self.emit_to_room("chat", msg, room.name)
 
         return {"status": "ok"}
+
@@ -0,0 +1,52 @@
+from secrets import token_urlsafe
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, Optional
+
+from .UserRegistry import user_record
+from .Users import User, name_key
+
+RESUME_TTL = 60  # seconds
+
+
+class ResumeTokens:
+    """
+    Tokens para que un cliente retome su sesion en otro server (e.g. despues de
+    una migracion) sin pasar por el connect completo: mantiene su uuid, su sala
+    y su uri p2p, y no se le vuelve a mandar la historia. Cada token se usa una vez.
+    """
+
+    def __init__(self, ttl: float = RESUME_TTL) -> None:
+        self.ttl = ttl
+        self.lock = Lock()
+
+        # { token: {"name": ..., "uuid": ..., "uri": ..., "room": ..., "expires": ...} }
+        self.sessions: Dict[str, dict] = {}
+
+    def issue(self, users: Iterable[User]) -> Dict[str, str]:
+        """{ sid: token } Un token nuevo por cada usuario"""
+        expires = time() + self.ttl
+        tokens = {}
+        with self.lock:
+            for user in users:
+                token = token_urlsafe(16)
+                self.sessions[token] = {**user_record(user), "name": user.name, "expires": expires}
+                tokens[user.sid] = token
+        return tokens
+
+    def dump(self) -> Dict[str, dict]:
+        with self.lock:
+            now = time()
+            return {token: session for token, session in self.sessions.items() if session["expires"] > now}
+
+    def load(self, sessions: Dict[str, dict]):
+        with self.lock:
+            self.sessions.update(sessions)
+
+    def claim(self, token: str, username: str) -> Optional[dict]:
+        """La sesion del token, si es de ese usuario y no ha expirado. El token deja de ser valido"""
+        with self.lock:
+            session = self.sessions.pop(token, None)
+        if session is None or session["expires"] <= time() or name_key(session["name"]) != name_key(username):
+            return None
+        return session
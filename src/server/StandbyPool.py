@@ -0,0 +1,70 @@
+import subprocess
+import sys
+from os import path
+from time import monotonic, sleep
+from typing import Dict, List
+
+from ..utils.Logger import getServerLogger
+from ..utils.networking import free_port, request_standbys
+
+logger = getServerLogger("StandbyPool")
+
+STARTUP_GRACE = 30  # seconds
+
+SERVER_SCRIPT = path.join(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))), "server.py")
+
+
+class StandbyPool:
+    """
+    Mantiene `size` servidores standby registrados en el DNS. Cuando una
+    migracion toma uno, este pasa a ser un servidor activo (y su proceso sigue
+    corriendo), y el pool levanta otro para reemplazarlo.
+    """
+
+    def __init__(self, dns_host: str, dns_port: int, server_uri: str, ip: str, size: int, server_args=()) -> None:
+        self.dns_host = dns_host
+        self.dns_port = dns_port
+        self.server_uri = server_uri
+        self.ip = ip
+        self.size = size
+        self.server_args = list(map(str, server_args))
+
+        # { addr: cuando se levanto } Standbys que todavia no aparecen en el DNS
+        self.starting: Dict[str, float] = {}
+        self.processes: List[subprocess.Popen] = []
+
+    def spawn(self):
+        port = free_port(self.ip)
+        addr = f"http://{self.ip}:{port}"
+        command = [
+            sys.executable,
+            SERVER_SCRIPT,
+            *("--dns_ip", self.dns_host, "--dns_port", str(self.dns_port), "-u", self.server_uri),
+            *("--server_ip", self.ip, "--server_port", str(port), "--standby"),
+            *self.server_args,
+        ]
+        logger.info(f"Starting standby server at {addr}")
+        self.processes.append(subprocess.Popen(command, stdin=subprocess.DEVNULL))
+        self.starting[addr] = monotonic()
+
+    def refill(self):
+        standbys = set(request_standbys(self.dns_host, self.dns_port, self.server_uri))
+
+        # Si un standby no aparece a tiempo en el DNS, se asume que fallo
+        now = monotonic()
+        self.starting = {
+            addr: started
+            for addr, started in self.starting.items()
+            if addr not in standbys and now - started < STARTUP_GRACE
+        }
+
+        for _ in range(self.size - len(standbys) - len(self.starting)):
+            self.spawn()
+
+    def run(self, interval: float = 1):
+        while True:
+            try:
+                self.refill()
+            except Exception as e:
+                logger.error(f"Could not refill the standby pool: {e}")
+            sleep(interval)
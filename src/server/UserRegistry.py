@@ -0,0 +1,41 @@
+from threading import Condition
+from typing import Dict, List, Optional, Set
+
+from .Users import User
+
+# { name: record } o { name: None } si el usuario ya no esta conectado
+Delta = Dict[str, Optional[dict]]
+
+
+def user_record(user: User) -> dict:
+    """Lo que una replica necesita saber de un usuario conectado a este servidor"""
+    return {"uuid": user.uuid, "uri": user.uri, "sid": user.sid, "room": user.room}
+
+
+class RegistryChanges:
+    """
+    Nombres de los usuarios locales que cambiaron desde el ultimo delta. Solo se
+    guarda el nombre, y el estado se lee al armar el delta, por lo que varios
+    cambios de un mismo usuario (e.g. conectarse y desconectarse) se juntan en uno.
+    """
+
+    def __init__(self) -> None:
+        self.condition = Condition()
+        self.changed: Set[str] = set()
+
+    def touch(self, name: str):
+        with self.condition:
+            self.changed.add(name)
+            self.condition.notify()
+
+    def wait(self):
+        """Espera a que haya algun cambio"""
+        with self.condition:
+            while not self.changed:
+                self.condition.wait()
+
+    def drain(self) -> List[str]:
+        with self.condition:
+            changed = list(self.changed)
+            self.changed.clear()
+            return changed
@@ -1,18 +1,99 @@
 import logging
-from collections import namedtuple
-from typing import Dict, Optional, Union
+from collections import OrderedDict
+from threading import RLock
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 from uuid import uuid4
 
+from .Rooms import DEFAULT_ROOM
+
 logger = logging.getLogger("[UserList]")
 
 
-User = namedtuple("User", ["name", "uuid", "uri", "sid", "replicated", "disconnected"])
+DISCONNECTED_GRACE = 300  # seconds
+IDENTITY_CACHE_SIZE = 1024
+
+
+class User:
+    """
+    A user record. Records are never modified in place: use `replace` to get an updated copy
+        origin: Address of the server a replicated user is connected to
+    """
+
+    __slots__ = ("name", "uuid", "uri", "sid", "replicated", "disconnected", "room", "origin")
+
+    def __init__(
+        self,
+        name: str,
+        uuid: str,
+        uri: str,
+        sid: str,
+        replicated: bool,
+        disconnected: bool,
+        room: str,
+        origin: str = None,
+    ) -> None:
+        self.name = name
+        self.uuid = uuid
+        self.uri = uri
+        self.sid = sid
+        self.replicated = replicated
+        self.disconnected = disconnected
+        self.room = room
+        self.origin = origin
+
+    def replace(self, **changes) -> "User":
+        fields = {field: getattr(self, field) for field in self.__slots__}
+        fields.update(changes)
+        return User(**fields)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"User({fields})"
+
+
+def name_key(name: str) -> str:
+    """Names are case insensitive"""
+    return name.casefold()
 
 
 class UserList:
-    def __init__(self) -> None:
+    """
+    Users are modified by many threads (connects, disconnects, replication events).
+    Every change is made while holding `lock`. Broadcasts iterate a snapshot of the
+    room members that is copied after a change, the first time it is needed, and then
+    shared by every broadcast until the next change, without taking the lock.
+    """
+
+    def __init__(self, grace: float = DISCONNECTED_GRACE, identity_cache_size: int = IDENTITY_CACHE_SIZE) -> None:
+        self.lock = RLock()
+
         self.users: Dict[str, User] = {}
 
+        # sids of the connected (not disconnected) users, local or replicated
+        self.connected: Set[str] = set()
+
+        # { case-folded name: sid } and { uuid: sid }, pointing to the latest user set with that name/uuid
+        self.by_name: Dict[str, str] = {}
+        self.by_uuid: Dict[str, str] = {}
+
+        # { room: set(sid) } Only connected users are members of a room
+        self.rooms: Dict[str, Set[str]] = {}
+
+        # { room: (sid, ...) } Copies of the members of a room, removed when they change
+        self.room_snapshots: Dict[str, Tuple[str, ...]] = {}
+
+        # Called with the name of a local (not replicated) user whenever it changes
+        self.on_local_change: Optional[Callable[[str], None]] = None
+
+        # { sid: deadline } Disconnected users are evicted after `grace` seconds, oldest first
+        self.grace = grace
+        self.expiring: "OrderedDict[str, float]" = OrderedDict()
+
+        # { case-folded name: (uuid, room) } Evicted local users, so they keep their uuid if they come back
+        self.identity_cache_size = identity_cache_size
+        self.identities: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+
     """
     Adds a new user to global dictionary
         username: Handle for this user
@@ -20,39 +101,155 @@ class UserList:
         sid: Session ID for the user
     """
 
-    def add_user(self, username: str, sid: str, uri: str, replicated: bool, uri_update=False) -> Optional[User]:
-        old_user = self.get_user_by_name(username)
-        if not username or old_user:
-            if uri_update:
-                self.del_user(old_user.sid)
-            elif old_user.disconnected:
-                self.del_user(old_user.sid)
-                user = User(old_user.name, old_user.uuid, uri, sid, old_user.replicated, False)
-                self.users[sid] = user
-                return user
-            else:
-                logger.debug(f"Username with name {username} already exists. Users:", self.users)
-                if old_user.replicated:
-                    logger.debug("Old user is replicated, we're just gonna assume the real one is arriving.")
-                    self.del_user(old_user.sid)
+    def add_user(
+        self, username: str, sid: str, uri: str, replicated: bool, uri_update=False, room: str = None
+    ) -> Optional[User]:
+        with self.lock:
+            self.evict_expired()
+            old_user = self.get_user_by_name(username)
+            if not username or old_user:
+                if room is None and old_user:
+                    room = old_user.room
+                if uri_update:
+                    # Only the uri changes, the user keeps its uuid
+                    self.__forget(old_user.sid)
+                    user = User(old_user.name, old_user.uuid, uri, sid, replicated, False, room or DEFAULT_ROOM)
+                    self.__set_user(user)
+                    return user
+                elif old_user.disconnected:
+                    self.__forget(old_user.sid)
+                    user = User(old_user.name, old_user.uuid, uri, sid, old_user.replicated, False, room)
+                    self.__set_user(user)
+                    return user
                 else:
-                    if replicated:
-                        return old_user
-                    return None
-        uuid = str(uuid4())
-        user = User(username, uuid, uri, sid, replicated, False)
-        self.users[sid] = user
+                    logger.debug(f"Username with name {username} already exists")
+                    if old_user.replicated:
+                        logger.debug("Old user is replicated, we're just gonna assume the real one is arriving.")
+                        self.__forget(old_user.sid)
+                    else:
+                        if replicated:
+                            return old_user
+                        return None
+            uuid = str(uuid4())
+
+            # A local user that was evicted keeps its uuid (and its room, if none is given)
+            identity = self.identities.pop(name_key(username), None) if not replicated else None
+            if identity:
+                uuid, room = identity[0], room or identity[1]
+
+            user = User(username, uuid, uri, sid, replicated, False, room or DEFAULT_ROOM)
+            self.__set_user(user)
+            return user
+
+    def __set_user(self, user: User):
+        self.users[user.sid] = user
+        self.connected.add(user.sid)
+        self.expiring.pop(user.sid, None)
+        self.by_name[name_key(user.name)] = user.sid
+        self.by_uuid[user.uuid] = user.sid
+        self.rooms.setdefault(user.room, set()).add(user.sid)
+        self.room_snapshots.pop(user.room, None)
+        self.__notify(user)
+
+    def __notify(self, user: User):
+        if self.on_local_change and not user.replicated:
+            self.on_local_change(user.name)
+
+    def __leave(self, user: User):
+        """Removes the user from the connected users and from its room"""
+        self.connected.discard(user.sid)
+        self.rooms.get(user.room, set()).discard(user.sid)
+        self.room_snapshots.pop(user.room, None)
+
+    def __forget(self, sid: str):
+        user = self.users.pop(sid, None)
+        if user:
+            self.__leave(user)
+            self.expiring.pop(sid, None)
+            if self.by_name.get(name_key(user.name)) == sid:
+                del self.by_name[name_key(user.name)]
+            if self.by_uuid.get(user.uuid) == sid:
+                del self.by_uuid[user.uuid]
         return user
 
+    """
+    Adds or updates a user connected to another server, keeping its uuid.
+    A connected local user keeps its name.
+        origin: Address of the server the user is connected to
+    """
+
+    def set_replicated_user(self, name: str, uuid: str, uri: str, sid: str, room: str, origin: str) -> Optional[User]:
+        with self.lock:
+            self.evict_expired()
+            old_user = self.get_user_by_name(name)
+            if old_user:
+                if not old_user.replicated and not old_user.disconnected:
+                    return None
+                self.__forget(old_user.sid)
+
+            user = User(name, uuid, uri, sid, True, False, room or DEFAULT_ROOM, origin)
+            self.__set_user(user)
+            return user
+
+    """
+    Adds a local user resuming a session from another server, keeping its uuid.
+    Replaces a replicated or disconnected user with the same name
+    """
+
+    def resume_user(self, name: str, uuid: str, uri: str, sid: str, room: str) -> Optional[User]:
+        with self.lock:
+            self.evict_expired()
+            old_user = self.get_user_by_name(name)
+            if old_user:
+                if not old_user.replicated and not old_user.disconnected:
+                    return None
+                self.__forget(old_user.sid)
+
+            user = User(name, uuid, uri, sid, False, False, room or DEFAULT_ROOM)
+            self.__set_user(user)
+            return user
+
+    def remove_replicated_user(self, name: str, origin: str) -> Optional[User]:
+        with self.lock:
+            user = self.get_user_by_name(name)
+            if user and user.replicated and user.origin == origin:
+                return self.__forget(user.sid)
+            return None
+
+    """
+    Removes the replicated users of a server
+        keep: Names of users that are still connected to it
+    """
+
+    def drop_replicated(self, origin: str, keep: Iterable[str] = ()) -> List[User]:
+        keep = set(keep)
+        with self.lock:
+            dropped = [
+                user
+                for user in self.users.values()
+                if user.replicated and user.origin == origin and user.name not in keep
+            ]
+            for user in dropped:
+                self.__forget(user.sid)
+        return dropped
+
+    def snapshot(self) -> List[User]:
+        """All the users, including replicated and disconnected ones"""
+        with self.lock:
+            return list(self.users.values())
+
+    def local_users(self) -> List[User]:
+        with self.lock:
+            users = [self.users.get(sid) for sid in self.connected]
+        return [user for user in users if user and not user.replicated]
+
     """
     Gets a user based on the session ID
         sid: SID for the user
     """
 
     def get_user_by_sid(self, sid: str) -> Union[User, None]:
-        if sid in self.users:
-            return self.users[sid]
-        return None
+        return self.users.get(sid)
 
     """
     gets a user based on user handle
@@ -60,16 +257,28 @@ class UserList:
     """
 
     def get_user_by_name(self, name: str) -> Union[User, None]:
-        for _, value in self.users.items():
-            if value.name.upper() == name.upper():
-                return value
-        return None
+        sid = self.by_name.get(name_key(name))
+        return self.users.get(sid) if sid is not None else None
 
     def get_user_by_uuid(self, uuid: str) -> Union[User, None]:
-        for _, value in self.users.items():
-            if value.uuid == uuid:
-                return value
-        return None
+        sid = self.by_uuid.get(uuid)
+        return self.users.get(sid) if sid is not None else None
+
+    """
+    Gets the connected users of a room
+        room: Name of the room
+    """
+
+    def get_users_in_room(self, room: str) -> List[User]:
+        members = self.room_snapshots.get(room)
+        if members is None:
+            with self.lock:
+                members = self.room_snapshots[room] = tuple(self.rooms.get(room, ()))
+        users = [self.users.get(sid) for sid in members]
+        return [user for user in users if user]
+
+    def count_in_room(self, room: str) -> int:
+        return len(self.rooms.get(room, ()))
 
     """
     Deletes a user from global dictionary
@@ -78,12 +287,44 @@ class UserList:
     """
 
     def del_user(self, sid: str) -> Union[User, None]:
-        user = None
-        if sid in self.users:
-            user = self.users[sid]
-            self.users[sid] = User(user.name, user.uuid, user.uri, user.sid, user.replicated, True)
+        with self.lock:
+            user = self.users.get(sid)
+            if user:
+                self.users[sid] = user.replace(disconnected=True)
+                self.__leave(user)
+                self.expiring.pop(sid, None)
+                self.expiring[sid] = monotonic() + self.grace
+                self.__notify(user)
 
-        return user
+            self.evict_expired()
+            return user
+
+    def evict_expired(self) -> List[User]:
+        """Forgets the users that have been disconnected for more than `grace` seconds"""
+        now = monotonic()
+        evicted = []
+        with self.lock:
+            while self.expiring:
+                sid, deadline = next(iter(self.expiring.items()))
+                if deadline > now:
+                    break
+                self.expiring.popitem(last=False)
+
+                user = self.__forget(sid)
+                if user is None:
+                    continue
+                if not user.replicated and self.get_user_by_name(user.name) is None:
+                    self.__remember(user)
+                evicted.append(user)
+        return evicted
+
+    def __remember(self, user: User):
+        key = name_key(user.name)
+        self.identities.pop(key, None)
+        self.identities[key] = (user.uuid, user.room)
+        while len(self.identities) > self.identity_cache_size:
+            self.identities.popitem(last=False)
 
     def __len__(self):
-        return len(self.users)
+        """Connected users"""
+        return len(self.connected)
@@ -2,21 +2,28 @@ import os
 import signal
 from threading import Thread
 from time import sleep
-from typing import List
+from typing import Dict, List
 
 from socketio import Server, WSGIApp
-from socketio.client import Client
 from werkzeug.serving import make_server
 
 from ..utils.Logger import getServerLogger
+from ..utils.Metrics import Metrics
 from ..utils.Middleware import Middleware
-from ..utils.networking import get_public_ip, request_replica_addr, send_server_addr
+from ..utils.StartupProfiler import StartupProfiler
+from ..utils.networking import get_public_ip, register_standby, send_server_addr
+from .MetricsMiddleware import MetricsMiddleware
 from .MigrationMiddleware import MigrationMiddleware
+from .MigrationSchedule import FIXED, make_policy
 from .P2PMiddleware import P2PMiddleware
-from .ReplicationMiddleware import ReplicationMiddleware
+from .RateLimitMiddleware import REJECT, RateLimitMiddleware
+from .ReplicationMiddleware import LEASES, ReplicationMiddleware
+from .ChatOrderMiddleware import ChatOrderMiddleware
 from .DNSMiddleware import DNSMiddleware
+from .Rooms import RoomList
 from .ServerMiddleware import ServerMiddleware
-from .Users import UserList
+from .Sessions import ResumeTokens
+from .Users import DISCONNECTED_GRACE, UserList
 
 logger = getServerLogger("Main")
 
@@ -31,13 +38,55 @@ class MainServer:
         server_ip: str = None,
         server_port: int = None,
         migrating: bool = False,
+        standby: bool = False,
+        user_rate: float = 0,
+        user_burst: float = 1,
+        global_rate: float = 0,
+        global_burst: float = 1,
+        rate_limit_mode: str = REJECT,
+        max_defer: float = 1.0,
+        lease_size: int = 64,
+        ordering: str = LEASES,
+        migration_interval: float = 30,
+        migration_policy: str = FIXED,
+        migration_max_interval: float = 120,
+        migration_max_rate: float = 50,
+        migration_max_users: int = 500,
+        reconnect_window: float = 1.0,
+        migration_weights: Dict[str, float] = None,
+        disconnected_grace: float = DISCONNECTED_GRACE,
+        profile_startup: bool = False,
     ):
+        # Etapas del inicio del servidor. Lo que paso antes de crear el MainServer son los imports
+        self.startup = StartupProfiler()
+        self.startup.mark("imports")
+        self.profile_startup = profile_startup
+
         # Parameters
         self.dns_host = dns_host
         self.dns_port = dns_port
         self.min_user_count = min_user_count
         self.server_uri = server_uri
         self.migrating = migrating
+        self.standby = standby
+        self.rate_limits = {
+            "user_rate": user_rate,
+            "user_burst": user_burst,
+            "global_rate": global_rate,
+            "global_burst": global_burst,
+            "mode": rate_limit_mode,
+            "max_defer": max_defer,
+        }
+
+        self.lease_size = lease_size
+        self.ordering = ordering
+        self.migration_schedule = make_policy(
+            migration_policy, migration_interval, migration_max_interval, migration_max_rate, migration_max_users
+        )
+        self.reconnect_window = reconnect_window
+        self.migration_weights = migration_weights
+
+        self.metrics = Metrics()
 
         # Middlewares
         self.middlewares: List[Middleware] = []
@@ -47,33 +96,29 @@ class MainServer:
         self.server: Server = Server(cors_allowed_origins="*")
         self.app = WSGIApp(self.server)
 
-        if server_ip is None or server_port is None:
-            ip, port = get_public_ip()
+        # Solo se busca la ip si no se conoce. Sin puerto, el sistema asigna uno libre al hacer bind
+        self.ip = server_ip if server_ip is not None else get_public_ip()[0]
+        self.startup.mark("address")
 
-            if server_ip is None:
-                self.ip = ip
-            else:
-                self.ip = server_ip
-
-            if server_port is None:
-                self.port = port
-            else:
-                self.port = server_port
-        else:
-            self.ip = server_ip
-            self.port = server_port
-
-        self.addr = f"http://{self.ip}:{self.port}"
         self._created_server = make_server(
             self.ip,
-            self.port,
+            server_port if server_port is not None else 0,
             self.app,
             threaded=True,
         )
+        self.port = self._created_server.server_port
+        self.addr = f"http://{self.ip}:{self.port}"
+        self.startup.mark("bind")
 
         # Connected Users
-        self.users = UserList()
-        self.messages = {}
+        self.disconnected_grace = disconnected_grace
+        self.users = UserList(grace=disconnected_grace)
+
+        # Chat rooms, each one with its own message log
+        self.rooms = RoomList(min_user_count)
+
+        # Sessions that clients can resume on another server after a migration
+        self.sessions = ResumeTokens()
 
         self.events = set()
 
@@ -84,21 +129,37 @@ class MainServer:
     def setup_middlewares(self):
         # ! Setup application middlewares
 
+        self.metrics_middleware = MetricsMiddleware(self.server, main_server=self)
+        self.middlewares.append(self.metrics_middleware)
+
         self.dns_middleware = DNSMiddleware(self.users, self.server, main_server=self)
         self.middlewares.append(self.dns_middleware)
 
-        self.migration_middleware = MigrationMiddleware(self.users, self.server, main_server=self)
+        self.migration_middleware = MigrationMiddleware(
+            self.users,
+            self.server,
+            main_server=self,
+            schedule=self.migration_schedule,
+            reconnect_window=self.reconnect_window,
+            target_weights=self.migration_weights,
+        )
         self.middlewares.append(self.migration_middleware)
 
-        self.replication_middleware = ReplicationMiddleware(self.users, self.server, main_server=self)
+        self.chat_order_middleware = ChatOrderMiddleware(self.users, self.server, main_server=self)
+        self.middlewares.append(self.chat_order_middleware)
+
+        self.rate_limit_middleware = RateLimitMiddleware(self.users, self.server, main_server=self, **self.rate_limits)
+        self.middlewares.append(self.rate_limit_middleware)
+
+        self.replication_middleware = ReplicationMiddleware(
+            self.users, self.server, main_server=self, lease_size=self.lease_size, ordering=self.ordering
+        )
         self.middlewares.append(self.replication_middleware)
 
         self.p2p_middleware = P2PMiddleware(self.users, self.server, main_server=self)
         self.middlewares.append(self.p2p_middleware)
 
-        self.server_middleware = ServerMiddleware(
-            self.users, self.messages, self.min_user_count, self.server, main_server=self
-        )
+        self.server_middleware = ServerMiddleware(self.users, self.rooms, self.server, main_server=self)
 
         self.middlewares.append(self.server_middleware)
 
@@ -143,7 +204,7 @@ class MainServer:
         print(self.server.handlers)
 
     def register_in_dns(self):
-        if self.migrating:
+        if self.migrating or self.standby:
             return
 
         print(self.addr)
@@ -155,11 +216,34 @@ class MainServer:
         #     socket = Client()
         #     socket.connect(f"http://{self.dns_host}:{8001}")
 
+    def register_as_standby(self):
+        """Queda esperando en el DNS a que una migracion lo tome, ya con todo listo"""
+        logger.info("Registrando como standby")
+        register_standby(self.dns_host, self.dns_port, self.server_uri, self.addr)
+
+    def activate(self):
+        """Un standby tomado por una migracion comienza a funcionar como replica"""
+        if self.standby:
+            logger.info("Standby activado")
+            self.standby = False
+            self.replication_middleware.connect_replica()
+
     def __start(self):
         self.register_in_dns()
+        self.startup.mark("dns")
         self.setup_middlewares()
-        self.setup_events()   
+        self.startup.mark("middlewares")
+        self.setup_events()
+        self.startup.mark("events")
+        if self.standby:
+            self.register_as_standby()
+        self.replication_middleware.start()
         self.migration_middleware.start()
+        self.startup.mark("listening")
+
+        self.startup.record(self.metrics)
+        if self.profile_startup:
+            print(self.startup.report())
         self._created_server.serve_forever()
 
     def start(self):
@@ -168,7 +252,13 @@ class MainServer:
         server_th.start()
 
         while True:
-            inp = input("Ingrese APAGAR o PRENDER para cambiar el estado del servidor: ")
+            try:
+                inp = input("Ingrese APAGAR o PRENDER para cambiar el estado del servidor: ")
+            except EOFError:
+                # Sin consola (e.g. un standby del pool), se sigue atendiendo
+                server_th.join()
+                break
+
             if inp == "APAGAR":
                 logger.info("Apagando servidor")
                 self.simulate_server_down = True
@@ -179,9 +269,19 @@ class MainServer:
             elif inp == "PRENDER":
                 logger.info("Prendiendo servidor")
                 self.simulate_server_down = False
-                self.users = UserList()
+                self.users = UserList(grace=self.disconnected_grace)
                 for middleware in self.middlewares:
-                    if isinstance(middleware, ServerMiddleware) or isinstance(middleware, ReplicationMiddleware):
+                    if isinstance(
+                        middleware,
+                        (
+                            ServerMiddleware,
+                            ReplicationMiddleware,
+                            RateLimitMiddleware,
+                            ChatOrderMiddleware,
+                            MigrationMiddleware,
+                            P2PMiddleware,
+                        ),
+                    ):
                         middleware.users = self.users
                 self.replication_middleware.connect_replica()
                 self.register_in_dns()
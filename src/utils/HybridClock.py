@@ -0,0 +1,70 @@
+from hashlib import blake2b
+from threading import Lock
+from time import time
+from typing import Tuple
+
+LOGICAL_BITS = 16
+NODE_BITS = 64
+MAX_LOGICAL = (1 << LOGICAL_BITS) - 1
+
+# (tiempo fisico en ms, contador logico, id del servidor)
+Stamp = Tuple[int, int, int]
+
+
+def node_id(name: str) -> int:
+    """Id de NODE_BITS bits para un servidor, derivado de forma determinista de su nombre (e.g. su address)"""
+    return int.from_bytes(blake2b(name.encode(), digest_size=NODE_BITS // 8).digest(), "big")
+
+
+def pack(stamp: Stamp) -> int:
+    """
+    Codifica un stamp en un solo entero, que se ordena igual que el stamp:
+    primero por tiempo fisico, luego por contador logico y luego por servidor
+    """
+    physical, logical, node = stamp
+    return (((physical << LOGICAL_BITS) | logical) << NODE_BITS) | node
+
+
+def unpack(packed: int) -> Stamp:
+    node = packed & ((1 << NODE_BITS) - 1)
+    packed >>= NODE_BITS
+    return packed >> LOGICAL_BITS, packed & MAX_LOGICAL, node
+
+
+class HybridLogicalClock:
+    """
+    Reloj logico hibrido. Cada servidor estampa sus mensajes localmente, sin
+    coordinarse con nadie, y los stamps de distintos servidores se ordenan
+    igual en todas las replicas. Un stamp nuevo siempre es mayor a todos los
+    que el servidor ya genero o vio, aunque los relojes fisicos esten desfasados.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.node = node_id(name)
+        self.physical = 0
+        self.logical = 0
+        self.lock = Lock()
+
+    def now(self) -> Stamp:
+        with self.lock:
+            physical = int(time() * 1000)
+            if physical > self.physical:
+                self.physical = physical
+                self.logical = 0
+            elif self.logical < MAX_LOGICAL:
+                self.logical += 1
+            else:
+                # Se acabo el contador en este ms, se adelanta el tiempo logico
+                self.physical += 1
+                self.logical = 0
+            return self.physical, self.logical, self.node
+
+    def now_packed(self) -> int:
+        return pack(self.now())
+
+    def observe(self, packed: int):
+        """Registra un stamp de otro servidor, para que los siguientes stamps queden despues de el"""
+        physical, logical, _ = unpack(packed)
+        with self.lock:
+            if (physical, logical) > (self.physical, self.logical):
+                self.physical, self.logical = physical, logical
@@ -21,12 +21,13 @@ client_used_colors = set()
 
 
 def getServerLogger(name):
-    color = choice(list(available_colors - server_used_colors))
+    # Si ya se usaron todos los colores, se repite alguno
+    color = choice(list(available_colors - server_used_colors) or list(available_colors))
     server_used_colors.add(color)
     return getLogger(f"{color}[{name}]{Color.RESET}")
 
 
 def getClientLogger(name):
-    color = choice(list(available_colors - client_used_colors))
+    color = choice(list(available_colors - client_used_colors) or list(available_colors))
     client_used_colors.add(color)
     return getLogger(f"{color}[{name}]{Color.RESET}")
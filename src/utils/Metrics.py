@@ -0,0 +1,35 @@
+from collections import defaultdict
+from threading import Lock
+from typing import Dict, Union
+
+Number = Union[int, float]
+
+
+class Metrics:
+    """
+    Registro de metricas del servidor. Los contadores se incrementan
+    con incr y los valores instantaneos (gauges) se fijan con set.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.counters: Dict[str, Number] = defaultdict(int)
+        self.gauges: Dict[str, Number] = {}
+
+    def incr(self, name: str, value: Number = 1):
+        with self.lock:
+            self.counters[name] += value
+
+    def set(self, name: str, value: Number):
+        with self.lock:
+            self.gauges[name] = value
+
+    def get(self, name: str, default: Number = 0) -> Number:
+        with self.lock:
+            if name in self.gauges:
+                return self.gauges[name]
+            return self.counters.get(name, default)
+
+    def snapshot(self) -> Dict[str, Number]:
+        with self.lock:
+            return {**self.counters, **self.gauges}
@@ -0,0 +1,54 @@
+import os
+from time import perf_counter, time
+from typing import List, Tuple
+
+
+def process_age() -> float:
+    """Segundos desde que se creo este proceso (0 si no se puede saber, e.g. fuera de Linux)"""
+    try:
+        with open(f"/proc/{os.getpid()}/stat") as f:
+            # El nombre del proceso puede tener espacios, por lo que se cuenta desde el final
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0)
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class StartupProfiler:
+    """Registra cuanto tarda cada etapa del inicio del servidor, desde que se creo el proceso"""
+
+    def __init__(self) -> None:
+        self.origin = perf_counter() - process_age()
+        self.created_at = time() - (perf_counter() - self.origin)
+        self.marks: List[Tuple[str, float]] = []
+
+    def mark(self, stage: str):
+        """Marca el fin de una etapa"""
+        self.marks.append((stage, perf_counter()))
+
+    def elapsed(self) -> float:
+        """Segundos desde que se creo el proceso"""
+        return perf_counter() - self.origin
+
+    def stages(self) -> List[Tuple[str, float, float]]:
+        """[(etapa, duracion, tiempo desde que se creo el proceso)]"""
+        stages = []
+        previous = self.origin
+        for stage, at in self.marks:
+            stages.append((stage, at - previous, at - self.origin))
+            previous = at
+        return stages
+
+    def record(self, metrics):
+        for stage, duration, elapsed in self.stages():
+            metrics.set(f"startup.{stage}_seconds", duration)
+        if self.marks:
+            metrics.set("startup.total_seconds", self.marks[-1][1] - self.origin)
+
+    def report(self) -> str:
+        lines = [f"{'stage':<12} {'ms':>8} {'since start':>12}"]
+        for stage, duration, elapsed in self.stages():
+            lines.append(f"{stage:<12} {duration * 1e3:>8.1f} {elapsed * 1e3:>12.1f}")
+        return "\n".join(lines)
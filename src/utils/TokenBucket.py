@@ -0,0 +1,56 @@
+from threading import Lock
+from time import monotonic
+from typing import Tuple
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe. Se rellena a `rate` tokens por segundo,
+    hasta un maximo de `capacity` tokens. Con rate <= 0 no hay limite.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.last = monotonic()
+        self.lock = Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def __refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def try_acquire(self, tokens: float = 1) -> Tuple[bool, float]:
+        """
+        Intenta consumir tokens. Retorna si se pudo y, si no,
+        cuantos segundos faltan para que haya suficientes
+        """
+        if self.unlimited:
+            return True, 0
+
+        with self.lock:
+            self.__refill(monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True, 0
+            return False, (tokens - self.tokens) / self.rate
+
+    def refund(self, tokens: float = 1):
+        """Devuelve tokens consumidos (e.g. si otro bucket rechazo la operacion)"""
+        if self.unlimited:
+            return
+
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def is_full(self) -> bool:
+        if self.unlimited:
+            return True
+
+        with self.lock:
+            self.__refill(monotonic())
+            return self.tokens >= self.capacity
@@ -1,7 +1,7 @@
 import socket
 import pickle
 from time import sleep
-from typing import Tuple
+from typing import List, Optional, Tuple
 import logging
 from colorama import Fore as Color
 
@@ -16,6 +16,13 @@ def get_public_ip() -> Tuple[str, int]:
     return public_ip, port
 
 
+def free_port(ip: str = "") -> int:
+    """Puerto TCP libre en la ip dada, asignado por el sistema"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((ip, 0))
+        return s.getsockname()[1]
+
+
 def request_server_adrr(dns_host: str, dns_port: int, uri: str) -> str:
     msg = pickle.dumps({"name": "addr_request", "uri": uri})
 
@@ -50,6 +57,54 @@ def request_replica_addr(dns_host: str, dns_port: int, my_addr: str, uri: str) -
                 return response["addr"]
 
 
+def request_replica_addrs(dns_host: str, dns_port: int, my_addr: str, uri: str) -> List[str]:
+    msg = pickle.dumps({"name": "get_replica_addrs", "my_addr": my_addr, "uri": uri})
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.connect((dns_host, dns_port))
+        s.send(msg)
+
+        while True:
+            response = s.recv(4096)
+            response: dict = pickle.loads(response)
+
+            if response["name"] == "get_replica_addrs_response":
+                return response["addrs"]
+
+
+def split_addr(addr: str) -> Tuple[str, int]:
+    """http://ip:port -> (ip, port)"""
+    ip, port = addr.split("://", 1)[-1].rsplit(":", 1)
+    return ip, int(port)
+
+
+def _request(dns_host: str, dns_port: int, msg: dict, response_name: str) -> dict:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.connect((dns_host, dns_port))
+        s.send(pickle.dumps(msg))
+
+        while True:
+            response = s.recv(4096)
+            response: dict = pickle.loads(response)
+
+            if response["name"] == response_name:
+                return response
+
+
+def register_standby(dns_host: str, dns_port: int, uri: str, addr: str):
+    _request(dns_host, dns_port, {"name": "register_standby", "uri": uri, "addr": addr}, "register_standby_response")
+
+
+def claim_standby(dns_host: str, dns_port: int, uri: str) -> Optional[str]:
+    msg = {"name": "claim_standby", "uri": uri}
+    return _request(dns_host, dns_port, msg, "claim_standby_response")["addr"]
+
+
+def request_standbys(dns_host: str, dns_port: int, uri: str) -> List[str]:
+    msg = {"name": "get_standbys", "uri": uri}
+    return _request(dns_host, dns_port, msg, "get_standbys_response")["addrs"]
+
+
 def send_server_addr(dns_host: str, dns_port: int, server_uri: str, server_addr: str) -> str:
     msg = pickle.dumps({"name": "update_server", "addr": server_addr, "uri": server_uri})
 
@@ -1,29 +1,62 @@
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
 from functools import wraps
+from heapq import heappop, heappush
+from itertools import count
 from threading import Lock
+from time import monotonic
 from copy import deepcopy
-from typing import Callable, List
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from .Metrics import Metrics
 
 MESSAGE = "message"
 MESSAGE_COUNT = "message_count"
 SENDER_ID = "sender_id"
 
+MAX_DELAYED = 1024  # delayed messages per sender
+GAP_TIMEOUT = 2.0  # seconds
+MAX_NACKS = 3
+RETRANSMIT_LOG = 1024  # sent messages kept per destination
+
+# Keys of a clock delta (see VectorClock.dump_delta)
+DELTA_NAMES = "n"
+DELTA_SENT = "s"
+DELTA_RECEIVED = "r"
+
 
 def create_with_vector_locks(lock_names: List[str]):
     """
     Decorator that acquires locks with the specified names.
     Used in VectorClock class.
+    Locks are always acquired in the same (sorted) order, so two methods
+    that need overlapping locks can't deadlock, and released in reverse
+    order even if the method raises.
     """
-    lock_names.sort()
+    lock_names = sorted(set(lock_names))
 
     def with_vector_locks(func):
+        if len(lock_names) == 1:
+            # A single lock doesn't need ordering
+            lock_name = lock_names[0]
+
+            @wraps(func)
+            def wrapper(self, *args, **kwargs):
+                with self.locks[lock_name]:
+                    return func(self, *args, **kwargs)
+
+            return wrapper
+
         @wraps(func)
         def wrapper(self, *args, **kwargs):
-            for lock_name in lock_names:
-                self.locks[lock_name].acquire()
-                result = func(self, *args, **kwargs)
-                self.locks[lock_name].release()
-                return result
+            acquired = []
+            try:
+                for lock_name in lock_names:
+                    self.locks[lock_name].acquire()
+                    acquired.append(self.locks[lock_name])
+                return func(self, *args, **kwargs)
+            finally:
+                for lock in reversed(acquired):
+                    lock.release()
 
         return wrapper
 
@@ -37,26 +70,74 @@ class VectorClock:
     that messages from a specific client will have their sending
     order preserved, but there is no such guarantee for messages of
     different clients
+
+    A message that is missing blocks the ones behind it for at most
+    `gap_timeout` seconds. Then the missing messages are requested to
+    the sender via onRequestRetransmit (a NACK), up to `max_nacks` times,
+    and if they still don't arrive they are skipped. They are also skipped
+    if more than `max_delayed` messages of the sender are waiting behind
+    them. Gaps are only checked when a message is received, or when
+    check_gaps is called.
     """
 
-    def __init__(self, idx: str, onDeliverMessage: Callable[[dict], None]) -> None:
+    def __init__(
+        self,
+        idx: str,
+        onDeliverMessage: Callable[[dict], None],
+        onRequestRetransmit: Optional[Callable[[str, List[int]], None]] = None,
+        max_delayed: int = MAX_DELAYED,
+        gap_timeout: float = GAP_TIMEOUT,
+        max_nacks: int = MAX_NACKS,
+        retransmit_log: int = RETRANSMIT_LOG,
+        metrics: Metrics = None,
+    ) -> None:
         self.idx = idx
         # { destination_id: message_count }
         self.sent_messages = defaultdict(lambda: 0)
 
+        # { destination_id: last messages sent } To answer retransmit requests
+        self.sent_log: Dict[str, Deque[dict]] = defaultdict(lambda: deque(maxlen=retransmit_log))
+
         # { sender_id: message_count }
         self.received_messages = defaultdict(lambda: 0)
 
         # Delayed messages
-        self.delayed_messages = []
+        # { sender_id: min-heap of (message_count, arrival, message) }
+        self.delayed_messages: Dict[str, List[Tuple[int, int, dict]]] = defaultdict(list)
+        self.arrivals = count()
+
+        # { sender_id: [first missing message_count, since, nacks sent] }
+        self.gaps: Dict[str, list] = {}
+        self.max_delayed = max_delayed
+        self.gap_timeout = gap_timeout
+        self.max_nacks = max_nacks
+
+        # Counters: vector_clock.gaps, .nacks, .skips, .skipped_messages and .duplicates
+        self.metrics = metrics or Metrics()
 
         # Locks
         lock_names = ["sent_messages", "received_messages", "delayed_messages"]
         self.locks = {x: Lock() for x in lock_names}
 
+        # Delta encoding. Peers are sent as integer ids, local to this clock
+        # { peer name: id } and [ peer name ] by id
+        self.peer_ids: Dict[str, int] = {}
+        self.peer_names: List[str] = []
+        # { (DELTA_SENT | DELTA_RECEIVED, peer name): version } Latest changed last
+        self.changes: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self.version = 0
+        self.changes_lock = Lock()
+        # { peer: [last version sent to it, peer ids it knows] }
+        self.exchanged: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        # { peer: [ peer name ] } The ids used by each peer in the deltas it sent
+        self.remote_names: Dict[str, List[str]] = defaultdict(list)
+
         # Callback when message is delivered
         self.onDeliverMessage = onDeliverMessage
 
+        # Callback with the sender id and the missing message counts to request them again
+        self.onRequestRetransmit = onRequestRetransmit
+
     @create_with_vector_locks(["sent_messages"])
     def send_message(self, message_txt: str, dest_id: str):
         """
@@ -64,6 +145,7 @@ class VectorClock:
         """
         # Increase count of messages sent to the destination
         self.sent_messages[dest_id] += 1
+        self.__changed(DELTA_SENT, dest_id)
 
         message = {
             MESSAGE: message_txt,
@@ -71,21 +153,113 @@ class VectorClock:
             MESSAGE_COUNT: self.sent_messages[dest_id],
             SENDER_ID: self.idx,
         }
+        self.sent_log[dest_id].append(message)
 
         return message
 
+    @create_with_vector_locks(["sent_messages"])
+    def retransmit(self, dest_id: str, message_counts: List[int]) -> List[dict]:
+        """
+        Messages sent to the destination with the requested counts,
+        if they are still in the retransmit log.
+        """
+        log = self.sent_log.get(dest_id)
+        if not log:
+            return []
+
+        first = log[0][MESSAGE_COUNT]
+        return [log[n - first] for n in message_counts if 0 <= n - first < len(log)]
+
     def receive_message(self, message: dict):
         """
         Public method to receive a message. Will execute logic clock algorithm,
         delaying the delivery of a message if previous messages are missing.
+
+        The next message of a sender with nothing delayed (the usual case, e.g.
+        a single sender sending in order) takes a fast path that only holds the
+        received_messages lock and skips the delayed messages and gap checks.
+        It is not lock-free: the deliveries of a sender still have to happen one
+        at a time and in order, which needs the lock.
         """
+        if self.__is_next(message):
+            with self.locks["received_messages"]:
+                # delayed_messages is only changed while holding the received_messages
+                # lock too, so it can be checked again here
+                if self.__is_next(message):
+                    self.__deliver_message(message)
+                    return
+
+        self.__receive(message)
+
+    def __is_next(self, message: dict) -> bool:
+        """If the message is the next one of its sender, and none of the sender's messages is delayed"""
+        sender_id = message[SENDER_ID]
+        return (
+            message[MESSAGE_COUNT] == self.received_messages.get(sender_id, 0) + 1
+            and sender_id not in self.delayed_messages
+        )
+
+    @create_with_vector_locks(["received_messages", "delayed_messages"])
+    def __receive(self, message: dict):
+        sender_id = message[SENDER_ID]
+        if message[MESSAGE_COUNT] <= self.received_messages[sender_id]:
+            # Already delivered (e.g. a retransmission) or skipped
+            self.metrics.incr("vector_clock.duplicates")
+            return
+
         if self.__should_delay_message(message):
-            self.delayed_messages.append(message)
+            heappush(self.delayed_messages[sender_id], (message[MESSAGE_COUNT], next(self.arrivals), message))
         else:
             self.__deliver_message(message)
-            self.__check_delayed_messages()
+            self.__check_delayed_messages(sender_id)
+
+        self.__check_gap(sender_id, monotonic())
+
+    @create_with_vector_locks(["received_messages", "delayed_messages"])
+    def check_gaps(self):
+        """
+        Requests or skips the missing messages of every sender whose gap
+        timed out. Should be called periodically if messages can stop arriving.
+        """
+        now = monotonic()
+        for sender_id in list(self.delayed_messages):
+            self.__check_gap(sender_id, now)
+
+    def __check_gap(self, sender_id: str, now: float):
+        """
+        Keeps track of the missing messages that block the delayed messages
+        of a sender, sending a NACK or skipping them when the gap times out.
+        """
+        while True:
+            delayed = self.delayed_messages.get(sender_id)
+            if not delayed:
+                self.gaps.pop(sender_id, None)
+                return
+
+            expected = self.received_messages[sender_id] + 1
+            gap = self.gaps.get(sender_id)
+            if gap is None or gap[0] != expected:
+                gap = self.gaps[sender_id] = [expected, now, 0]
+                self.metrics.incr("vector_clock.gaps")
+
+            if len(delayed) <= self.max_delayed:
+                if now - gap[1] < self.gap_timeout:
+                    return
+
+                if self.onRequestRetransmit and gap[2] < self.max_nacks:
+                    gap[1] = now
+                    gap[2] += 1
+                    self.metrics.incr("vector_clock.nacks")
+                    self.onRequestRetransmit(sender_id, list(range(expected, delayed[0][0])))
+                    return
+
+            # The missing messages are given up, and the ones behind them can be delivered
+            self.received_messages[sender_id] = delayed[0][0] - 1
+            self.__changed(DELTA_RECEIVED, sender_id)
+            self.metrics.incr("vector_clock.skips")
+            self.metrics.incr("vector_clock.skipped_messages", delayed[0][0] - expected)
+            self.__check_delayed_messages(sender_id)
 
-    @create_with_vector_locks(["received_messages"])
     def __should_delay_message(self, message: dict) -> bool:
         """
         Checks if a message should be delayed. This should happen if a
@@ -100,7 +274,6 @@ class VectorClock:
         # predate this one.
         return message_count - 1 > self.received_messages[sender_id]
 
-    @create_with_vector_locks(["received_messages"])
     def __deliver_message(self, message: dict):
         """
         Executes the delivery of a message via the onDeliverMessage callback.
@@ -110,35 +283,97 @@ class VectorClock:
         self.received_messages[sender_id] = max(
             message[MESSAGE_COUNT], self.received_messages[sender_id] + 1
         )
+        self.__changed(DELTA_RECEIVED, sender_id)
         self.onDeliverMessage(message)
 
-    @create_with_vector_locks(["delayed_messages"])
-    def __check_delayed_messages(self):
+    def __check_delayed_messages(self, sender_id: str):
         """
-        Checks if a delayed message should now be delivered. Does this
-        untill no more messages can be delivered.
+        Delivers the delayed messages of a sender that are now in order.
+        Only the earliest message of the sender has to be checked each time,
+        so a run of k messages is delivered in O(k log n).
         """
-        message_delivered = True
-
-        while message_delivered:
-            message_delivered = False
-            for i, message in enumerate(self.delayed_messages):
-                if self.__should_delay_message(message):
-                    continue
+        delayed = self.delayed_messages[sender_id]
+        while delayed and not self.__should_delay_message(delayed[0][2]):
+            message_count, _, message = heappop(delayed)
+            if message_count <= self.received_messages[sender_id]:
+                self.metrics.incr("vector_clock.duplicates")
+                continue
+            self.__deliver_message(message)
 
-                self.delayed_messages.pop(i)
-                self.__deliver_message(message)
-                message_delivered = True
-                break
+        if not delayed:
+            del self.delayed_messages[sender_id]
 
+    @create_with_vector_locks(["sent_messages", "received_messages"])
     def load_from(self, sent_messages: dict, received_messages: dict):
         self.sent_messages.update(sent_messages)
         self.received_messages.update(received_messages)
+        for peer in sent_messages:
+            self.__changed(DELTA_SENT, peer)
+        for peer in received_messages:
+            self.__changed(DELTA_RECEIVED, peer)
         return self
 
+    @create_with_vector_locks(["sent_messages", "received_messages"])
     def dump(self):
         return [dict(self.sent_messages), dict(self.received_messages)]
 
+    def __changed(self, kind: str, peer: str):
+        """Records that an entry of the clock changed, for the next deltas"""
+        with self.changes_lock:
+            if peer not in self.peer_ids:
+                self.peer_ids[peer] = len(self.peer_names)
+                self.peer_names.append(peer)
+            self.version += 1
+            self.changes.pop((kind, peer), None)
+            self.changes[(kind, peer)] = self.version
+
+    @create_with_vector_locks(["sent_messages", "received_messages"])
+    def dump_delta(self, peer: str) -> dict:
+        """
+        Like dump, but only with the entries that changed since the last
+        delta sent to the peer, assuming it received every previous delta:
+            {
+                DELTA_NAMES: [first id, [peer name, ...]],  # Ids the peer doesn't know yet
+                DELTA_SENT: [peer id, message_count, ...],
+                DELTA_RECEIVED: [peer id, message_count, ...],
+            }
+        Each key is only present if it has entries.
+        """
+        with self.changes_lock:
+            exchanged = self.exchanged[peer]
+            changed = {DELTA_SENT: [], DELTA_RECEIVED: []}
+            for key in reversed(self.changes):
+                if self.changes[key] <= exchanged[0]:
+                    break
+                changed[key[0]].append(key[1])
+
+            delta = {}
+            if exchanged[1] < len(self.peer_names):
+                delta[DELTA_NAMES] = [exchanged[1], self.peer_names[exchanged[1] :]]
+            for kind, values in ((DELTA_SENT, self.sent_messages), (DELTA_RECEIVED, self.received_messages)):
+                if changed[kind]:
+                    delta[kind] = [n for name in changed[kind] for n in (self.peer_ids[name], values[name])]
+
+            exchanged[0] = self.version
+            exchanged[1] = len(self.peer_names)
+            return delta
+
+    @create_with_vector_locks(["sent_messages", "received_messages"])
+    def load_delta(self, peer: str, delta: dict):
+        """Applies a delta sent by the peer with dump_delta, like load_from"""
+        names = self.remote_names[peer]
+        if DELTA_NAMES in delta:
+            first, new_names = delta[DELTA_NAMES]
+            names[first:] = new_names
+
+        for kind, values in ((DELTA_SENT, self.sent_messages), (DELTA_RECEIVED, self.received_messages)):
+            entries = delta.get(kind, [])
+            for i in range(0, len(entries), 2):
+                name = names[entries[i]]
+                values[name] = entries[i + 1]
+                self.__changed(kind, name)
+        return self
+
 
 if __name__ == "__main__":
 
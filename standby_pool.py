@@ -0,0 +1,22 @@
+import logging
+import socket
+from argparse import ArgumentParser
+
+from src.server.StandbyPool import StandbyPool
+from src.utils.networking import get_public_ip
+
+logging.basicConfig(level=logging.INFO)
+
+parser = ArgumentParser()
+parser.add_argument("--dns_ip", default=socket.gethostbyname(socket.gethostname()), help="Domain name server ip")
+parser.add_argument("--dns_port", default=8000, help="Domain name server port", type=int)
+parser.add_argument("-u", "--server_uri", default="backend.com", help="Server URI", type=str)
+parser.add_argument("--server_ip", help="Optional. Ip of the standby servers", type=str, default=None)
+parser.add_argument("-s", "--size", help="Number of idle standby servers to keep", type=int, default=1)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    server_ip = args.server_ip or get_public_ip()[0]
+    pool = StandbyPool(args.dns_ip, args.dns_port, args.server_uri, server_ip, args.size)
+    pool.run()